@@ -0,0 +1,267 @@
+import threading
+from decimal import Decimal
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+# Sales are pulled into memory in batches of this many rows
+ANALYTICS_BATCH_SIZE = 50000
+# A sale can commit after one with a higher sale_id is already visible (its
+# transaction took the id first). Every refresh reads this many ids below the
+# high-water mark again so such late sales are not missed.
+REFRESH_OVERLAP = 1000
+# Baskets with more units than this share the histogram's last bucket
+BASKET_HISTOGRAM_MAX = 20
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+# Archived sales are part of the history; a sale is in exactly one of the
+# two tables, and past the first load the archive side is an empty range
+SALES_COLUMNS_QUERY = """
+    SELECT sale_id, sale_date, customer_id, seller_id, total_amount FROM Sales WHERE sale_id > %s
+    UNION ALL
+    SELECT sale_id, sale_date, customer_id, seller_id, total_amount FROM Sales_Archive WHERE sale_id > %s
+    ORDER BY sale_id
+"""
+# Bounded by the last sale read, so every item belongs to a cached sale
+ITEMS_COLUMNS_QUERY = """
+    SELECT sale_id, product_id, quantity, unit_price FROM Sale_Items WHERE sale_id > %s AND sale_id <= %s
+    UNION ALL
+    SELECT sale_id, product_id, quantity, unit_price FROM Sale_Items_Archive WHERE sale_id > %s AND sale_id <= %s
+    ORDER BY sale_id
+"""
+
+
+class ProductRank(NamedTuple):
+    product_id: int
+    name: Optional[str]
+    quantity: int
+    revenue: Decimal
+
+
+class SellerRank(NamedTuple):
+    seller_id: int
+    name: Optional[str]
+    sale_count: int
+    items_sold: int
+    revenue: Decimal
+
+
+class BasketStats(NamedTuple):
+    sales: int
+    mean_units: float
+    # (50th, 90th, 99th) percentiles
+    units: tuple
+    totals: tuple
+    # Number of sales with 0, 1, ... BASKET_HISTOGRAM_MAX or more units
+    histogram: List[int]
+
+
+class Heatmap(NamedTuple):
+    # 7 x 24 lists indexed [weekday][hour], Monday first
+    sale_count: List[List[int]]
+    revenue: List[List[Decimal]]
+
+
+def cents(values):
+    # DECIMAL amounts to exact int64 cents; a double holds any amount up to
+    # 2**53 cents exactly, so going through float64 loses nothing
+    return np.rint(np.array(values, dtype=np.float64) * 100).astype(np.int64)
+
+
+def money(value):
+    return (Decimal(int(value)) / 100).quantize(Decimal("0.01"))
+
+
+def group_sum(keys, *values):
+    # (unique keys, one exact int64 sum per values array for each key)
+    if not len(keys):
+        return keys, [np.zeros(0, np.int64) for _ in values]
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+    return keys[starts], [np.add.reduceat(np.asarray(column, np.int64)[order], starts) for column in values]
+
+
+def top(values, n):
+    # Indexes of the n largest values, largest first
+    if len(values) > n:
+        candidates = np.argpartition(-values, n)[:n]
+    else:
+        candidates = np.arange(len(values))
+    return candidates[np.argsort(-values[candidates], kind="stable")]
+
+
+class SalesColumns:
+    # Sales and Sale_Items as parallel arrays, both ordered by sale_id. Never
+    # changed once built; a refresh builds a new one, so readers on other
+    # threads can keep using the one they hold.
+    def __init__(self, sales=None, items=None):
+        sales = sales or {}
+        items = items or {}
+        self.sale_id = sales.get("sale_id", np.zeros(0, np.int32))
+        self.sale_date = sales.get("sale_date", np.zeros(0, "datetime64[s]"))
+        self.customer_id = sales.get("customer_id", np.zeros(0, np.int32))
+        self.seller_id = sales.get("seller_id", np.zeros(0, np.int32))
+        self.total_cents = sales.get("total_cents", np.zeros(0, np.int64))
+        self.item_sale_id = items.get("sale_id", np.zeros(0, np.int32))
+        self.item_product_id = items.get("product_id", np.zeros(0, np.int32))
+        self.item_quantity = items.get("quantity", np.zeros(0, np.int32))
+        self.item_price_cents = items.get("price_cents", np.zeros(0, np.int64))
+        # Position of each item's sale in the sales arrays
+        self.item_sale = np.searchsorted(self.sale_id, self.item_sale_id)
+        self.sale_units = np.bincount(self.item_sale, weights=self.item_quantity,
+                                      minlength=len(self.sale_id)).astype(np.int64)
+
+    @property
+    def high_water(self):
+        return int(self.sale_id[-1]) if len(self.sale_id) else 0
+
+    def sales_arrays(self):
+        return {"sale_id": self.sale_id, "sale_date": self.sale_date, "customer_id": self.customer_id,
+                "seller_id": self.seller_id, "total_cents": self.total_cents}
+
+    def items_arrays(self):
+        return {"sale_id": self.item_sale_id, "product_id": self.item_product_id,
+                "quantity": self.item_quantity, "price_cents": self.item_price_cents}
+
+    def nbytes(self):
+        return sum(array.nbytes for array in (*self.sales_arrays().values(), *self.items_arrays().values()))
+
+    def sale_mask(self, from_date=None, to_date=None):
+        # Same bounds as the sales list: dates compare as midnight, so a bare
+        # to_date stops at the start of that day
+        mask = np.ones(len(self.sale_id), bool)
+        if from_date:
+            mask &= self.sale_date >= np.datetime64(from_date, "s")
+        if to_date:
+            mask &= self.sale_date <= np.datetime64(to_date, "s")
+        return mask
+
+
+def sales_batch(rows):
+    sale_id, sale_date, customer_id, seller_id, total_amount = zip(*rows)
+    return {
+        "sale_id": np.array(sale_id, np.int32),
+        "sale_date": np.array(sale_date, "datetime64[s]"),
+        # Sales whose customer or seller was removed count as 0, as in the rollups
+        "customer_id": np.array([value or 0 for value in customer_id], np.int32),
+        "seller_id": np.array([value or 0 for value in seller_id], np.int32),
+        "total_cents": cents(total_amount),
+    }
+
+
+def items_batch(rows):
+    sale_id, product_id, quantity, unit_price = zip(*rows)
+    return {
+        "sale_id": np.array(sale_id, np.int32),
+        "product_id": np.array(product_id, np.int32),
+        "quantity": np.array(quantity, np.int32),
+        "price_cents": cents(unit_price),
+    }
+
+
+def only_sales(batch, sale_ids):
+    # The rows of an items batch that belong to one of sale_ids
+    keep = np.isin(batch["sale_id"], sale_ids)
+    return {name: array[keep] for name, array in batch.items()}
+
+
+def concat(kept, batches):
+    # kept: arrays already cached; batches: new arrays read from the database
+    return {name: np.concatenate([array] + [batch[name] for batch in batches]) for name, array in kept.items()}
+
+
+class SalesAnalytics:
+    # Reports over the whole sales history computed in memory with NumPy
+    # instead of row by row in Python. The first report loads every sale;
+    # later ones only read the sales added since, by sale_id.
+    def __init__(self, service, batch_size=ANALYTICS_BATCH_SIZE):
+        self.service = service
+        self.batch_size = batch_size
+        self.columns = SalesColumns()
+        self.lock = threading.Lock()
+
+    def refresh(self) -> SalesColumns:
+        with self.lock:
+            columns = self.columns
+            since = max(columns.high_water - REFRESH_OVERLAP, 0)
+            sales = [sales_batch(rows) for rows in self.service.stream(SALES_COLUMNS_QUERY, (since, since),
+                                                                       batch_size=self.batch_size)]
+            if not sales:
+                return columns
+            last = int(sales[-1]["sale_id"][-1])
+            keep = np.searchsorted(columns.sale_id, since, side="right")
+            read = sum(len(batch["sale_id"]) for batch in sales)
+            if last == columns.high_water and read == len(columns.sale_id) - keep:
+                # Only the overlap came back, unchanged
+                return columns
+            items = [items_batch(rows) for rows in self.service.stream(ITEMS_COLUMNS_QUERY, (since, last) * 2,
+                                                                       batch_size=self.batch_size)]
+            # A sale that committed between the two reads has items but no
+            # sale row here; searchsorted would hand its items to a
+            # neighbouring sale. Drop them; the next refresh reads the
+            # overlap again and picks the sale up whole.
+            loaded = np.concatenate([batch["sale_id"] for batch in sales])
+            items = [only_sales(batch, loaded) for batch in items]
+            # Drop the overlap that was read again before appending it
+            keep_items = np.searchsorted(columns.item_sale_id, since, side="right")
+            self.columns = SalesColumns(
+                concat({name: array[:keep] for name, array in columns.sales_arrays().items()}, sales),
+                concat({name: array[:keep_items] for name, array in columns.items_arrays().items()}, items))
+            return self.columns
+
+    def names(self, query, ids):
+        if not len(ids):
+            return {}
+        placeholders = ", ".join(["%s"] * len(ids))
+        return dict(self.service.fetch_all(f"{query} IN ({placeholders})", [int(value) for value in ids]))
+
+    def top_products(self, n=10, by="revenue", from_date=None, to_date=None) -> List[ProductRank]:
+        columns = self.refresh()
+        mask = columns.sale_mask(from_date, to_date)[columns.item_sale]
+        quantity = columns.item_quantity[mask]
+        products, (units, revenue) = group_sum(columns.item_product_id[mask], quantity,
+                                               quantity.astype(np.int64) * columns.item_price_cents[mask])
+        ranked = top(units if by == "quantity" else revenue, n)
+        names = self.names("SELECT product_id, product_name FROM Products WHERE product_id", products[ranked])
+        return [ProductRank(int(products[i]), names.get(int(products[i])), int(units[i]), money(revenue[i]))
+                for i in ranked]
+
+    def seller_leaderboard(self, n=10, from_date=None, to_date=None) -> List[SellerRank]:
+        columns = self.refresh()
+        mask = columns.sale_mask(from_date, to_date)
+        sellers, (sale_count, units, revenue) = group_sum(
+            columns.seller_id[mask], np.ones(int(mask.sum()), np.int64), columns.sale_units[mask],
+            columns.total_cents[mask])
+        ranked = top(revenue, n)
+        names = self.names("SELECT seller_id, seller_name FROM Sellers WHERE seller_id", sellers[ranked])
+        return [SellerRank(int(sellers[i]), names.get(int(sellers[i])), int(sale_count[i]), int(units[i]),
+                           money(revenue[i])) for i in ranked]
+
+    def basket_sizes(self, from_date=None, to_date=None) -> BasketStats:
+        columns = self.refresh()
+        mask = columns.sale_mask(from_date, to_date)
+        units = columns.sale_units[mask]
+        if not len(units):
+            return BasketStats(0, 0.0, (0, 0, 0), (money(0),) * 3, [0] * (BASKET_HISTOGRAM_MAX + 1))
+        histogram = np.bincount(np.minimum(units, BASKET_HISTOGRAM_MAX), minlength=BASKET_HISTOGRAM_MAX + 1)
+        return BasketStats(
+            len(units), float(units.mean()),
+            tuple(int(value) for value in np.percentile(units, (50, 90, 99), method="higher")),
+            tuple(money(value) for value in np.percentile(columns.total_cents[mask], (50, 90, 99), method="higher")),
+            histogram.tolist())
+
+    def hour_heatmap(self, from_date=None, to_date=None) -> Heatmap:
+        columns = self.refresh()
+        mask = columns.sale_mask(from_date, to_date)
+        dates = columns.sale_date[mask]
+        days = dates.astype("datetime64[D]")
+        # 1970-01-01 was a Thursday
+        weekday = (days.astype(np.int64) + 3) % 7
+        hour = (dates - days).astype("timedelta64[h]").astype(np.int64)
+        cell = weekday * 24 + hour
+        count = np.bincount(cell, minlength=7 * 24).reshape(7, 24)
+        cells, (revenue,) = group_sum(cell, columns.total_cents[mask])
+        revenue_grid = np.zeros(7 * 24, np.int64)
+        revenue_grid[cells] = revenue
+        return Heatmap(count.tolist(), [[money(value) for value in row] for row in revenue_grid.reshape(7, 24)])
@@ -0,0 +1,160 @@
+from datetime import date
+
+# Months of empty Sales partitions kept ready ahead of the current one
+PARTITION_MONTHS_AHEAD = 3
+
+SALE_COLUMNS = ("sale_id, customer_id, seller_id, sale_date, total_amount, discount_amount, tax_amount, "
+                "terminal_id, idempotency_key")
+SALE_ITEM_COLUMNS = "item_id, sale_id, product_id, quantity, unit_price"
+
+# The whole history as one table, for the rare jobs that need all of it
+SALES_HISTORY = f"(SELECT {SALE_COLUMNS} FROM Sales UNION ALL SELECT {SALE_COLUMNS} FROM Sales_Archive)"
+SALE_ITEMS_HISTORY = (f"(SELECT {SALE_ITEM_COLUMNS} FROM Sale_Items"
+                      f" UNION ALL SELECT {SALE_ITEM_COLUMNS} FROM Sale_Items_Archive)")
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def archive_horizon(cursor):
+    # Sales dated before this may be in the archive tables; None when
+    # nothing has been archived
+    cursor.execute("SELECT MAX(month) FROM sales_archive_periods")
+    month = cursor.fetchone()[0]
+    if month is None:
+        return None
+    if isinstance(month, str):
+        month = date.fromisoformat(month)
+    return next_month(month)
+
+
+def reaches_archive(horizon, from_date):
+    # Whether a report starting at from_date needs the archive tables. Dates
+    # arrive as date objects or as the ISO strings typed into the filters,
+    # and ISO text compares in date order.
+    return horizon is not None and (not from_date or str(from_date) < horizon.isoformat())
+
+
+def archive_month(db, month):
+    # Moves one month of sales and their items into the archive tables in
+    # a single transaction, so a report sees each sale in exactly one place.
+    # Running it again for the same month moves sales that arrived late,
+    # e.g. from a till's journal. Returns (sales, items) moved.
+    end = next_month(month)
+    with db.cursor() as cursor:
+        cursor.execute(cursor.dialect.begin)
+        in_month = "SELECT sale_id FROM Sales WHERE sale_date >= %s AND sale_date < %s"
+        cursor.execute(f"""
+            INSERT INTO Sale_Items_Archive ({SALE_ITEM_COLUMNS})
+            SELECT {SALE_ITEM_COLUMNS} FROM Sale_Items WHERE sale_id IN ({in_month})
+        """, (month, end))
+        items = cursor.rowcount
+        cursor.execute(f"""
+            INSERT INTO Sales_Archive ({SALE_COLUMNS})
+            SELECT {SALE_COLUMNS} FROM Sales WHERE sale_date >= %s AND sale_date < %s
+        """, (month, end))
+        sales = cursor.rowcount
+        if sales:
+            cursor.execute(f"DELETE FROM Sale_Items WHERE sale_id IN ({in_month})", (month, end))
+            cursor.execute("DELETE FROM Sales WHERE sale_date >= %s AND sale_date < %s", (month, end))
+        cursor.execute(cursor.dialect.upsert(
+            "sales_archive_periods", ("month", "sale_count", "item_count", "archived_at"), ("month",),
+            {"sale_count": "sale_count + {new}", "item_count": "item_count + {new}", "archived_at": "{new}"}
+        ), (month, sales, items, date.today()))
+    db.commit()
+    return sales, items
+
+
+def months_to_archive(cursor, before):
+    # Months with sales dated before `before`, oldest first
+    cursor.execute("SELECT MIN(sale_date) FROM Sales WHERE sale_date < %s", (before,))
+    oldest = cursor.fetchone()[0]
+    months = []
+    if oldest is not None:
+        month = month_start(date.fromisoformat(oldest[:10]) if isinstance(oldest, str) else oldest)
+        while month < before:
+            months.append(month)
+            month = next_month(month)
+    return months
+
+
+# MySQL range partitioning of Sales by month
+
+def sales_partitions(cursor):
+    # {partition name: upper bound as written in the table definition};
+    # empty while Sales is not partitioned
+    cursor.execute("""
+        SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'Sales' AND PARTITION_NAME IS NOT NULL
+    """)
+    return dict(cursor.fetchall())
+
+
+def partition_clause(months):
+    return ", ".join(f"PARTITION p{month:%Y%m} VALUES LESS THAN ('{next_month(month)}')" for month in months)
+
+
+def partition_sales(cursor, months_ahead=PARTITION_MONTHS_AHEAD):
+    # Partitions Sales by RANGE COLUMNS (sale_date), one partition a month,
+    # so queries filtered on sale_date only read the months they cover.
+    # The first run rebuilds the table; later runs only split the catch-all
+    # partition to keep months_ahead empty months ready. Returns the
+    # partitions added.
+    #
+    # MySQL requires the partitioning column in every unique key and does
+    # not allow foreign keys to or from a partitioned table, so the key
+    # becomes (sale_id, sale_date), the idempotency key is unique per sale
+    # date (a replayed sale keeps its date), and the foreign keys on Sales
+    # and Sale_Items.sale_id are dropped. Sale_Items is not partitioned: it
+    # is read by sale_id, which a date range does not bound.
+    last = month_start(date.today())
+    for _ in range(months_ahead):
+        last = next_month(last)
+    partitions = sales_partitions(cursor)
+    if partitions:
+        # The newest monthly partition ends where the next month starts
+        month = max(date.fromisoformat(bound.strip("'")[:10])
+                    for name, bound in partitions.items() if name != "p_future")
+        months = []
+        while month <= last:
+            months.append(month)
+            month = next_month(month)
+        if months:
+            cursor.execute(f"""
+                ALTER TABLE Sales REORGANIZE PARTITION p_future INTO (
+                    {partition_clause(months)}, PARTITION p_future VALUES LESS THAN (MAXVALUE))
+            """)
+        return len(months)
+
+    cursor.execute("""
+        SELECT CONSTRAINT_NAME, TABLE_NAME FROM information_schema.REFERENTIAL_CONSTRAINTS
+        WHERE CONSTRAINT_SCHEMA = DATABASE() AND (TABLE_NAME = 'Sales' OR REFERENCED_TABLE_NAME = 'Sales')
+    """)
+    for name, table in cursor.fetchall():
+        cursor.execute(f"ALTER TABLE {table} DROP FOREIGN KEY {name}")
+    cursor.execute("""
+        ALTER TABLE Sales
+            MODIFY sale_date DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            DROP PRIMARY KEY, ADD PRIMARY KEY (sale_id, sale_date),
+            DROP INDEX unique_sales_idempotency_key,
+            ADD UNIQUE INDEX unique_sales_idempotency_key (idempotency_key, sale_date)
+    """)
+    cursor.execute("SELECT MIN(sale_date) FROM Sales")
+    oldest = cursor.fetchone()[0]
+    month = month_start(oldest or date.today())
+    months = []
+    while month <= last:
+        months.append(month)
+        month = next_month(month)
+    cursor.execute(f"""
+        ALTER TABLE Sales PARTITION BY RANGE COLUMNS (sale_date) (
+            PARTITION p_past VALUES LESS THAN ('{months[0]}'),
+            {partition_clause(months)},
+            PARTITION p_future VALUES LESS THAN (MAXVALUE))
+    """)
+    return len(months)
@@ -0,0 +1,695 @@
+import argparse
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from cart import Cart, to_money
+from catalog import ProductCatalog
+from db import BACKEND, DB_CONFIG, MySQLBackend, SQLiteBackend
+from ledger import adjust_stock, ledger_drift, record_opening_balances
+from migrations import migrate
+from query_stats import QUERY_STATS
+from reservations import InsufficientStockError, new_session_id
+from rollups import PERIODS, rebuild_rollups
+from store_service import SaleLine, StoreService, sales_count_query, sales_filters, sales_page_query
+
+BENCH_DATABASE = "store_management_bench"
+BATCH_SIZE = 10000
+SELLERS = 50
+CUSTOMERS = 10000
+PRODUCTS = 2000
+HISTORY_DAYS = 730
+# Generated history ends on a fixed day so the same seed always produces the
+# same rows, and reports over it stay comparable between runs
+HISTORY_END = datetime(2025, 1, 1)
+INITIAL_STOCK = 1000000
+
+REPORT_INDEXES = ("idx_sales_date", "idx_sales_customer_date", "idx_sales_seller_date")
+REPORT_RANGES = [("1 day", 1), ("1 week", 7), ("1 month", 30), ("1 quarter", 91)]
+
+# Restocks all hit this many products so the threads contend for rows
+RESTOCK_HOT_PRODUCTS = 10
+# Simulated terminals sell from this many products, so their carts overlap
+# and their sale transactions wait on each other's inventory row locks
+TERMINAL_HOT_PRODUCTS = 20
+# The oversell scenario lets every terminal fight over this little stock of
+# a few products, so the stock guard decides most sales
+OVERSELL_PRODUCTS = 3
+OVERSELL_STOCK = 10
+# Checkout carts mix these so rounding of discounts and tax is exercised
+CHECKOUT_TAX_RATES = ("0", "0.0725", "0.2")
+CHECKOUT_DISCOUNTS = ("", "", "1.50", "10%", "33.3%")
+
+SCENARIOS = ("reports", "scans", "checkout", "restock", "catalog", "analytics", "terminals", "oversell")
+
+
+class Results:
+    # Flat list of measurements, keyed by (scenario, metric) so that runs can
+    # be compared with --compare
+    def __init__(self):
+        self.rows = []
+
+    def add(self, scenario, metric, value, unit, better="lower"):
+        self.rows.append({"scenario": scenario, "metric": metric, "value": round(value, 3),
+                          "unit": unit, "better": better})
+
+    def write(self, path, meta):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "results": self.rows}, f, indent=2)
+
+    def compare(self, path):
+        with open(path, encoding="utf-8") as f:
+            baseline = {(row["scenario"], row["metric"]): row for row in json.load(f)["results"]}
+        print(f"\nCompared with {path}")
+        print(f"{'scenario':<10} {'metric':<32} {'baseline':>12} {'current':>12} {'change':>9}")
+        for row in self.rows:
+            before = baseline.get((row["scenario"], row["metric"]))
+            if before is None or not before["value"]:
+                continue
+            change = (row["value"] - before["value"]) / before["value"] * 100
+            worse = change > 0 if row["better"] == "lower" else change < 0
+            print(f"{row['scenario']:<10} {row['metric']:<32} {before['value']:>12.3f} {row['value']:>12.3f}"
+                  f" {change:>+8.1f}%{'  worse' if worse and abs(change) >= 10 else ''}")
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def run_meta(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "backend": args.backend,
+        "database": args.database,
+        "sales": args.sales,
+        "products": args.products,
+        "customers": args.customers,
+        "sellers": args.sellers,
+        "seed": args.seed,
+        "threads": args.threads,
+        "terminals": args.terminals,
+        "repeat": args.repeat,
+    }
+
+
+def open_backend(kind, database, pool_size=1):
+    if kind == "sqlite":
+        return SQLiteBackend(f"{database}.db")
+    import mysql.connector
+
+    config = {key: value for key, value in DB_CONFIG.items() if key != "database"}
+    server = mysql.connector.connect(**config)
+    try:
+        with server.cursor() as cursor:
+            cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{database}`")
+    finally:
+        server.close()
+    return MySQLBackend(dict(config, database=database), pool_size=pool_size, pool_name="stormanag_bench")
+
+
+def populate(db, sales, seed, products=PRODUCTS, customers=CUSTOMERS, sellers=SELLERS):
+    # Deterministic for a given seed and scale; rerunning with more sales
+    # only adds the missing ones
+    rng = random.Random(seed)
+    with db.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*), COALESCE(MAX(sale_id), 0) FROM Sales")
+        existing, last_id = cursor.fetchone()
+        if existing >= sales:
+            return
+
+        insert_ignore = cursor.dialect.insert_ignore
+        cursor.execute(cursor.dialect.begin)
+        cursor.executemany(f"{insert_ignore} INTO Sellers (seller_name, contact_number) VALUES (%s, %s)",
+                           [(f"Seller {i}", f"555{i:07d}") for i in range(sellers)])
+        cursor.executemany(f"{insert_ignore} INTO Customers (customer_name, contact_number) VALUES (%s, %s)",
+                           [(f"Customer {i}", f"556{i:07d}") for i in range(customers)])
+        cursor.executemany(f"{insert_ignore} INTO Products (product_name, price, category) VALUES (%s, %s, %s)",
+                           [(f"Product {i}", Decimal(rng.randint(100, 10000)) / 100, f"Category {i % 20}")
+                            for i in range(products)])
+        db.commit()
+
+        cursor.execute("SELECT seller_id FROM Sellers ORDER BY seller_id")
+        seller_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT customer_id FROM Customers ORDER BY customer_id")
+        customer_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT product_id, price FROM Products ORDER BY product_id")
+        catalog = cursor.fetchall()
+
+        cursor.execute(cursor.dialect.begin)
+        cursor.executemany(f"""
+            {insert_ignore} INTO Inventory (product_id, quantity, last_restocked) VALUES (%s, %s, %s)
+        """, [(product_id, INITIAL_STOCK, HISTORY_END.date()) for product_id, _ in catalog])
+        db.commit()
+
+        start = HISTORY_END - timedelta(days=HISTORY_DAYS)
+        # sale_ids are assigned here so line items can reference them without
+        # reading back auto-increment values
+        next_id = last_id + 1
+        remaining = sales - existing
+        while remaining > 0:
+            batch = min(BATCH_SIZE, remaining)
+            sale_rows = []
+            item_rows = []
+            for sale_id in range(next_id, next_id + batch):
+                sale_date = start + timedelta(seconds=rng.randrange(HISTORY_DAYS * 86400))
+                total = Decimal("0.00")
+                for product_id, price in rng.sample(catalog, rng.randint(1, 5)):
+                    quantity = rng.randint(1, 4)
+                    total += price * quantity
+                    item_rows.append((sale_id, product_id, quantity, price))
+                sale_rows.append((sale_id, rng.choice(customer_ids), rng.choice(seller_ids), sale_date, total))
+            cursor.execute(cursor.dialect.begin)
+            cursor.executemany("""
+                INSERT INTO Sales (sale_id, customer_id, seller_id, sale_date, total_amount)
+                VALUES (%s, %s, %s, %s, %s)
+            """, sale_rows)
+            cursor.executemany("""
+                INSERT INTO Sale_Items (sale_id, product_id, quantity, unit_price)
+                VALUES (%s, %s, %s, %s)
+            """, item_rows)
+            db.commit()
+            next_id += batch
+            remaining -= batch
+            print(f"  generated {sales - remaining}/{sales} sales")
+
+        print("  rebuilding rollups")
+        cursor.execute(cursor.dialect.begin)
+        rebuild_rollups(cursor)
+    db.commit()
+
+
+def time_query(cursor, query, params, repeat):
+    timings = []
+    for _ in range(repeat + 1):
+        started = time.perf_counter()
+        cursor.execute(query, params)
+        cursor.fetchall()
+        timings.append(time.perf_counter() - started)
+    # The first run only warms the buffer pool
+    return statistics.median(timings[1:]) * 1000
+
+
+def timed(job, repeat):
+    # Median of `repeat` runs after one warm-up run
+    timings = []
+    for _ in range(repeat + 1):
+        started = time.perf_counter()
+        job()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings[1:]) * 1000
+
+
+def without_report_indexes(dialect, query):
+    return query.replace("FROM Sales s", f"FROM Sales {dialect.ignore_indexes('s', REPORT_INDEXES)}", 1)
+
+
+def bench_reports(backend, args, results):
+    # Date-range reports over the generated history: the paged sales report
+    # with and without its indexes, then the rollup totals
+    end = HISTORY_END
+    with backend.connection() as db, db.cursor() as cursor:
+        print(f"{'range':<10} {'query':<6} {'before ms':>10} {'after ms':>10}")
+        for label, days in REPORT_RANGES:
+            filters = sales_filters(end - timedelta(days=days), end)
+            for name, (query, params) in (("page", sales_page_query(filters)), ("count", sales_count_query(filters))):
+                before = time_query(cursor, without_report_indexes(cursor.dialect, query), params, args.repeat)
+                after = time_query(cursor, query, params, args.repeat)
+                print(f"{label:<10} {name:<6} {before:>10.1f} {after:>10.1f}")
+                results.add("reports", f"{label} {name} no index", before, "ms")
+                results.add("reports", f"{label} {name}", after, "ms")
+
+    service = StoreService(backend)
+    start = (end - timedelta(days=365)).date()
+    print(f"{'period':<10} {'totals ms':>10}")
+    for period in PERIODS:
+        elapsed = timed(lambda: service.sales_totals(period, "All", start, end.date()), args.repeat)
+        print(f"{period:<10} {elapsed:>10.1f}")
+        results.add("reports", f"1 year totals by {period}", elapsed, "ms")
+
+
+def assign_codes(db):
+    with db.cursor() as cursor:
+        cursor.execute("SELECT product_id FROM Products WHERE barcode IS NULL")
+        product_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute(cursor.dialect.begin)
+        cursor.executemany("UPDATE Products SET sku = %s, barcode = %s WHERE product_id = %s",
+                           [(f"SKU-{product_id}", f"{product_id:013d}", product_id) for product_id in product_ids])
+    db.commit()
+
+
+def bench_scans(backend, args, results):
+    # Resolving scanned barcodes: one query per scan, as a till without the
+    # catalog would do, against the catalog's in-memory code map
+    scans = args.scans
+    rng = random.Random(args.seed)
+    with backend.connection() as db:
+        assign_codes(db)
+        with db.cursor() as cursor:
+            cursor.execute("SELECT barcode FROM Products WHERE barcode IS NOT NULL ORDER BY product_id")
+            codes = [row[0] for row in cursor.fetchall()]
+            sample = [rng.choice(codes) for _ in range(scans)]
+
+            started = time.perf_counter()
+            for code in sample:
+                cursor.execute("SELECT product_id, product_name, price FROM Products WHERE barcode = %s", (code,))
+                cursor.fetchall()
+            query_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        catalog = ProductCatalog().warm(db)
+        warm_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    cart = {}
+    for code in sample:
+        entry = catalog.lookup_code(code)
+        cart[entry.product_id] = cart.get(entry.product_id, 0) + 1
+    lookup_seconds = time.perf_counter() - started
+
+    print(f"{scans} scans into {len(cart)} cart lines")
+    print(f"{'path':<10} {'total ms':>10} {'per scan us':>12}")
+    print(f"{'query':<10} {query_seconds * 1000:>10.1f} {query_seconds / scans * 1e6:>12.1f}")
+    print(f"{'catalog':<10} {lookup_seconds * 1000:>10.1f} {lookup_seconds / scans * 1e6:>12.1f}"
+          f"  (+{warm_seconds * 1000:.0f} ms to load {len(catalog.entries)} products once)")
+    results.add("scans", "query per scan", query_seconds / scans * 1e6, "us")
+    results.add("scans", "catalog per scan", lookup_seconds / scans * 1e6, "us")
+
+
+def run_threads(threads, work):
+    # Runs work(thread_index) on `threads` threads and returns the wall time
+    # in seconds and every operation latency they reported
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def run(index):
+        try:
+            timings = work(index)
+        except Exception as err:
+            with lock:
+                errors.append(err)
+            return
+        with lock:
+            latencies.extend(timings)
+
+    workers = [threading.Thread(target=run, args=(index,)) for index in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    if errors:
+        raise errors[0]
+    return elapsed, latencies
+
+
+def report_throughput(scenario, operation, count, elapsed, latencies, results):
+    rate = count / elapsed
+    p50 = percentile(latencies, 0.5) * 1000
+    p95 = percentile(latencies, 0.95) * 1000
+    print(f"{count} {operation}s in {elapsed:.2f} s: {rate:.0f}/s, p50 {p50:.1f} ms, p95 {p95:.1f} ms")
+    results.add(scenario, f"{operation}s per second", rate, f"{operation}s/s", better="higher")
+    results.add(scenario, f"{operation} p50", p50, "ms")
+    results.add(scenario, f"{operation} p95", p95, "ms")
+
+
+def reset_stock(db):
+    # The ledger starts over from the reset stock so it keeps matching Inventory
+    with db.cursor() as cursor:
+        cursor.execute(cursor.dialect.begin)
+        cursor.execute("DELETE FROM Stock_Reservations")
+        cursor.execute("UPDATE Inventory SET quantity = %s, reserved = 0", (INITIAL_STOCK,))
+        cursor.execute("DELETE FROM inventory_movements")
+        cursor.execute("DELETE FROM inventory_snapshots")
+        record_opening_balances(cursor)
+    db.commit()
+
+
+def last_sale_id(db):
+    with db.cursor() as cursor:
+        cursor.execute("SELECT COALESCE(MAX(sale_id), 0) FROM Sales")
+        return cursor.fetchone()[0]
+
+
+def remove_bench_sales(backend, last_id):
+    # Puts the generated history back the way it was before a scenario sold
+    with backend.connection() as db:
+        with db.cursor() as cursor:
+            cursor.execute(cursor.dialect.begin)
+            cursor.execute("DELETE FROM Sale_Items WHERE sale_id > %s", (last_id,))
+            cursor.execute("DELETE FROM Sales WHERE sale_id > %s", (last_id,))
+            cursor.execute("DELETE FROM daily_sales_summary WHERE summary_date > %s", (HISTORY_END.date(),))
+            cursor.execute("DELETE FROM daily_product_summary WHERE summary_date > %s", (HISTORY_END.date(),))
+        db.commit()
+        reset_stock(db)
+
+
+def bench_checkout(backend, args, results):
+    # Sales through StoreService.create_sale from several tills at once,
+    # which is what the Process Sale button runs. The sales are deleted
+    # again afterwards so the generated history stays the same.
+    service = StoreService(backend)
+    with backend.connection() as db:
+        reset_stock(db)
+        service.catalog.warm(db)
+        last_id = last_sale_id(db)
+        with db.cursor() as cursor:
+            cursor.execute("SELECT customer_id FROM Customers ORDER BY customer_id")
+            customer_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute("SELECT seller_id FROM Sellers ORDER BY seller_id")
+            seller_ids = [row[0] for row in cursor.fetchall()]
+    products = service.catalog.products()
+    per_thread = max(args.checkouts // args.threads, 1)
+
+    def till(index):
+        rng = random.Random(args.seed + index)
+        timings = []
+        for _ in range(per_thread):
+            cart = Cart(tax_rate=rng.choice(CHECKOUT_TAX_RATES))
+            for entry in rng.sample(products, rng.randint(1, 5)):
+                cart.add(entry.product_id, entry.name, entry.price, rng.randint(1, 4))
+            cart.set_discount_text(rng.choice(CHECKOUT_DISCOUNTS))
+            totals = cart.totals
+            started = time.perf_counter()
+            service.create_sale(rng.choice(customer_ids), rng.choice(seller_ids), cart.sale_lines(),
+                                discount=totals.discount, tax=totals.tax)
+            timings.append(time.perf_counter() - started)
+        return timings
+
+    QUERY_STATS.reset()
+    try:
+        elapsed, latencies = run_threads(args.threads, till)
+        statements = sum(entry["calls"] for entry in QUERY_STATS.snapshot()["statements"])
+        with backend.connection() as db:
+            mismatched = mismatched_totals(db, last_id)
+    finally:
+        remove_bench_sales(backend, last_id)
+    report_throughput("checkout", "sale", len(latencies), elapsed, latencies, results)
+    print(f"{statements / len(latencies):.1f} statements per sale, {mismatched} sale totals off their items")
+    results.add("checkout", "statements per sale", statements / len(latencies), "statements")
+    results.add("checkout", "mismatched totals", mismatched, "sales")
+
+
+def mismatched_totals(db, last_id):
+    # Every sale's total less tax plus discount must be exactly what its
+    # Sale_Items add up to. Summed here rather than in SQL because SQLite
+    # keeps DECIMAL columns as floats.
+    with db.cursor() as cursor:
+        cursor.execute("""
+            SELECT sale_id, total_amount, discount_amount, tax_amount FROM Sales WHERE sale_id > %s
+        """, (last_id,))
+        expected = {sale_id: to_money(total) - to_money(tax) + to_money(discount)
+                    for sale_id, total, discount, tax in cursor.fetchall()}
+        cursor.execute("SELECT sale_id, quantity, unit_price FROM Sale_Items WHERE sale_id > %s", (last_id,))
+        items = {}
+        for sale_id, quantity, unit_price in cursor.fetchall():
+            items[sale_id] = items.get(sale_id, 0) + quantity * to_money(unit_price)
+    return sum(1 for sale_id, amount in expected.items() if items.get(sale_id) != amount)
+
+
+def bench_restock(backend, args, results):
+    # Concurrent restocks of a few hot products; every one must land, so the
+    # stock added is checked against what was sent
+    service = StoreService(backend)
+    with backend.connection() as db:
+        reset_stock(db)
+        with db.cursor() as cursor:
+            cursor.execute("SELECT product_id FROM Inventory ORDER BY product_id LIMIT %s", (RESTOCK_HOT_PRODUCTS,))
+            product_ids = [row[0] for row in cursor.fetchall()]
+    per_thread = max(args.restocks // args.threads, 1)
+    added = [0] * args.threads
+
+    def clerk(index):
+        rng = random.Random(args.seed + index)
+        timings = []
+        for _ in range(per_thread):
+            quantity = rng.randint(1, 20)
+            started = time.perf_counter()
+            service.restock(rng.choice(product_ids), quantity)
+            timings.append(time.perf_counter() - started)
+            added[index] += quantity
+        return timings
+
+    elapsed, latencies = run_threads(args.threads, clerk)
+    with backend.connection() as db:
+        with db.cursor() as cursor:
+            placeholders = ", ".join(["%s"] * len(product_ids))
+            cursor.execute(f"SELECT SUM(quantity) FROM Inventory WHERE product_id IN ({placeholders})", product_ids)
+            stocked = int(cursor.fetchone()[0]) - INITIAL_STOCK * len(product_ids)
+        reset_stock(db)
+    report_throughput("restock", "restock", len(latencies), elapsed, latencies, results)
+    if stocked != sum(added):
+        print(f"LOST UPDATES: sent {sum(added)} units but {stocked} arrived")
+    results.add("restock", "lost units", sum(added) - stocked, "units")
+
+
+def bench_catalog(backend, args, results):
+    # What a till does at startup and on every catalog refresh
+    service = StoreService(backend)
+    warm = timed(service.warm_catalog, args.repeat)
+    lookups = timed(service.load_lookups, args.repeat)
+    search = timed(lambda: [service.catalog.search(prefix) for prefix in ("pro", "product 1", "category 7")],
+                   args.repeat)
+    print(f"{len(service.catalog.entries)} products")
+    print(f"{'load':<10} {'ms':>10}")
+    for name, elapsed in (("warm", warm), ("lookups", lookups), ("search", search)):
+        print(f"{name:<10} {elapsed:>10.1f}")
+    results.add("catalog", "warm", warm, "ms")
+    results.add("catalog", "load lookups", lookups, "ms")
+    results.add("catalog", "3 searches", search, "ms")
+
+
+def bench_analytics(backend, args, results):
+    # Loading the history into the analytics arrays, a refresh with nothing
+    # new, and each report over everything loaded
+    try:
+        from analytics import SalesAnalytics
+    except ImportError:
+        print("numpy is not installed; skipped")
+        return
+    service = StoreService(backend)
+    analytics = SalesAnalytics(service)
+    started = time.perf_counter()
+    columns = analytics.refresh()
+    load = (time.perf_counter() - started) * 1000
+    print(f"{len(columns.sale_id)} sales, {len(columns.item_sale_id)} items in {columns.nbytes() / 2 ** 20:.1f} MB")
+    print(f"{'operation':<15} {'ms':>10}")
+    timings = [("load", load), ("refresh", timed(analytics.refresh, args.repeat))]
+    for name, job in (("top products", analytics.top_products), ("sellers", analytics.seller_leaderboard),
+                      ("baskets", analytics.basket_sizes), ("hours", analytics.hour_heatmap)):
+        timings.append((name, timed(job, args.repeat)))
+    for name, elapsed in timings:
+        print(f"{name:<15} {elapsed:>10.1f}")
+        results.add("analytics", name, elapsed, "ms")
+
+
+def bench_terminals(backend, args, results):
+    # N terminals, each with its own service and terminal id, running the
+    # till's full checkout at once: hold every line of a cart, then sell it.
+    # Afterwards every unit sold must be gone from stock, the movement ledger
+    # must still agree with Inventory and no hold may be left behind.
+    catalog = ProductCatalog()
+    with backend.connection() as db:
+        reset_stock(db)
+        catalog.warm(db)
+        last_id = last_sale_id(db)
+        with db.cursor() as cursor:
+            cursor.execute("SELECT customer_id FROM Customers ORDER BY customer_id LIMIT 100")
+            customer_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute("SELECT seller_id FROM Sellers ORDER BY seller_id")
+            seller_ids = [row[0] for row in cursor.fetchall()]
+    hot = catalog.products()[:TERMINAL_HOT_PRODUCTS]
+    per_terminal = max(args.checkouts // args.terminals, 1)
+    sold = [0] * args.terminals
+
+    def terminal(index):
+        service = StoreService(backend, catalog, terminal_id=f"bench-{index}")
+        rng = random.Random(args.seed + index)
+        timings = []
+        for _ in range(per_terminal):
+            session_id = new_session_id()
+            started = time.perf_counter()
+            lines = []
+            for entry in rng.sample(hot, rng.randint(1, 5)):
+                quantity = rng.randint(1, 3)
+                service.reserve(session_id, entry.product_id, quantity)
+                lines.append(SaleLine(entry.product_id, quantity, entry.price))
+            service.create_sale(rng.choice(customer_ids), rng.choice(seller_ids), lines, session_id)
+            timings.append(time.perf_counter() - started)
+            sold[index] += sum(line.quantity for line in lines)
+        return timings
+
+    QUERY_STATS.reset()
+    try:
+        elapsed, latencies = run_threads(args.terminals, terminal)
+        retries = QUERY_STATS.snapshot()["retries_total"]
+        with backend.connection() as db, db.cursor() as cursor:
+            placeholders = ", ".join(["%s"] * len(hot))
+            cursor.execute(f"""
+                SELECT COALESCE(SUM(quantity), 0), COALESCE(SUM(reserved), 0) FROM Inventory
+                WHERE product_id IN ({placeholders})
+            """, [entry.product_id for entry in hot])
+            stock, reserved = (int(value) for value in cursor.fetchone())
+            cursor.execute("SELECT COUNT(DISTINCT terminal_id) FROM Sales WHERE sale_id > %s", (last_id,))
+            terminals = cursor.fetchone()[0]
+            drift = len(ledger_drift(cursor))
+    finally:
+        remove_bench_sales(backend, last_id)
+    report_throughput("terminals", "checkout", len(latencies), elapsed, latencies, results)
+    missing = INITIAL_STOCK * len(hot) - stock - sum(sold)
+    print(f"{args.terminals} terminals ({terminals} seen on sales), {retries} deadlock retries, "
+          f"{missing} units unaccounted for, {reserved} left reserved, {drift} product(s) off the ledger")
+    results.add("terminals", "retries per checkout", retries / len(latencies), "retries")
+    results.add("terminals", "units unaccounted for", missing, "units")
+    results.add("terminals", "products off the ledger", drift, "products")
+
+
+def bench_oversell(backend, args, results):
+    # N terminals buying a few units at a time of a stock of OVERSELL_STOCK
+    # until it is gone. Half hold the units first, like the till; the other
+    # half sell straight away, like a flushed journal. Exactly the starting
+    # stock must be sold, leaving every product at 0, never below.
+    catalog = ProductCatalog()
+    with backend.connection() as db:
+        reset_stock(db)
+        with db.cursor() as cursor:
+            cursor.execute("SELECT product_id FROM Inventory ORDER BY product_id LIMIT %s", (OVERSELL_PRODUCTS,))
+            product_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute("SELECT MIN(customer_id) FROM Customers")
+            customer_id = cursor.fetchone()[0]
+            cursor.execute("SELECT MIN(seller_id) FROM Sellers")
+            seller_id = cursor.fetchone()[0]
+        for product_id in product_ids:
+            adjust_stock(db, product_id, OVERSELL_STOCK, "benchmark")
+        catalog.warm(db)
+        last_id = last_sale_id(db)
+    sold = [0] * args.terminals
+    refused = [0] * args.terminals
+
+    def terminal(index):
+        service = StoreService(backend, catalog, terminal_id=f"bench-{index}")
+        rng = random.Random(args.seed + index)
+        timings = []
+        left = list(product_ids)
+        while left:
+            entry = catalog.get(rng.choice(left))
+            # After a refusal try a single unit: only when even that is
+            # refused is the product sold out for this terminal
+            for quantity in (rng.randint(1, 3), 1):
+                session_id = new_session_id() if index % 2 == 0 else None
+                started = time.perf_counter()
+                try:
+                    if session_id:
+                        service.reserve(session_id, entry.product_id, quantity)
+                    service.create_sale(customer_id, seller_id, [SaleLine(entry.product_id, quantity, entry.price)],
+                                        session_id)
+                except InsufficientStockError:
+                    refused[index] += 1
+                    if session_id:
+                        service.release_cart(session_id)
+                else:
+                    sold[index] += quantity
+                    timings.append(time.perf_counter() - started)
+                    break
+            else:
+                left.remove(entry.product_id)
+        return timings
+
+    try:
+        elapsed, latencies = run_threads(args.terminals, terminal)
+        with backend.connection() as db, db.cursor() as cursor:
+            placeholders = ", ".join(["%s"] * len(product_ids))
+            cursor.execute(f"""
+                SELECT SUM(quantity), MIN(quantity), SUM(reserved) FROM Inventory
+                WHERE product_id IN ({placeholders})
+            """, product_ids)
+            stock, lowest, reserved = (int(value) for value in cursor.fetchone())
+            drift = len(ledger_drift(cursor))
+    finally:
+        remove_bench_sales(backend, last_id)
+        with backend.connection() as db:
+            reset_stock(db)
+    report_throughput("oversell", "sale", len(latencies), elapsed, latencies, results)
+    oversold = sum(sold) - OVERSELL_STOCK * len(product_ids)
+    print(f"{args.terminals} terminals sold {sum(sold)} of {OVERSELL_STOCK * len(product_ids)} units "
+          f"in {len(latencies)} sales, {sum(refused)} refused; {stock} left, lowest {lowest}, "
+          f"{reserved} left reserved, {drift} product(s) off the ledger")
+    if oversold > 0 or lowest < 0:
+        print(f"OVERSOLD: sold {sum(sold)} units of a stock of {OVERSELL_STOCK * len(product_ids)}, lowest {lowest}")
+    elif stock:
+        print(f"UNSOLD: {stock} units left after every terminal was refused")
+    results.add("oversell", "oversold units", oversold, "units")
+    results.add("oversell", "units left", stock, "units")
+    results.add("oversell", "products off the ledger", drift, "products")
+
+
+BENCHMARKS = {
+    "reports": bench_reports,
+    "scans": bench_scans,
+    "checkout": bench_checkout,
+    "restock": bench_restock,
+    "catalog": bench_catalog,
+    "analytics": bench_analytics,
+    "terminals": bench_terminals,
+    "oversell": bench_oversell,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark store operations against a scratch database")
+    parser.add_argument("--backend", choices=["mysql", "sqlite"], default=BACKEND)
+    parser.add_argument("--database", default=BENCH_DATABASE)
+    parser.add_argument("--sales", type=int, default=1000000)
+    parser.add_argument("--products", type=int, default=PRODUCTS)
+    parser.add_argument("--customers", type=int, default=CUSTOMERS)
+    parser.add_argument("--sellers", type=int, default=SELLERS)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--scans", type=int, default=10000)
+    parser.add_argument("--checkouts", type=int, default=1000)
+    parser.add_argument("--restocks", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=4, help="concurrent tills for checkout and restock")
+    parser.add_argument("--terminals", type=int, default=8, help="simulated terminals for the terminals and oversell scenarios")
+    parser.add_argument("--scenario", nargs="+", choices=["all", *SCENARIOS], default=["all"])
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="compare with the results JSON of an earlier run")
+    args = parser.parse_args()
+
+    scenarios = SCENARIOS if "all" in args.scenario else [name for name in SCENARIOS if name in args.scenario]
+    backend = open_backend(args.backend, args.database, pool_size=max(args.threads, args.terminals) + 1)
+    with backend.connection() as db:
+        migrate(db)
+        print(f"Populating {args.database} with {args.sales} sales...")
+        populate(db, args.sales, args.seed, args.products, args.customers, args.sellers)
+
+    results = Results()
+    for name in scenarios:
+        print(f"\n== {name} ==")
+        BENCHMARKS[name](backend, args, results)
+
+    if args.output:
+        results.write(args.output, run_meta(args))
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        results.compare(args.compare)
+
+
+if __name__ == "__main__":
+    main()
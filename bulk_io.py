@@ -0,0 +1,269 @@
+import csv
+from datetime import date
+from typing import List, NamedTuple, Tuple
+
+from ledger import record_movements
+from reservations import lock_inventory
+from store_service import ValidationError, parse_price
+
+IMPORT_CHUNK_SIZE = 5000
+EXPORT_CHUNK_SIZE = 5000
+
+# Import and export share column names so an exported file can be edited and
+# imported again. Rows are upserted on the table's unique key.
+PRODUCT_COLUMNS = ("product_name", "price", "description", "category", "sku", "barcode")
+CUSTOMER_COLUMNS = ("customer_name", "contact_number", "email")
+INVENTORY_COLUMNS = ("product_name", "quantity", "last_restocked")
+
+# Upserts as (table, columns, unique key, updates) for the dialect to render
+PRODUCT_UPSERT = ("Products", PRODUCT_COLUMNS, ("product_name",), {
+    "price": "{new}",
+    "description": "{new}",
+    "category": "{new}",
+    "sku": "COALESCE({new}, sku)",
+    "barcode": "COALESCE({new}, barcode)",
+})
+CUSTOMER_UPSERT = ("Customers", CUSTOMER_COLUMNS, ("customer_name", "contact_number"), {"email": "{new}"})
+# Imported quantities are absolute stock counts, not deltas like a restock
+INVENTORY_UPSERT = ("Inventory", ("product_id", "quantity", "last_restocked"), ("product_id",), {
+    "quantity": "{new}",
+    "last_restocked": "{new}",
+})
+
+EXPORT_QUERIES = {
+    "products": (PRODUCT_COLUMNS, """
+        SELECT product_name, price, description, category, sku, barcode FROM Products ORDER BY product_id
+    """),
+    "customers": (CUSTOMER_COLUMNS, """
+        SELECT customer_name, contact_number, email FROM Customers ORDER BY customer_id
+    """),
+    "inventory": (INVENTORY_COLUMNS, """
+        SELECT p.product_name, i.quantity, i.last_restocked
+        FROM Inventory i
+        JOIN Products p ON p.product_id = i.product_id
+        ORDER BY i.product_id
+    """),
+}
+
+
+class ImportResult(NamedTuple):
+    imported: int
+    rejected: List[Tuple[int, str]]
+
+
+def read_chunks(path, required_columns, chunk_size=IMPORT_CHUNK_SIZE):
+    # Yields lists of (line_number, row) so only one chunk of the file is in
+    # memory at a time
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        missing = [column for column in required_columns if column not in (reader.fieldnames or [])]
+        if missing:
+            raise ValidationError(f"{path} is missing column(s): {', '.join(missing)}")
+        chunk = []
+        for row in reader:
+            chunk.append((reader.line_num, row))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def optional(value):
+    value = (value or "").strip()
+    return value or None
+
+
+def required(row, column, label):
+    value = (row.get(column) or "").strip()
+    if not value:
+        raise ValidationError(f"{label} is required")
+    return value
+
+
+def parse_quantity(value):
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError("Quantity must be a whole number")
+    if quantity < 0:
+        raise ValidationError("Quantity cannot be negative")
+    return quantity
+
+
+def product_row(row):
+    return (required(row, "product_name", "Product name"),
+            parse_price(required(row, "price", "Price")),
+            optional(row.get("description")),
+            optional(row.get("category")),
+            optional(row.get("sku")),
+            optional(row.get("barcode")))
+
+
+def customer_row(row):
+    return (required(row, "customer_name", "Customer name"),
+            required(row, "contact_number", "Contact number"),
+            optional(row.get("email")))
+
+
+def inventory_row(row):
+    restocked = optional(row.get("last_restocked"))
+    try:
+        restocked = date.fromisoformat(restocked) if restocked else date.today()
+    except ValueError:
+        raise ValidationError("last_restocked must be a YYYY-MM-DD date")
+    return (required(row, "product_name", "Product name"),
+            parse_quantity(required(row, "quantity", "Quantity")),
+            restocked)
+
+
+def validate(chunk, parse, rejected):
+    rows = []
+    for line, row in chunk:
+        try:
+            rows.append((line, parse(row)))
+        except ValidationError as err:
+            rejected.append((line, str(err)))
+    return rows
+
+
+def resolve_products(cursor, rows, rejected):
+    # Inventory files name products; look the ids up once per chunk
+    names = list({values[0] for _, values in rows})
+    if not names:
+        return []
+    cursor.execute(f"SELECT product_name, product_id FROM Products WHERE product_name IN ({', '.join(['%s'] * len(names))})",
+                   names)
+    ids = dict(cursor.fetchall())
+    resolved = []
+    for line, (name, quantity, restocked) in rows:
+        if name in ids:
+            resolved.append((line, (ids[name], quantity, restocked)))
+        else:
+            rejected.append((line, f"Unknown product {name!r}"))
+    return resolved
+
+
+def check_stock_counts(cursor, rows, rejected):
+    # Locks the products' inventory rows and rejects counts below what open
+    # carts hold, which the till could then not sell. Returns the rows kept
+    # and {product_id: quantity} as it was before the import.
+    lock_inventory(cursor, [values[0] for _, values in rows])
+    placeholders = ", ".join(["%s"] * len(rows))
+    cursor.execute(f"SELECT product_id, quantity, reserved FROM Inventory WHERE product_id IN ({placeholders})",
+                   [values[0] for _, values in rows])
+    current, reserved = {}, {}
+    for product_id, quantity, held in cursor.fetchall():
+        current[product_id] = quantity
+        reserved[product_id] = held
+    kept = []
+    for line, values in rows:
+        held = reserved.get(values[0], 0)
+        if values[1] < held:
+            rejected.append((line, f"Quantity {values[1]} is below the {held} unit(s) held in open carts"))
+        else:
+            kept.append((line, values))
+    return kept, current
+
+
+def record_stock_counts(cursor, rows, current):
+    # Imported counts replace the stock, so the ledger gets the difference
+    # from what was there; a product listed twice ends up at its last count
+    counts = {product_id: quantity for _, (product_id, quantity, _) in rows}
+    record_movements(cursor, "import", {product_id: quantity - current.get(product_id, 0)
+                                        for product_id, quantity in counts.items()})
+
+
+def write_chunk(db, kind, upsert, rows, rejected, row_by_row=False):
+    # Upserts (line, values) rows in one transaction and returns how many
+    # were written. Row by row, a row the database refuses (e.g. a SKU
+    # another product already has) is rejected and the rest still go in.
+    refused = []
+    with db.cursor() as cursor:
+        cursor.execute(cursor.dialect.begin)
+        current = None
+        if kind == "inventory":
+            rows, current = check_stock_counts(cursor, rows, refused)
+        if row_by_row:
+            written = []
+            for line, values in rows:
+                try:
+                    cursor.execute(upsert, values)
+                except Exception as err:
+                    if not cursor.dialect.is_data_error(err):
+                        raise
+                    refused.append((line, f"Rejected by the database: {err}"))
+                else:
+                    written.append((line, values))
+            rows = written
+        elif rows:
+            cursor.executemany(upsert, [values for _, values in rows])
+        if current is not None:
+            record_stock_counts(cursor, rows, current)
+    db.commit()
+    rejected.extend(refused)
+    return len(rows)
+
+
+# kind -> (required columns, row parser, upsert); other columns may be left out
+IMPORTS = {
+    "products": (("product_name", "price"), product_row, PRODUCT_UPSERT),
+    "customers": (("customer_name", "contact_number"), customer_row, CUSTOMER_UPSERT),
+    "inventory": (("product_name", "quantity"), inventory_row, INVENTORY_UPSERT),
+}
+
+
+def import_csv(service, kind, path, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    # Each chunk is validated, upserted with one multi-row INSERT and
+    # committed, so a bad row is reported instead of aborting the file and an
+    # interrupted import can simply be rerun.
+    required_columns, parse, upsert = IMPORTS[kind]
+    imported = 0
+    rejected = []
+    processed = 0
+    with service.backend.connection() as db:
+        with db.cursor() as cursor:
+            upsert = cursor.dialect.upsert(*upsert)
+            for chunk in read_chunks(path, required_columns, chunk_size):
+                rows = validate(chunk, parse, rejected)
+                if kind == "inventory":
+                    rows = resolve_products(cursor, rows, rejected)
+                if rows:
+                    try:
+                        imported += write_chunk(db, kind, upsert, rows, rejected)
+                    except Exception as err:
+                        if not cursor.dialect.is_data_error(err):
+                            raise
+                        # One row broke a unique key and took the chunk with
+                        # it; send the chunk again a row at a time
+                        db.rollback()
+                        imported += write_chunk(db, kind, upsert, rows, rejected, row_by_row=True)
+                processed += len(chunk)
+                if progress:
+                    progress(processed, imported, len(rejected))
+    if kind != "customers":
+        # Prices and stock changed underneath the catalog
+        service.catalog.invalidate()
+    rejected.sort()
+    return ImportResult(imported, rejected)
+
+
+def export_csv(service, kind, path, chunk_size=EXPORT_CHUNK_SIZE, progress=None):
+    # An unbuffered cursor streams rows from the server as they are fetched,
+    # so memory stays flat however large the table is
+    columns, query = EXPORT_QUERIES[kind]
+    exported = 0
+    with service.backend.connection() as db:
+        with db.cursor(buffered=False) as cursor, open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            cursor.execute(query)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                writer.writerows(rows)
+                exported += len(rows)
+                if progress:
+                    progress(exported)
+    return exported
@@ -0,0 +1,133 @@
+import os
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import List, NamedTuple
+
+from store_service import SaleLine, ValidationError
+
+CENT = Decimal("0.01")
+ZERO = Decimal("0.00")
+
+# Sales tax added on top of the discounted subtotal, e.g. "0.08" for 8%
+TAX_RATE = os.environ.get("STORMANAG_TAX_RATE", "0")
+
+
+def to_money(value) -> Decimal:
+    # Rounds to whole cents; floats go through str() so 0.1 stays 0.10
+    # instead of picking up its binary expansion
+    if isinstance(value, float):
+        value = str(value)
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def parse_rate(value) -> Decimal:
+    try:
+        rate = Decimal(str(value).strip().rstrip("%") or "0")
+    except InvalidOperation:
+        raise ValidationError(f"Invalid rate {value!r}")
+    if str(value).strip().endswith("%"):
+        rate /= 100
+    if not rate.is_finite() or not 0 <= rate <= 1:
+        raise ValidationError("Rate must be between 0 and 100%")
+    return rate
+
+
+class CartLine(NamedTuple):
+    product_id: int
+    name: str
+    quantity: int
+    unit_price: Decimal
+
+    @property
+    def total(self) -> Decimal:
+        return self.quantity * self.unit_price
+
+
+class CartTotals(NamedTuple):
+    subtotal: Decimal
+    discount: Decimal
+    tax: Decimal
+    total: Decimal
+
+
+class Cart:
+    # The open sale, priced in Decimal cents from end to end. The subtotal
+    # is kept up to date as lines change, so reading the totals never walks
+    # the lines. A discount is either a fixed amount or a rate of the
+    # subtotal; tax is charged on what is left after the discount.
+    def __init__(self, tax_rate=TAX_RATE):
+        self.tax_rate = parse_rate(tax_rate)
+        self.lines = {}
+        self.subtotal = ZERO
+        self.discount_amount = ZERO
+        self.discount_rate = None
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __iter__(self):
+        return iter(self.lines.values())
+
+    def get(self, product_id):
+        return self.lines.get(product_id)
+
+    def add(self, product_id, name, unit_price, quantity=1) -> CartLine:
+        # Adding a product that is already in the cart bumps its quantity
+        if quantity <= 0:
+            raise ValidationError("Quantity must be a positive number")
+        unit_price = to_money(unit_price)
+        line = self.lines.get(product_id)
+        if line is None:
+            line = CartLine(product_id, name, quantity, unit_price)
+        else:
+            # The price the line was started at stands for the whole line
+            line = line._replace(quantity=line.quantity + quantity)
+        self.lines[product_id] = line
+        self.subtotal += quantity * line.unit_price
+        return line
+
+    def remove(self, product_id) -> CartLine:
+        line = self.lines.pop(product_id)
+        self.subtotal -= line.total
+        return line
+
+    def clear(self):
+        self.lines = {}
+        self.subtotal = ZERO
+        self.discount_amount = ZERO
+        self.discount_rate = None
+
+    def set_discount(self, amount=None, rate=None):
+        # Replaces any earlier discount; pass neither to remove it
+        if amount is not None and rate is not None:
+            raise ValidationError("Give a discount amount or a rate, not both")
+        self.discount_rate = parse_rate(rate) if rate is not None else None
+        self.discount_amount = ZERO if amount is None else to_money(amount)
+        if self.discount_amount < 0:
+            raise ValidationError("Discount cannot be negative")
+
+    def set_discount_text(self, text):
+        # What the till's discount box holds: "5" is $5 off, "10%" is 10% off
+        text = (text or "").strip()
+        if not text:
+            self.set_discount()
+        elif text.endswith("%"):
+            self.set_discount(rate=text)
+        else:
+            try:
+                self.set_discount(amount=text)
+            except InvalidOperation:
+                raise ValidationError(f"Invalid discount {text!r}")
+
+    @property
+    def totals(self) -> CartTotals:
+        if self.discount_rate is not None:
+            discount = to_money(self.subtotal * self.discount_rate)
+        else:
+            discount = self.discount_amount
+        # Never discount below zero
+        discount = min(discount, self.subtotal)
+        tax = to_money((self.subtotal - discount) * self.tax_rate)
+        return CartTotals(self.subtotal, discount, tax, self.subtotal - discount + tax)
+
+    def sale_lines(self) -> List[SaleLine]:
+        return [SaleLine(line.product_id, line.quantity, line.unit_price) for line in self.lines.values()]
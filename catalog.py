@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import namedtuple
+
+from search_index import SEARCH_LIMIT, ProductSearchIndex
+
+# Seconds before the catalog is reloaded to pick up changes from other
+# terminals; 0 disables the periodic refresh.
+CATALOG_TTL = 60
+
+CATALOG_QUERY = """
+    SELECT p.product_id, p.product_name, p.price, p.category, p.description, p.sku, p.barcode,
+           i.quantity - i.reserved
+    FROM Products p
+    LEFT JOIN Inventory i ON i.product_id = p.product_id
+"""
+
+# stock is what is left once holds by open carts are taken off, and None for
+# products that have never been stocked
+CatalogEntry = namedtuple("CatalogEntry", ["product_id", "name", "price", "category", "description",
+                                           "sku", "barcode", "stock"])
+
+
+class ProductCatalog:
+    # In-memory copy of every product with its price and stock level, so that
+    # adding a cart line needs no database round trip. Stock here is only a
+    # hint for the UI; the sale commit re-validates it against Inventory.
+    def __init__(self, ttl=CATALOG_TTL):
+        self.ttl = ttl
+        self.entries = {}
+        self.index = ProductSearchIndex()
+        # Scanned SKU or barcode -> product_id
+        self.codes = {}
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def warm(self, db):
+        with db.cursor() as cursor:
+            cursor.execute(CATALOG_QUERY)
+            return self.load(cursor.fetchall())
+
+    def load(self, rows):
+        # rows are CATALOG_QUERY rows, however they were fetched
+        entries = {row[0]: CatalogEntry(*row) for row in rows}
+        # Build the new index off to the side so searches keep working
+        index = ProductSearchIndex.build((entry.product_id, entry.name, entry.category, entry.description)
+                                         for entry in entries.values())
+        codes = {code: entry.product_id for entry in entries.values() for code in (entry.sku, entry.barcode) if code}
+        with self.lock:
+            self.entries = entries
+            self.index = index
+            self.codes = codes
+            self.loaded_at = time.monotonic()
+        return self
+
+    def refresh_products(self, db, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        placeholders = ", ".join(["%s"] * len(product_ids))
+        with db.cursor() as cursor:
+            cursor.execute(CATALOG_QUERY + f" WHERE p.product_id IN ({placeholders})", product_ids)
+            rows = cursor.fetchall()
+        with self.lock:
+            for product_id in product_ids:
+                old = self.entries.pop(product_id, None)
+                if old is not None:
+                    for code in (old.sku, old.barcode):
+                        if self.codes.get(code) == product_id:
+                            del self.codes[code]
+                self.index.remove(product_id)
+            for row in rows:
+                entry = self.entries[row[0]] = CatalogEntry(*row)
+                self.index.add(entry.product_id, entry.name, entry.category, entry.description)
+                for code in (entry.sku, entry.barcode):
+                    if code:
+                        self.codes[code] = entry.product_id
+
+    def adjust_stock(self, quantities):
+        with self.lock:
+            for product_id, delta in quantities.items():
+                entry = self.entries.get(product_id)
+                if entry is not None:
+                    self.entries[product_id] = entry._replace(stock=(entry.stock or 0) + delta)
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded_at = None
+
+    def is_stale(self):
+        if self.loaded_at is None:
+            return True
+        return bool(self.ttl) and time.monotonic() - self.loaded_at > self.ttl
+
+    def get(self, product_id):
+        return self.entries.get(product_id)
+
+    def lookup_code(self, code):
+        product_id = self.codes.get(code)
+        return None if product_id is None else self.entries.get(product_id)
+
+    def refresh_code(self, db, code):
+        # For a code scanned before this terminal's catalog has seen it
+        with db.cursor() as cursor:
+            cursor.execute("SELECT product_id FROM Products WHERE sku = %s OR barcode = %s", (code, code))
+            product_ids = [row[0] for row in cursor.fetchall()]
+        self.refresh_products(db, product_ids)
+        return self.lookup_code(code)
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        ids = self.index.search(query, limit)
+        return [self.entries[product_id] for product_id in ids if product_id in self.entries]
+
+    def products(self):
+        return sorted(self.entries.values())
@@ -0,0 +1,492 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+
+from query_stats import QUERY_STATS
+
+# "mysql" for a shared server, "sqlite" for a single-node store or a test run
+# that should not need a server
+BACKEND = os.environ.get("STORMANAG_BACKEND", "mysql")
+
+DB_CONFIG = {
+    "host": os.environ.get("STORMANAG_DB_HOST", "localhost"),
+    "user": os.environ.get("STORMANAG_DB_USER", "root"),
+    "password": os.environ.get("STORMANAG_DB_PASSWORD", "123456789"),
+    "database": os.environ.get("STORMANAG_DB_NAME", "store_management"),
+    "port": int(os.environ.get("STORMANAG_DB_PORT", "3306")),
+    "ssl_disabled": True,
+}
+
+POOL_SIZE = int(os.environ.get("STORMANAG_POOL_SIZE", "5"))
+CHECKOUT_TIMEOUT = 30
+RECONNECT_ATTEMPTS = 3
+RECONNECT_DELAY = 1
+
+# A transaction that loses a deadlock or times out waiting for a row lock is
+# run again from the start, up to this many times in all
+TRANSACTION_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.05
+
+SQLITE_PATH = os.environ.get("STORMANAG_SQLITE_PATH", "store_management.db")
+SQLITE_BUSY_TIMEOUT = 30
+SQLITE_PRAGMAS = (
+    # Readers never block the writer and commits only fsync at checkpoints
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536",
+    "PRAGMA mmap_size = 268435456",
+)
+
+# SQLite has no DECIMAL or DATETIME storage class; store them as text and
+# convert columns declared with those types back on the way out
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+# Every DECIMAL column in the schema holds money to two places
+sqlite3.register_converter("DECIMAL", lambda value: Decimal(value.decode()).quantize(Decimal("0.01")))
+sqlite3.register_converter("DATE", lambda value: date.fromisoformat(value.decode()))
+sqlite3.register_converter("DATETIME", lambda value: datetime.fromisoformat(value.decode()))
+
+
+class MySQLDialect:
+    # SQL that differs between engines. The rest of the code base writes
+    # MySQL-flavoured SQL with %s placeholders and asks the dialect for
+    # the pieces that have no common spelling.
+    name = "mysql"
+    begin = "START TRANSACTION"
+    for_update = " FOR UPDATE"
+    insert_ignore = "INSERT IGNORE"
+    auto_id = "INT AUTO_INCREMENT PRIMARY KEY"
+    # Table option for history that is written once and rarely read
+    compressed = " ROW_FORMAT=COMPRESSED"
+    now = "NOW()"
+    today = "CURDATE()"
+    explain = "EXPLAIN "
+
+    def prepare(self, query):
+        return query
+
+    def seconds_from_now(self, placeholder="%s"):
+        return f"NOW() + INTERVAL {placeholder} SECOND"
+
+    def greatest(self, *expressions):
+        return f"GREATEST({', '.join(expressions)})"
+
+    def upsert(self, table, columns, keys, updates):
+        # updates maps a column to its new expression, with {new} standing
+        # for the value the conflicting row tried to insert
+        sets = ", ".join(f"{column} = {expression.format(new=f'VALUES({column})')}"
+                         for column, expression in updates.items())
+        return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+                f" ON DUPLICATE KEY UPDATE {sets}")
+
+    def update_join(self, table, alias, source, on, sets, where=None):
+        # Updates `table` from the rows of the derived table `source`, which
+        # is aliased d
+        assignments = ", ".join(f"{alias}.{column} = {expression}" for column, expression in sets.items())
+        query = f"UPDATE {table} {alias} JOIN ({source}) d ON {on} SET {assignments}"
+        return query + (f" WHERE {where}" if where else "")
+
+    def date_bucket(self, period, column):
+        if period == "Week":
+            return f"DATE_SUB({column}, INTERVAL WEEKDAY({column}) DAY)"
+        if period == "Month":
+            return f"DATE_SUB({column}, INTERVAL DAYOFMONTH({column}) - 1 DAY)"
+        return column
+
+    def ignore_indexes(self, alias, indexes):
+        return f"{alias} IGNORE INDEX ({', '.join(indexes)})"
+
+    def add_column(self, table, column, definition, after=None):
+        return f"ALTER TABLE {table} ADD COLUMN {column} {definition}" + (f" AFTER {after}" if after else "")
+
+    def track_changes(self, table):
+        # Statements that add a last_modified column stamped on every insert
+        # and on every update that changes the row
+        return [self.add_column(table, "last_modified",
+                                "TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)")]
+
+    def column_exists(self, cursor, table, column):
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+        """, (table, column))
+        return bool(cursor.fetchone()[0])
+
+    def index_exists(self, cursor, table, index):
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+        """, (table, index))
+        return bool(cursor.fetchone()[0])
+
+    def is_missing_table(self, err):
+        return getattr(err, "errno", None) == 1146  # ER_NO_SUCH_TABLE
+
+    def is_retryable(self, err):
+        # ER_LOCK_DEADLOCK, ER_LOCK_WAIT_TIMEOUT
+        return getattr(err, "errno", None) in (1213, 1205)
+
+    def is_data_error(self, err):
+        # The statement was refused for what it holds (a foreign key, a
+        # constraint, a value out of range), so running it again cannot help
+        import mysql.connector
+        return isinstance(err, (mysql.connector.IntegrityError, mysql.connector.DataError))
+
+    def acquire_lock(self, cursor, name, timeout):
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (name, timeout))
+        return bool(cursor.fetchone()[0])
+
+    def release_lock(self, cursor, name):
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (name,))
+        cursor.fetchall()
+
+
+class SQLiteDialect(MySQLDialect):
+    name = "sqlite"
+    # Take the write lock up front so a transaction never fails halfway
+    # when it tries to upgrade a read lock
+    begin = "BEGIN IMMEDIATE"
+    for_update = ""
+    insert_ignore = "INSERT OR IGNORE"
+    auto_id = "INTEGER PRIMARY KEY AUTOINCREMENT"
+    compressed = ""
+    now = "datetime('now', 'localtime')"
+    today = "date('now', 'localtime')"
+    explain = "EXPLAIN QUERY PLAN "
+
+    @staticmethod
+    @lru_cache(maxsize=512)
+    def prepare(query):
+        return query.replace("%s", "?")
+
+    def seconds_from_now(self, placeholder="%s"):
+        return f"datetime('now', 'localtime', '+' || {placeholder} || ' seconds')"
+
+    def greatest(self, *expressions):
+        return f"MAX({', '.join(expressions)})"
+
+    def upsert(self, table, columns, keys, updates):
+        sets = ", ".join(f"{column} = {expression.format(new=f'excluded.{column}')}"
+                         for column, expression in updates.items())
+        return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+                f" ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {sets}")
+
+    def update_join(self, table, alias, source, on, sets, where=None):
+        assignments = ", ".join(f"{column} = {expression}" for column, expression in sets.items())
+        query = f"UPDATE {table} AS {alias} SET {assignments} FROM ({source}) AS d WHERE {on}"
+        return query + (f" AND ({where})" if where else "")
+
+    def date_bucket(self, period, column):
+        if period == "Week":
+            # strftime('%w') counts from Sunday; weeks start on Monday
+            return f"date({column}, '-' || ((CAST(strftime('%w', {column}) AS INTEGER) + 6) % 7) || ' days')"
+        if period == "Month":
+            return f"date({column}, 'start of month')"
+        return column
+
+    def ignore_indexes(self, alias, indexes):
+        return f"{alias} NOT INDEXED"
+
+    def add_column(self, table, column, definition, after=None):
+        # SQLite always appends new columns
+        return f"ALTER TABLE {table} ADD COLUMN {column} {definition}"
+
+    def track_changes(self, table):
+        # No ON UPDATE clause, and ALTER TABLE only takes constant defaults,
+        # so triggers stamp the rows. The WHEN clause keeps the trigger's own
+        # UPDATE from firing it again.
+        stamp = "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')"
+        return [
+            self.add_column(table, "last_modified", "DATETIME NOT NULL DEFAULT '1970-01-01 00:00:00'"),
+            f"UPDATE {table} SET last_modified = {stamp}",
+            f"""CREATE TRIGGER IF NOT EXISTS {table}_inserted AFTER INSERT ON {table}
+                BEGIN UPDATE {table} SET last_modified = {stamp} WHERE rowid = NEW.rowid; END""",
+            f"""CREATE TRIGGER IF NOT EXISTS {table}_modified AFTER UPDATE ON {table}
+                WHEN NEW.last_modified = OLD.last_modified
+                BEGIN UPDATE {table} SET last_modified = {stamp} WHERE rowid = NEW.rowid; END""",
+        ]
+
+    def column_exists(self, cursor, table, column):
+        cursor.execute(f"PRAGMA table_info({table})")
+        return any(row[1] == column for row in cursor.fetchall())
+
+    def index_exists(self, cursor, table, index):
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND name = %s",
+                       (table, index))
+        return bool(cursor.fetchone()[0])
+
+    def is_missing_table(self, err):
+        return isinstance(err, sqlite3.OperationalError) and "no such table" in str(err)
+
+    def is_retryable(self, err):
+        # Raised once the busy timeout runs out waiting for another writer
+        return isinstance(err, sqlite3.OperationalError) and "locked" in str(err)
+
+    def is_data_error(self, err):
+        return isinstance(err, (sqlite3.IntegrityError, sqlite3.DataError))
+
+    def acquire_lock(self, cursor, name, timeout):
+        # Migrations run one transaction each and re-check the version after
+        # BEGIN IMMEDIATE, which already serialises processes sharing the file
+        return True
+
+    def release_lock(self, cursor, name):
+        pass
+
+
+class Cursor:
+    # Wraps a driver cursor so that every backend takes %s placeholders and
+    # works as a context manager, and so callers can reach the dialect.
+    # Every statement is timed and counted in QUERY_STATS.
+    def __init__(self, cursor, dialect, connection=None, streaming=False):
+        self.cursor = cursor
+        self.dialect = dialect
+        self.connection = connection
+        self.streaming = streaming
+        # Stats entry of the last statement, while its rows are being fetched
+        self.entry = None
+
+    def execute(self, query, params=()):
+        started = time.perf_counter()
+        try:
+            result = self.cursor.execute(self.dialect.prepare(query), params)
+        except Exception:
+            QUERY_STATS.record(query, (time.perf_counter() - started) * 1000, error=True)
+            raise
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if self.cursor.description is None:
+            QUERY_STATS.record(query, elapsed_ms, max(self.cursor.rowcount, 0))
+            self.entry = None
+        else:
+            # Rows are counted as they are fetched
+            self.entry = QUERY_STATS.record(query, elapsed_ms)
+        if QUERY_STATS.is_slow(elapsed_ms):
+            self.log_slow(query, params, elapsed_ms)
+        return result
+
+    def executemany(self, query, seq_params):
+        started = time.perf_counter()
+        try:
+            result = self.cursor.executemany(self.dialect.prepare(query), seq_params)
+        except Exception:
+            QUERY_STATS.record(query, (time.perf_counter() - started) * 1000, error=True)
+            raise
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        QUERY_STATS.record(query, elapsed_ms, max(self.cursor.rowcount, 0))
+        self.entry = None
+        if QUERY_STATS.is_slow(elapsed_ms):
+            QUERY_STATS.record_slow(query, (), elapsed_ms)
+        return result
+
+    def log_slow(self, query, params, elapsed_ms):
+        plan = None
+        # A streaming cursor still has rows pending on the connection, so
+        # nothing else can be sent on it yet
+        if QUERY_STATS.wants_plan(query) and not self.streaming and self.connection:
+            plan = self.explain(query, params)
+        QUERY_STATS.record_slow(query, params, elapsed_ms, plan)
+
+    def explain(self, query, params):
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(self.dialect.prepare(self.dialect.explain + query), params)
+            return "\n".join(" | ".join(str(value) for value in row) for row in cursor.fetchall())
+        except Exception as err:
+            return f"EXPLAIN failed: {err}"
+        finally:
+            cursor.close()
+
+    def count_rows(self, rows):
+        if self.entry is not None and rows:
+            QUERY_STATS.add_rows(self.entry, rows)
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        self.count_rows(row is not None)
+        return row
+
+    def fetchmany(self, size):
+        rows = self.cursor.fetchmany(size)
+        self.count_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        self.count_rows(len(rows))
+        return rows
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    def close(self):
+        self.cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Connection:
+    def __init__(self, connection, dialect):
+        self.connection = connection
+        self.dialect = dialect
+
+    def cursor(self, **options):
+        # Driver options such as buffered=False only mean something to MySQL
+        if self.dialect.name != "mysql":
+            options = {}
+        streaming = options.get("buffered") is False
+        return Cursor(self.connection.cursor(**options), self.dialect, self.connection, streaming)
+
+    def commit(self):
+        started = time.perf_counter()
+        self.connection.commit()
+        QUERY_STATS.record("COMMIT", (time.perf_counter() - started) * 1000)
+
+    def rollback(self):
+        started = time.perf_counter()
+        self.connection.rollback()
+        QUERY_STATS.record("ROLLBACK", (time.perf_counter() - started) * 1000)
+
+
+class MySQLBackend:
+    # Hands out one pooled connection per operation. Checkout blocks while the
+    # pool is exhausted instead of failing, and every connection is pinged on
+    # the way out so one dropped by wait_timeout or a network blip is reopened.
+    dialect = MySQLDialect()
+
+    def __init__(self, config=None, pool_size=POOL_SIZE, pool_name="stormanag"):
+        # Imported here so SQLite-only installs do not need the driver
+        import mysql.connector
+
+        self.config = dict(DB_CONFIG if config is None else config)
+        # The C extension parses result sets much faster than the pure Python
+        # protocol, so only fall back to it when the extension is missing.
+        self.config.setdefault("use_pure", not mysql.connector.HAVE_CEXT)
+        # A streamed result abandoned halfway is drained when its cursor
+        # closes instead of poisoning the pooled connection
+        self.config.setdefault("consume_results", True)
+        self.pool_size = pool_size
+        self.pool_name = pool_name
+        self.pool = None
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(pool_size)
+
+    def get_pool(self):
+        from mysql.connector import pooling
+
+        with self.lock:
+            if self.pool is None:
+                self.pool = pooling.MySQLConnectionPool(
+                    pool_name=self.pool_name,
+                    pool_size=self.pool_size,
+                    pool_reset_session=True,
+                    **self.config
+                )
+                print(f"Created MySQL connection pool '{self.pool_name}' with {self.pool_size} connections")
+            return self.pool
+
+    @contextmanager
+    def connection(self):
+        import mysql.connector
+        from mysql.connector import pooling
+
+        if not self.slots.acquire(timeout=CHECKOUT_TIMEOUT):
+            raise pooling.PoolError("Timed out waiting for a free database connection")
+        try:
+            connection = self.get_pool().get_connection()
+            try:
+                connection.ping(reconnect=True, attempts=RECONNECT_ATTEMPTS, delay=RECONNECT_DELAY)
+                yield Connection(connection, self.dialect)
+            except Exception:
+                try:
+                    connection.rollback()
+                except mysql.connector.Error:
+                    pass
+                raise
+            finally:
+                # Closing a pooled connection returns it to the pool
+                connection.close()
+        finally:
+            self.slots.release()
+
+
+class SQLiteBackend:
+    # An embedded database file for single-node stores and server-free runs.
+    # Each thread keeps its own connection open, so an operation costs no
+    # connect at all; WAL lets readers run alongside the single writer.
+    dialect = SQLiteDialect()
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self.local = threading.local()
+
+    def connect(self):
+        # isolation_level=None leaves transactions to explicit BEGINs, the
+        # same as autocommit on a MySQL connection
+        connection = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None,
+                                     detect_types=sqlite3.PARSE_DECLTYPES)
+        for pragma in SQLITE_PRAGMAS:
+            connection.execute(pragma)
+        return Connection(connection, self.dialect)
+
+    @contextmanager
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.local.connection = self.connect()
+        try:
+            yield connection
+        except Exception:
+            if connection.connection.in_transaction:
+                connection.rollback()
+            raise
+
+
+def run_transaction(backend, work, after=None, attempts=TRANSACTION_ATTEMPTS):
+    # work(db) runs one whole transaction, commit included. When it loses a
+    # deadlock or times out on a lock it is rolled back and run again from
+    # the start, after a randomized, growing delay so the terminals that
+    # collided do not collide again. after(db) runs once, on the same
+    # connection, when work has succeeded; it is never retried.
+    attempt = 1
+    while True:
+        with backend.connection() as db:
+            try:
+                result = work(db)
+            except Exception as err:
+                if attempt >= attempts or not backend.dialect.is_retryable(err):
+                    raise
+                db.rollback()
+            else:
+                if after is not None:
+                    after(db)
+                return result
+        QUERY_STATS.record_retry()
+        time.sleep(RETRY_BASE_DELAY * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+        attempt += 1
+
+
+def create_backend(kind=None):
+    kind = kind or BACKEND
+    if kind == "sqlite":
+        return SQLiteBackend()
+    if kind == "mysql":
+        return MySQLBackend()
+    raise ValueError(f"Unknown database backend {kind!r}")
@@ -0,0 +1,189 @@
+import os
+from datetime import datetime, time, timedelta
+
+# Every change to Inventory.quantity is also appended here as a signed
+# movement, in the same transaction, so the stock of any product at any
+# time is its latest snapshot plus the movements after it
+MOVEMENT_KINDS = ("opening", "restock", "sale", "adjustment", "import")
+# Snapshots are taken at midnight, once the last transactions of the day
+# have had this long to commit
+LEDGER_COMPACT_LAG = timedelta(hours=1)
+LEDGER_COMPACT_INTERVAL = 60 * 60
+# Movements older than this are dropped once a snapshot covers them; stock
+# further back is then known as of each day's snapshot. 0 keeps them all.
+LEDGER_RETENTION_DAYS = int(os.environ.get("STORMANAG_LEDGER_RETENTION_DAYS", "365"))
+MOVEMENT_HISTORY_LIMIT = 200
+
+
+def record_movements(cursor, kind, quantities, sale_id=None, note=None):
+    # quantities: {product_id: signed change}. Must run inside the
+    # transaction that changes Inventory.quantity by the same amounts.
+    rows = [(product_id, quantity, kind, sale_id, note)
+            for product_id, quantity in sorted(quantities.items()) if quantity]
+    if rows:
+        cursor.executemany(f"""
+            INSERT INTO inventory_movements (product_id, moved_at, quantity, kind, sale_id, note)
+            VALUES (%s, {cursor.dialect.now}, %s, %s, %s, %s)
+        """, rows)
+
+
+def record_opening_balances(cursor):
+    # Starts the ledger from the stock already in Inventory
+    cursor.execute(f"""
+        INSERT INTO inventory_movements (product_id, moved_at, quantity, kind)
+        SELECT product_id, {cursor.dialect.now}, quantity, 'opening' FROM Inventory WHERE quantity <> 0
+    """)
+
+
+def adjust_stock(db, product_id, counted, note=None):
+    # Sets the stock to a counted quantity, e.g. after a stocktake or for
+    # damaged goods, and records the difference. Returns the change, or None
+    # when the product has no inventory row. A count below what open carts
+    # hold raises ValueError, as the till could not sell those units.
+    with db.cursor() as cursor:
+        cursor.execute(cursor.dialect.begin)
+        cursor.execute(f"SELECT quantity, reserved FROM Inventory WHERE product_id = %s{cursor.dialect.for_update}",
+                       (product_id,))
+        row = cursor.fetchone()
+        if row is None:
+            db.rollback()
+            return None
+        quantity, held = row
+        if counted < held:
+            db.rollback()
+            raise ValueError(f"Quantity {counted} is below the {held} unit(s) held in open carts")
+        change = counted - quantity
+        if change:
+            cursor.execute("UPDATE Inventory SET quantity = %s WHERE product_id = %s", (counted, product_id))
+            record_movements(cursor, "adjustment", {product_id: change}, note=note)
+    db.commit()
+    return change
+
+
+def fetch_time(cursor, query, params=()):
+    # MIN/MAX of a DATETIME column, or None; SQLite hands them back as text
+    cursor.execute(query, params)
+    value = cursor.fetchone()[0]
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value
+
+
+def product_filter(column, product_ids):
+    if product_ids is None:
+        return "", []
+    product_ids = list(product_ids)
+    return f" AND {column} IN ({', '.join(['%s'] * len(product_ids))})", product_ids
+
+
+def stock_at(cursor, when=None, product_ids=None):
+    # {product_id: quantity} at `when` (now by default): each product's
+    # snapshot from the last compaction before `when`, plus the movements
+    # between that compaction and `when`. Only the movements since one
+    # snapshot are read, however long the history is.
+    snapshot_at = fetch_time(cursor, "SELECT MAX(snapshot_at) FROM inventory_snapshots"
+                             + (" WHERE snapshot_at <= %s" if when else ""), (when,) if when else ())
+    stock = {}
+    if snapshot_at is not None:
+        condition, params = product_filter("s.product_id", product_ids)
+        cursor.execute(f"""
+            SELECT s.product_id, s.quantity FROM inventory_snapshots s
+            JOIN (
+                SELECT product_id, MAX(snapshot_at) AS snapshot_at FROM inventory_snapshots
+                WHERE snapshot_at <= %s GROUP BY product_id
+            ) latest ON latest.product_id = s.product_id AND latest.snapshot_at = s.snapshot_at
+            WHERE 1 = 1{condition}
+        """, [snapshot_at] + params)
+        stock.update(cursor.fetchall())
+
+    bounds, params = [], []
+    if snapshot_at is not None:
+        bounds.append("moved_at > %s")
+        params.append(snapshot_at)
+    if when:
+        bounds.append("moved_at <= %s")
+        params.append(when)
+    condition, ids = product_filter("product_id", product_ids)
+    cursor.execute(f"""
+        SELECT product_id, SUM(quantity) FROM inventory_movements
+        WHERE {' AND '.join(bounds) or '1 = 1'}{condition}
+        GROUP BY product_id
+    """, params + ids)
+    for product_id, quantity in cursor.fetchall():
+        stock[product_id] = stock.get(product_id, 0) + int(quantity)
+    return stock
+
+
+def ledger_horizon(cursor):
+    # The earliest time stock_at can answer for, or None when no movement
+    # has been dropped yet. Dropped movements all precede a snapshot, so once
+    # the oldest movement is later than the oldest snapshot some are gone.
+    oldest_snapshot = fetch_time(cursor, "SELECT MIN(snapshot_at) FROM inventory_snapshots")
+    oldest_movement = fetch_time(cursor, "SELECT MIN(moved_at) FROM inventory_movements")
+    if oldest_snapshot is not None and (oldest_movement is None or oldest_movement > oldest_snapshot):
+        return oldest_snapshot
+    return None
+
+
+def ledger_drift(cursor):
+    # [(product_id, Inventory.quantity, ledger balance)] where the two
+    # disagree; empty unless stock was changed behind the ledger's back
+    stock = stock_at(cursor)
+    cursor.execute("SELECT product_id, quantity FROM Inventory")
+    inventory = dict(cursor.fetchall())
+    return [(product_id, inventory.get(product_id, 0), stock.get(product_id, 0))
+            for product_id in sorted(set(stock) | set(inventory))
+            if inventory.get(product_id, 0) != stock.get(product_id, 0)]
+
+
+def movement_history(cursor, product_id, from_date=None, limit=MOVEMENT_HISTORY_LIMIT):
+    # Newest first; movements older than the retention window are gone
+    condition = " AND moved_at >= %s" if from_date else ""
+    cursor.execute(f"""
+        SELECT movement_id, moved_at, kind, quantity, sale_id, note FROM inventory_movements
+        WHERE product_id = %s{condition}
+        ORDER BY moved_at DESC, movement_id DESC
+        LIMIT %s
+    """, [product_id] + ([from_date] if from_date else []) + [limit])
+    return cursor.fetchall()
+
+
+def compact_ledger(db, cutoff=None, retention_days=LEDGER_RETENTION_DAYS):
+    # Rolls the movements up to `cutoff` (last midnight by default) into one
+    # snapshot row per product that moved since the previous compaction,
+    # then drops movements older than the retention window that a snapshot
+    # already covers. Snapshots are upserted, so terminals compacting at the
+    # same time write the same rows. Returns (snapshots written, movements
+    # dropped).
+    cutoff = cutoff or datetime.combine((datetime.now() - LEDGER_COMPACT_LAG).date(), time())
+    written = 0
+    with db.cursor() as cursor:
+        dialect = cursor.dialect
+        cursor.execute(dialect.begin)
+        previous = fetch_time(cursor, "SELECT MAX(snapshot_at) FROM inventory_snapshots")
+        if previous is None or previous < cutoff:
+            bound = " AND moved_at > %s" if previous is not None else ""
+            cursor.execute(f"""
+                SELECT product_id, SUM(quantity) FROM inventory_movements
+                WHERE moved_at <= %s{bound}
+                GROUP BY product_id
+            """, [cutoff] + ([previous] if previous is not None else []))
+            moved = {product_id: int(quantity) for product_id, quantity in cursor.fetchall()}
+            if moved:
+                balances = stock_at(cursor, previous, moved) if previous is not None else {}
+                cursor.executemany(dialect.upsert(
+                    "inventory_snapshots", ("product_id", "snapshot_at", "quantity"), ("product_id", "snapshot_at"),
+                    {"quantity": "{new}"}
+                ), [(product_id, cutoff, balances.get(product_id, 0) + quantity)
+                    for product_id, quantity in sorted(moved.items())])
+                written = len(moved)
+
+        dropped = 0
+        if retention_days:
+            covered = fetch_time(cursor, "SELECT MAX(snapshot_at) FROM inventory_snapshots WHERE snapshot_at <= %s",
+                                 (datetime.now() - timedelta(days=retention_days),))
+            if covered is not None:
+                cursor.execute("DELETE FROM inventory_movements WHERE moved_at <= %s", (covered,))
+                dropped = cursor.rowcount
+    db.commit()
+    return written, dropped
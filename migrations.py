@@ -0,0 +1,286 @@
+from ledger import record_opening_balances
+from rollups import rebuild_rollups
+
+MIGRATION_LOCK = "stormanag_migrations"
+MIGRATION_LOCK_TIMEOUT = 60
+
+
+def add_column_if_missing(table, column, definition, after=None):
+    def step(cursor):
+        if not cursor.dialect.column_exists(cursor, table, column):
+            cursor.execute(cursor.dialect.add_column(table, column, definition, after))
+    return step
+
+
+def create_index_if_missing(table, index, columns, unique=False):
+    def step(cursor):
+        if not cursor.dialect.index_exists(cursor, table, index):
+            cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX {index} ON {table} {columns}")
+    return step
+
+
+def track_changes(table):
+    def step(cursor):
+        if not cursor.dialect.column_exists(cursor, table, "last_modified"):
+            for statement in cursor.dialect.track_changes(table):
+                cursor.execute(statement)
+    return step
+
+
+# (version, description, steps). A step is either a SQL statement or a
+# callable taking a cursor. Statements are written for MySQL; {auto_id} and
+# {compressed} are filled in by the dialect. Secondary indexes are created
+# separately, because SQLite has no inline KEY clause, and only if missing,
+# so a migration MySQL half applied can run again. Never change what a
+# released migration does; add a new one instead.
+MIGRATIONS = [
+    (1, "Base schema", [
+        """CREATE TABLE IF NOT EXISTS Sellers (
+            seller_id {auto_id},
+            seller_name VARCHAR(100) NOT NULL,
+            contact_number VARCHAR(15) NOT NULL,
+            email VARCHAR(100),
+            CONSTRAINT unique_seller UNIQUE (seller_name, contact_number)
+        )""",
+        """CREATE TABLE IF NOT EXISTS Customers (
+            customer_id {auto_id},
+            customer_name VARCHAR(100) NOT NULL,
+            contact_number VARCHAR(15) NOT NULL,
+            email VARCHAR(100),
+            CONSTRAINT unique_customer UNIQUE (customer_name, contact_number)
+        )""",
+        """CREATE TABLE IF NOT EXISTS Products (
+            product_id {auto_id},
+            product_name VARCHAR(100) NOT NULL,
+            description TEXT,
+            price DECIMAL(10, 2) NOT NULL,
+            category VARCHAR(50),
+            CONSTRAINT unique_product UNIQUE (product_name)
+        )""",
+        """CREATE TABLE IF NOT EXISTS Inventory (
+            inventory_id {auto_id},
+            product_id INT NOT NULL,
+            quantity INT NOT NULL DEFAULT 0,
+            last_restocked DATE,
+            FOREIGN KEY (product_id) REFERENCES Products(product_id),
+            CONSTRAINT unique_inventory UNIQUE (product_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS Sales (
+            sale_id {auto_id},
+            customer_id INT,
+            seller_id INT,
+            sale_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+            total_amount DECIMAL(10, 2),
+            FOREIGN KEY (customer_id) REFERENCES Customers(customer_id),
+            FOREIGN KEY (seller_id) REFERENCES Sellers(seller_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS Sale_Items (
+            item_id {auto_id},
+            sale_id INT NOT NULL,
+            product_id INT NOT NULL,
+            quantity INT NOT NULL,
+            unit_price DECIMAL(10, 2) NOT NULL,
+            FOREIGN KEY (sale_id) REFERENCES Sales(sale_id),
+            FOREIGN KEY (product_id) REFERENCES Products(product_id)
+        )""",
+    ]),
+    (2, "Stock reservations", [
+        add_column_if_missing("Inventory", "reserved", "INT NOT NULL DEFAULT 0", after="quantity"),
+        """CREATE TABLE IF NOT EXISTS Stock_Reservations (
+            reservation_id {auto_id},
+            product_id INT NOT NULL,
+            quantity INT NOT NULL,
+            session_id VARCHAR(64) NOT NULL,
+            expires_at DATETIME NOT NULL,
+            FOREIGN KEY (product_id) REFERENCES Products(product_id)
+        )""",
+        create_index_if_missing("Stock_Reservations", "idx_reservations_session", "(session_id)"),
+        create_index_if_missing("Stock_Reservations", "idx_reservations_expiry", "(expires_at)"),
+    ]),
+    (3, "Indexes for sales reports and joins", [
+        # Covers the date-range scan, the keyset ordering and the total column
+        create_index_if_missing("Sales", "idx_sales_date", "(sale_date, sale_id, total_amount)"),
+        create_index_if_missing("Sales", "idx_sales_customer_date", "(customer_id, sale_date)"),
+        create_index_if_missing("Sales", "idx_sales_seller_date", "(seller_id, sale_date)"),
+        create_index_if_missing("Sale_Items", "idx_sale_items_product", "(product_id, sale_id)"),
+    ]),
+    (4, "Daily sales rollups", [
+        """CREATE TABLE IF NOT EXISTS daily_sales_summary (
+            summary_date DATE NOT NULL,
+            seller_id INT NOT NULL,
+            sale_count INT NOT NULL DEFAULT 0,
+            items_sold INT NOT NULL DEFAULT 0,
+            revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+            PRIMARY KEY (summary_date, seller_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS daily_product_summary (
+            summary_date DATE NOT NULL,
+            product_id INT NOT NULL,
+            sale_count INT NOT NULL DEFAULT 0,
+            quantity_sold INT NOT NULL DEFAULT 0,
+            revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+            PRIMARY KEY (summary_date, product_id)
+        )""",
+        create_index_if_missing("daily_product_summary", "idx_product_summary_product", "(product_id, summary_date)"),
+        # Backfill the existing history
+        rebuild_rollups,
+    ]),
+    (5, "Product SKU and barcode", [
+        add_column_if_missing("Products", "sku", "VARCHAR(64) NULL"),
+        add_column_if_missing("Products", "barcode", "VARCHAR(64) NULL"),
+        # NULLs do not collide, so products without codes are unaffected
+        create_index_if_missing("Products", "unique_product_sku", "(sku)", unique=True),
+        create_index_if_missing("Products", "unique_product_barcode", "(barcode)", unique=True),
+    ]),
+    (6, "Terminal identity on sales", [
+        add_column_if_missing("Sales", "terminal_id", "VARCHAR(64) NULL"),
+    ]),
+    (7, "Idempotency keys for replayed sales", [
+        add_column_if_missing("Sales", "idempotency_key", "VARCHAR(64) NULL"),
+        create_index_if_missing("Sales", "unique_sales_idempotency_key", "(idempotency_key)", unique=True),
+    ]),
+    (8, "Discount and tax on sales", [
+        # total_amount = SUM(quantity * unit_price) - discount_amount + tax_amount
+        add_column_if_missing("Sales", "discount_amount", "DECIMAL(10, 2) NOT NULL DEFAULT 0"),
+        add_column_if_missing("Sales", "tax_amount", "DECIMAL(10, 2) NOT NULL DEFAULT 0"),
+    ]),
+    (9, "Change tracking for the list views", [
+        track_changes("Sellers"),
+        track_changes("Customers"),
+        track_changes("Products"),
+        track_changes("Inventory"),
+        create_index_if_missing("Sellers", "idx_sellers_modified", "(last_modified)"),
+        create_index_if_missing("Customers", "idx_customers_modified", "(last_modified)"),
+        create_index_if_missing("Products", "idx_products_modified", "(last_modified)"),
+        create_index_if_missing("Inventory", "idx_inventory_modified", "(last_modified)"),
+    ]),
+    (10, "Reorder points and sales velocity", [
+        add_column_if_missing("Inventory", "min_stock", "INT NULL"),
+        add_column_if_missing("Inventory", "reorder_point", "INT NULL"),
+        # Exponentially weighted units sold per day, folded in up to velocity_through
+        add_column_if_missing("Inventory", "daily_velocity", "DOUBLE NOT NULL DEFAULT 0"),
+        add_column_if_missing("Inventory", "velocity_through", "DATE NULL"),
+        # Serves the low-stock query (reorder.REORDER_CONDITION); rows without
+        # a reorder point index as NULL and are never flagged
+        create_index_if_missing("Inventory", "idx_inventory_reorder", "((quantity - reserved - reorder_point))"),
+        create_index_if_missing("Inventory", "idx_inventory_velocity", "(velocity_through)"),
+    ]),
+    (11, "Inventory movement ledger", [
+        # Signed stock changes, insert only; see ledger.py
+        """CREATE TABLE IF NOT EXISTS inventory_movements (
+            movement_id {auto_id},
+            product_id INT NOT NULL,
+            moved_at DATETIME NOT NULL,
+            quantity INT NOT NULL,
+            kind VARCHAR(16) NOT NULL,
+            sale_id INT NULL,
+            note VARCHAR(200) NULL
+        )""",
+        # Each product's stock as of a compaction, for products that moved
+        # since the one before
+        """CREATE TABLE IF NOT EXISTS inventory_snapshots (
+            product_id INT NOT NULL,
+            snapshot_at DATETIME NOT NULL,
+            quantity INT NOT NULL,
+            PRIMARY KEY (product_id, snapshot_at)
+        )""",
+        create_index_if_missing("inventory_movements", "idx_movements_moved_at", "(moved_at)"),
+        create_index_if_missing("inventory_movements", "idx_movements_product", "(product_id, moved_at)"),
+        create_index_if_missing("inventory_snapshots", "idx_snapshots_snapshot_at", "(snapshot_at)"),
+        record_opening_balances,
+    ]),
+    (12, "Sales archive", [
+        # Closed months of Sales and Sale_Items, moved by archive.archive_month.
+        # Same columns, no foreign keys, ids kept as they were.
+        """CREATE TABLE IF NOT EXISTS Sales_Archive (
+            sale_id INT PRIMARY KEY,
+            customer_id INT,
+            seller_id INT,
+            sale_date DATETIME NOT NULL,
+            total_amount DECIMAL(10, 2),
+            discount_amount DECIMAL(10, 2) NOT NULL DEFAULT 0,
+            tax_amount DECIMAL(10, 2) NOT NULL DEFAULT 0,
+            terminal_id VARCHAR(64) NULL,
+            idempotency_key VARCHAR(64) NULL
+        ){compressed}""",
+        """CREATE TABLE IF NOT EXISTS Sale_Items_Archive (
+            item_id INT PRIMARY KEY,
+            sale_id INT NOT NULL,
+            product_id INT NOT NULL,
+            quantity INT NOT NULL,
+            unit_price DECIMAL(10, 2) NOT NULL
+        ){compressed}""",
+        """CREATE TABLE IF NOT EXISTS sales_archive_periods (
+            month DATE PRIMARY KEY,
+            sale_count INT NOT NULL,
+            item_count INT NOT NULL,
+            archived_at DATE NOT NULL
+        )""",
+        create_index_if_missing("Sales_Archive", "idx_sales_archive_date", "(sale_date, sale_id, total_amount)"),
+        create_index_if_missing("Sale_Items_Archive", "idx_sale_items_archive_sale", "(sale_id)"),
+    ]),
+    (13, "Idempotency keys in the sales archive", [
+        # create_sale looks replayed keys up in the archive as well
+        create_index_if_missing("Sales_Archive", "idx_sales_archive_idempotency_key", "(idempotency_key)"),
+    ]),
+    (14, "Sale items by sale", [
+        # MySQL indexes a foreign key by itself but SQLite does not, so each
+        # deleted sale (archiving, benchmark cleanup) scanned all of Sale_Items
+        create_index_if_missing("Sale_Items", "idx_sale_items_sale", "(sale_id)"),
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(cursor):
+    try:
+        cursor.execute("SELECT MAX(version) FROM schema_version")
+    except Exception as err:
+        if not cursor.dialect.is_missing_table(err):
+            raise
+        return 0
+    return cursor.fetchone()[0] or 0
+
+
+def migrate(db):
+    # An up-to-date database costs one SELECT; DDL only runs for migrations
+    # that have not been recorded yet.
+    with db.cursor() as cursor:
+        if schema_version(cursor) >= LATEST_VERSION:
+            return []
+
+        # Serialise terminals that start up against the same database
+        dialect = cursor.dialect
+        if not dialect.acquire_lock(cursor, MIGRATION_LOCK, MIGRATION_LOCK_TIMEOUT):
+            raise RuntimeError("Timed out waiting for another terminal to finish migrating the database")
+        try:
+            cursor.execute("""CREATE TABLE IF NOT EXISTS schema_version (
+                version INT PRIMARY KEY,
+                description VARCHAR(200) NOT NULL,
+                applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )""")
+            applied = []
+            for version, description, steps in MIGRATIONS:
+                # One transaction per migration. Only SQLite rolls DDL back
+                # with it; MySQL commits each CREATE/ALTER on its own, so a
+                # failed migration can leave some steps applied and every
+                # step must be safe to run again.
+                cursor.execute(dialect.begin)
+                if version <= schema_version(cursor):
+                    db.rollback()
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(cursor)
+                    else:
+                        cursor.execute(step.replace("{auto_id}", dialect.auto_id)
+                                       .replace("{compressed}", dialect.compressed))
+                cursor.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                               (version, description))
+                db.commit()
+                print(f"Applied migration {version}: {description}")
+                applied.append(version)
+            return applied
+        finally:
+            dialect.release_lock(cursor, MIGRATION_LOCK)
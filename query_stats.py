@@ -0,0 +1,263 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+
+# Statements slower than this are written to stderr and kept in the slow log
+SLOW_QUERY_MS = float(os.environ.get("STORMANAG_SLOW_QUERY_MS", "200"))
+# Also capture the plan of slow reads; costs one extra statement per slow query
+EXPLAIN_SLOW_QUERIES = os.environ.get("STORMANAG_EXPLAIN_SLOW", "") == "1"
+SLOW_LOG_SIZE = 100
+
+# Upper bounds of the latency histogram buckets in milliseconds; anything
+# slower lands in the last, unbounded bucket
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+EXPLAINABLE = ("SELECT", "UPDATE", "DELETE")
+
+WHITESPACE_RE = re.compile(r"\s+")
+# IN lists and multi-row VALUES vary in length with the data; fold them so
+# one statement is counted once however many values it was sent with
+PLACEHOLDER_LIST_RE = re.compile(r"%s(?:\s*,\s*%s)+")
+VALUES_ROWS_RE = re.compile(r"(\(%s(?:, \.\.\.)?\))(?:\s*,\s*\(%s(?:, \.\.\.)?\))+")
+
+
+@lru_cache(maxsize=1024)
+def normalize(query):
+    query = WHITESPACE_RE.sub(" ", query).strip()
+    query = PLACEHOLDER_LIST_RE.sub("%s, ...", query)
+    return VALUES_ROWS_RE.sub(r"\1, ...", query)
+
+
+class StatementStats:
+    def __init__(self, statement):
+        self.statement = statement
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def add(self, elapsed_ms, rows, error):
+        self.calls += 1
+        self.errors += error
+        self.rows += rows
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.buckets[bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the given fraction of calls
+        wanted = fraction * self.calls
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= wanted:
+                return bound
+        return self.max_ms
+
+    def as_dict(self):
+        return {
+            "statement": self.statement,
+            "calls": self.calls,
+            "errors": self.errors,
+            "rows": self.rows,
+            "total_ms": round(self.total_ms, 3),
+            "avg_ms": round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            "p95_ms": self.percentile(0.95),
+            "max_ms": round(self.max_ms, 3),
+            "buckets": dict(zip([str(bound) for bound in LATENCY_BUCKETS_MS] + ["+Inf"], self.buckets)),
+        }
+
+
+class ActionStats:
+    # One user-level operation (a button press, a CLI command) and the
+    # statements it took
+    def __init__(self, name):
+        self.name = name
+        self.runs = 0
+        self.queries = 0
+        self.total_ms = 0.0
+        self.last_queries = 0
+        self.last_ms = 0.0
+
+    def add(self, queries, elapsed_ms):
+        self.runs += 1
+        self.queries += queries
+        self.total_ms += elapsed_ms
+        self.last_queries = queries
+        self.last_ms = elapsed_ms
+
+    def summary(self):
+        return f"{self.name} = {self.last_queries} queries, {self.last_ms:.0f}ms"
+
+    def as_dict(self):
+        return {
+            "action": self.name,
+            "runs": self.runs,
+            "queries": self.queries,
+            "total_ms": round(self.total_ms, 3),
+            "last_queries": self.last_queries,
+            "last_ms": round(self.last_ms, 3),
+        }
+
+
+class QueryStats:
+    # Collects latency, row counts and round trips for every statement the
+    # db wrappers send, grouped by normalized statement text and by the
+    # action running on the calling thread. Safe to share between threads.
+    def __init__(self, slow_query_ms=SLOW_QUERY_MS, explain_slow=EXPLAIN_SLOW_QUERIES):
+        self.slow_query_ms = slow_query_ms
+        self.explain_slow = explain_slow
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.statements = {}
+            self.actions = {}
+            self.slow_queries = deque(maxlen=SLOW_LOG_SIZE)
+            self.slow_count = 0
+            self.retries = 0
+            self.started_at = time.time()
+
+    @contextmanager
+    def action(self, name):
+        # Statements run on this thread inside the block count towards
+        # `name`; nested actions count towards the outermost one
+        if getattr(self.local, "queries", None) is not None:
+            yield
+            return
+        self.local.queries = 0
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            queries = self.local.queries
+            self.local.queries = None
+            with self.lock:
+                action = self.actions.get(name)
+                if action is None:
+                    action = self.actions[name] = ActionStats(name)
+                action.add(queries, elapsed_ms)
+
+    def record(self, query, elapsed_ms, rows=0, error=False):
+        # Returns the statement's entry so rows fetched later can be added
+        statement = normalize(query)
+        if getattr(self.local, "queries", None) is not None:
+            self.local.queries += 1
+        with self.lock:
+            entry = self.statements.get(statement)
+            if entry is None:
+                entry = self.statements[statement] = StatementStats(statement)
+            entry.add(elapsed_ms, rows, error)
+        return entry
+
+    def record_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def add_rows(self, entry, rows):
+        with self.lock:
+            entry.rows += rows
+
+    def is_slow(self, elapsed_ms):
+        return elapsed_ms >= self.slow_query_ms
+
+    def wants_plan(self, query):
+        return self.explain_slow and query.lstrip()[:6].upper() in EXPLAINABLE
+
+    def record_slow(self, query, params, elapsed_ms, plan=None):
+        statement = normalize(query)
+        print(f"Slow query ({elapsed_ms:.1f} ms): {statement}", file=sys.stderr)
+        with self.lock:
+            self.slow_count += 1
+            self.slow_queries.append({
+                "at": time.time(),
+                "elapsed_ms": round(elapsed_ms, 3),
+                "statement": statement,
+                "params": [repr(param) for param in params or ()][:20],
+                "plan": plan,
+            })
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "since": self.started_at,
+                "slow_query_ms": self.slow_query_ms,
+                "slow_queries_total": self.slow_count,
+                "retries_total": self.retries,
+                "statements": sorted((entry.as_dict() for entry in self.statements.values()),
+                                     key=lambda entry: entry["total_ms"], reverse=True),
+                "actions": sorted((action.as_dict() for action in self.actions.values()),
+                                  key=lambda action: action["total_ms"], reverse=True),
+                "slow_queries": list(self.slow_queries),
+            }
+
+    def summaries(self):
+        with self.lock:
+            return [action.summary() for action in self.actions.values()]
+
+    def to_json(self, indent=2):
+        return json.dumps(self.snapshot(), indent=indent, default=str)
+
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP stormanag_query_duration_seconds Time spent executing each statement.",
+            "# TYPE stormanag_query_duration_seconds histogram",
+        ]
+        for entry in snapshot["statements"]:
+            label = f'statement="{escape_label(entry["statement"])}"'
+            cumulative = 0
+            for bound, count in entry["buckets"].items():
+                cumulative += count
+                le = bound if bound == "+Inf" else repr(float(bound) / 1000)
+                lines.append(f'stormanag_query_duration_seconds_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f"stormanag_query_duration_seconds_sum{{{label}}} {entry['total_ms'] / 1000}")
+            lines.append(f"stormanag_query_duration_seconds_count{{{label}}} {entry['calls']}")
+        for name, kind, key, help_text in (
+                ("stormanag_query_rows_total", "counter", "rows", "Rows returned or affected per statement."),
+                ("stormanag_query_errors_total", "counter", "errors", "Statements that raised an error.")):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for entry in snapshot["statements"]:
+                lines.append(f'{name}{{statement="{escape_label(entry["statement"])}"}} {entry[key]}')
+        for name, key, help_text in (
+                ("stormanag_action_runs_total", "runs", "Times each user action ran."),
+                ("stormanag_action_queries_total", "queries", "Statements sent by each user action."),
+                ("stormanag_action_duration_seconds_total", "total_ms", "Time spent in each user action.")):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for action in snapshot["actions"]:
+                value = action[key] / 1000 if key == "total_ms" else action[key]
+                lines.append(f'{name}{{action="{escape_label(action["action"])}"}} {value}')
+        lines.append("# HELP stormanag_slow_queries_total Statements slower than the slow query threshold.")
+        lines.append("# TYPE stormanag_slow_queries_total counter")
+        lines.append(f"stormanag_slow_queries_total {snapshot['slow_queries_total']}")
+        lines.append("# HELP stormanag_transaction_retries_total Transactions rerun after a deadlock or lock timeout.")
+        lines.append("# TYPE stormanag_transaction_retries_total counter")
+        lines.append(f"stormanag_transaction_retries_total {snapshot['retries_total']}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path, fmt="json"):
+        text = self.to_prometheus() if fmt == "prometheus" else self.to_json()
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Shared by every backend in the process
+QUERY_STATS = QueryStats()
@@ -0,0 +1,122 @@
+import math
+import os
+from datetime import date, timedelta
+
+# Days of sales a product's stock should cover; products with less than
+# this are flagged for reordering
+REORDER_COVER_DAYS = int(os.environ.get("STORMANAG_REORDER_DAYS", "7"))
+# The sales velocity is an exponentially weighted daily rate; a day's sales
+# count half as much this many days later
+VELOCITY_HALF_LIFE_DAYS = 14
+VELOCITY_ALPHA = 1 - 0.5 ** (1 / VELOCITY_HALF_LIFE_DAYS)
+# History read for a product seen for the first time
+VELOCITY_WARMUP_DAYS = 90
+LOW_STOCK_CHECK_INTERVAL = 5 * 60
+LOW_STOCK_LIMIT = 500
+
+# available <= reorder_point, spelled the way idx_inventory_reorder indexes it
+REORDER_CONDITION = "i.quantity - i.reserved - i.reorder_point <= 0"
+
+
+def update_velocity(db, through=None):
+    # Folds the days since each product's velocity was last updated, up to
+    # `through` (yesterday by default, the last complete day), into its
+    # moving average. Reads only those days of daily_product_summary, never
+    # the sales history. Rows are guarded by velocity_through, so a second
+    # terminal running the same update concurrently changes nothing.
+    # Returns the number of days folded in.
+    through = through or date.today() - timedelta(days=1)
+    decay = 1 - VELOCITY_ALPHA
+    folded = 0
+    with db.cursor() as cursor:
+        cursor.execute(cursor.dialect.begin)
+        # New products start from zero at the beginning of the warm-up window
+        cursor.execute("""
+            UPDATE Inventory SET daily_velocity = 0, velocity_through = %s WHERE velocity_through IS NULL
+        """, (through - timedelta(days=VELOCITY_WARMUP_DAYS),))
+        cursor.execute("SELECT DISTINCT velocity_through FROM Inventory WHERE velocity_through < %s", (through,))
+        for (since,) in cursor.fetchall():
+            days = (through - since).days
+            cursor.execute("""
+                SELECT summary_date, product_id, quantity_sold FROM daily_product_summary
+                WHERE summary_date > %s AND summary_date <= %s
+            """, (since, through))
+            # Each day's sales weighted by how long ago it was, relative to `through`
+            added = {}
+            for summary_date, product_id, quantity in cursor.fetchall():
+                weight = VELOCITY_ALPHA * decay ** (through - summary_date).days
+                added[product_id] = added.get(product_id, 0) + weight * int(quantity)
+            if added:
+                cursor.executemany("""
+                    UPDATE Inventory SET daily_velocity = daily_velocity * %s + %s, velocity_through = %s
+                    WHERE product_id = %s AND velocity_through = %s
+                """, [(decay ** days, rate, through, product_id, since) for product_id, rate in added.items()])
+            # Products without sales in those days only decay
+            cursor.execute("""
+                UPDATE Inventory SET daily_velocity = daily_velocity * %s, velocity_through = %s
+                WHERE velocity_through = %s
+            """, (decay ** days, through, since))
+            folded = max(folded, days)
+        if folded:
+            update_reorder_points(cursor)
+    db.commit()
+    return folded
+
+
+def update_reorder_points(cursor, product_id=None):
+    # Enough stock for REORDER_COVER_DAYS at the current velocity, and never
+    # below a manually set minimum. Products that neither sell nor have a
+    # minimum get no reorder point and are never flagged.
+    query = f"""
+        UPDATE Inventory SET reorder_point = CASE
+            WHEN daily_velocity > 0 OR min_stock IS NOT NULL
+            THEN {cursor.dialect.greatest("COALESCE(min_stock, 0)", "ROUND(daily_velocity * %s)")}
+        END
+    """
+    params = [REORDER_COVER_DAYS]
+    if product_id is not None:
+        query += " WHERE product_id = %s"
+        params.append(product_id)
+    cursor.execute(query, params)
+
+
+def set_min_stock(db, product_id, min_stock):
+    # None removes the minimum and leaves the reorder point to the velocity
+    with db.cursor() as cursor:
+        cursor.execute(cursor.dialect.begin)
+        cursor.execute("UPDATE Inventory SET min_stock = %s WHERE product_id = %s", (min_stock, product_id))
+        found = cursor.rowcount == 1
+        if found:
+            update_reorder_points(cursor, product_id)
+    db.commit()
+    return found
+
+
+def low_stock(cursor, days=None, limit=LOW_STOCK_LIMIT):
+    # Products whose stock is at or below their reorder point, read through
+    # the expression index so the cost follows the number flagged, not the
+    # catalog size. `days` asks for a different horizon than the reorder
+    # points were set for; that cannot use the index and reads all of
+    # Inventory (still not the sales history).
+    if days is None:
+        condition, params = REORDER_CONDITION, []
+    else:
+        condition = "i.quantity - i.reserved <= i.daily_velocity * %s AND i.daily_velocity > 0"
+        params = [days]
+    cursor.execute(f"""
+        SELECT i.product_id, p.product_name, p.sku, i.quantity - i.reserved, i.reorder_point, i.daily_velocity
+        FROM Inventory i
+        JOIN Products p ON p.product_id = i.product_id
+        WHERE {condition}
+        ORDER BY i.quantity - i.reserved - i.reorder_point
+        LIMIT %s
+    """, params + [limit])
+    return cursor.fetchall()
+
+
+def days_left(available, velocity):
+    # Days until the stock runs out at the current velocity; None when the
+    # product does not sell
+    if not velocity or velocity <= 0:
+        return None
+    return max(math.floor(max(available, 0) / velocity), 0)
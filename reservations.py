@@ -0,0 +1,132 @@
+import uuid
+from datetime import date
+
+from ledger import record_movements
+
+# Seconds a cart may hold stock before the sweeper hands it back
+RESERVATION_TTL = 15 * 60
+RESERVATION_SWEEP_INTERVAL = 60
+
+
+class InsufficientStockError(Exception):
+    pass
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+def reserve_stock(db, session_id, product_id, quantity):
+    # The conditional UPDATE is the whole check: it only succeeds while
+    # unreserved stock covers the request, so two tills can never both
+    # claim the last unit.
+    with db.cursor() as cursor:
+        cursor.execute(cursor.dialect.begin)
+        cursor.execute("""
+            UPDATE Inventory
+            SET reserved = reserved + %s
+            WHERE product_id = %s AND quantity - reserved >= %s
+        """, (quantity, product_id, quantity))
+        if cursor.rowcount != 1:
+            cursor.execute("SELECT quantity - reserved FROM Inventory WHERE product_id = %s", (product_id,))
+            result = cursor.fetchone()
+            db.rollback()
+            if result is None:
+                raise InsufficientStockError("Product not available in inventory")
+            raise InsufficientStockError(f"Not enough stock. Only {result[0]} available")
+
+        expires_at = cursor.dialect.seconds_from_now()
+        cursor.execute(f"""
+            INSERT INTO Stock_Reservations (product_id, quantity, session_id, expires_at)
+            VALUES (%s, %s, %s, {expires_at})
+        """, (product_id, quantity, session_id, RESERVATION_TTL))
+        reservation_id = cursor.lastrowid
+
+        # Any activity on a cart keeps all of its holds alive
+        cursor.execute(f"""
+            UPDATE Stock_Reservations SET expires_at = {expires_at}
+            WHERE session_id = %s
+        """, (RESERVATION_TTL, session_id))
+    db.commit()
+    return reservation_id
+
+
+def held_quantities(cursor, session_id):
+    # Must run inside the caller's transaction; locks the session's holds
+    cursor.execute(f"""
+        SELECT product_id, SUM(quantity) FROM Stock_Reservations
+        WHERE session_id = %s
+        GROUP BY product_id{cursor.dialect.for_update}
+    """, (session_id,))
+    return {product_id: int(quantity) for product_id, quantity in cursor.fetchall()}
+
+
+def lock_inventory(cursor, product_ids):
+    # Must run inside the caller's transaction. Row locks are taken in
+    # product_id order, so transactions touching overlapping products queue
+    # up behind each other instead of deadlocking. SQLite's BEGIN IMMEDIATE
+    # already serialises writers.
+    if not cursor.dialect.for_update:
+        return
+    product_ids = sorted(set(product_ids))
+    placeholders = ", ".join(["%s"] * len(product_ids))
+    cursor.execute(f"""
+        SELECT product_id FROM Inventory WHERE product_id IN ({placeholders})
+        ORDER BY product_id{cursor.dialect.for_update}
+    """, product_ids)
+    cursor.fetchall()
+
+
+def release_holds(cursor, condition, params):
+    cursor.execute(f"""
+        SELECT reservation_id, product_id, quantity FROM Stock_Reservations
+        WHERE {condition}{cursor.dialect.for_update}
+    """, params)
+    holds = cursor.fetchall()
+    if not holds:
+        return 0
+
+    quantities = {}
+    for _, product_id, quantity in holds:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    lock_inventory(cursor, quantities)
+    quantities = dict(sorted(quantities.items()))
+    derived = " UNION ALL ".join(["SELECT %s AS product_id, %s AS quantity"] * len(quantities))
+    dialect = cursor.dialect
+    cursor.execute(dialect.update_join("Inventory", "i", derived, "i.product_id = d.product_id",
+                                       {"reserved": dialect.greatest("i.reserved - d.quantity", "0")}),
+                   [value for pair in quantities.items() for value in pair])
+
+    ids = [hold[0] for hold in holds]
+    placeholders = ", ".join(["%s"] * len(ids))
+    cursor.execute(f"DELETE FROM Stock_Reservations WHERE reservation_id IN ({placeholders})", ids)
+    return len(ids)
+
+
+def release_session(db, session_id):
+    with db.cursor() as cursor:
+        cursor.execute(cursor.dialect.begin)
+        released = release_holds(cursor, "session_id = %s", (session_id,))
+    db.commit()
+    return released
+
+
+def expire_reservations(db):
+    # Hands back stock held by carts that were abandoned
+    with db.cursor() as cursor:
+        cursor.execute(cursor.dialect.begin)
+        released = release_holds(cursor, f"expires_at < {cursor.dialect.now}", ())
+    db.commit()
+    return released
+
+
+def restock(db, product_id, quantity):
+    # A single upsert, so concurrent restocks add up instead of overwriting
+    # each other, and its movement in the ledger
+    with db.cursor() as cursor:
+        cursor.execute(cursor.dialect.begin)
+        cursor.execute(cursor.dialect.upsert("Inventory", ("product_id", "quantity", "last_restocked"), ("product_id",),
+                                             {"quantity": "quantity + {new}", "last_restocked": "{new}"}),
+                       (product_id, quantity, date.today()))
+        record_movements(cursor, "restock", {product_id: quantity})
+    db.commit()
@@ -0,0 +1,98 @@
+from archive import SALE_ITEMS_HISTORY, SALES_HISTORY
+
+PERIODS = ("Day", "Week", "Month")
+BREAKDOWNS = ("All", "Seller", "Product")
+
+
+def record_sale(cursor, sale_date, seller_id, total_amount, lines):
+    # Runs inside the sale transaction so the rollups can never drift from
+    # the Sales and Sale_Items rows they summarise
+    summary_date = sale_date.date()
+    dialect = cursor.dialect
+    cursor.execute(dialect.upsert(
+        "daily_sales_summary", ("summary_date", "seller_id", "sale_count", "items_sold", "revenue"),
+        ("summary_date", "seller_id"),
+        {"sale_count": "sale_count + 1", "items_sold": "items_sold + {new}", "revenue": "revenue + {new}"}
+    ), (summary_date, seller_id or 0, 1, sum(quantity for _, quantity, _ in lines), total_amount))
+
+    products = {}
+    for product_id, quantity, unit_price in lines:
+        sold, revenue = products.get(product_id, (0, 0))
+        products[product_id] = (sold + quantity, revenue + quantity * unit_price)
+    cursor.executemany(dialect.upsert(
+        "daily_product_summary", ("summary_date", "product_id", "sale_count", "quantity_sold", "revenue"),
+        ("summary_date", "product_id"),
+        {"sale_count": "sale_count + 1", "quantity_sold": "quantity_sold + {new}", "revenue": "revenue + {new}"}
+    ), [(summary_date, product_id, 1, sold, revenue) for product_id, (sold, revenue) in products.items()])
+
+
+def rebuild_rollups(cursor, from_date=None, archived=False):
+    # Recomputes the rollups from Sales/Sale_Items, for backfilling history or
+    # repairing them; from_date limits the work to recent days. archived
+    # includes the archive tables, for ranges that reach back into them. The
+    # caller owns the transaction.
+    sales, items = (SALES_HISTORY, SALE_ITEMS_HISTORY) if archived else ("Sales", "Sale_Items")
+    condition = " WHERE s.sale_date >= %s" if from_date else ""
+    params = (from_date,) if from_date else ()
+    cursor.execute("DELETE FROM daily_sales_summary" + (" WHERE summary_date >= %s" if from_date else ""), params)
+    cursor.execute("DELETE FROM daily_product_summary" + (" WHERE summary_date >= %s" if from_date else ""), params)
+    cursor.execute(f"""
+        INSERT INTO daily_sales_summary (summary_date, seller_id, sale_count, items_sold, revenue)
+        SELECT DATE(s.sale_date), COALESCE(s.seller_id, 0), COUNT(*),
+               COALESCE(SUM(items.quantity), 0), COALESCE(SUM(s.total_amount), 0)
+        FROM {sales} s
+        LEFT JOIN (
+            SELECT sale_id, SUM(quantity) AS quantity FROM {items} si GROUP BY sale_id
+        ) items ON items.sale_id = s.sale_id
+        {condition}
+        GROUP BY DATE(s.sale_date), COALESCE(s.seller_id, 0)
+    """, params)
+    cursor.execute(f"""
+        INSERT INTO daily_product_summary (summary_date, product_id, sale_count, quantity_sold, revenue)
+        SELECT DATE(s.sale_date), si.product_id, COUNT(DISTINCT s.sale_id),
+               SUM(si.quantity), SUM(si.quantity * si.unit_price)
+        FROM {sales} s
+        JOIN {items} si ON si.sale_id = s.sale_id
+        {condition}
+        GROUP BY DATE(s.sale_date), si.product_id
+    """, params)
+
+
+def sales_totals(cursor, period="Day", breakdown="All", from_date=None, to_date=None):
+    if period not in PERIODS:
+        raise ValueError(f"Unknown period {period!r}")
+    bucket = cursor.dialect.date_bucket(period, "summary_date")
+    if breakdown == "Product":
+        query = f"""
+            SELECT {bucket} AS period, p.product_name, SUM(r.sale_count), SUM(r.quantity_sold), SUM(r.revenue)
+            FROM daily_product_summary r
+            LEFT JOIN Products p ON p.product_id = r.product_id
+        """
+        group = ", r.product_id, p.product_name"
+    elif breakdown == "Seller":
+        query = f"""
+            SELECT {bucket} AS period, sl.seller_name, SUM(r.sale_count), SUM(r.items_sold), SUM(r.revenue)
+            FROM daily_sales_summary r
+            LEFT JOIN Sellers sl ON sl.seller_id = r.seller_id
+        """
+        group = ", r.seller_id, sl.seller_name"
+    else:
+        query = f"""
+            SELECT {bucket} AS period, 'All', SUM(r.sale_count), SUM(r.items_sold), SUM(r.revenue)
+            FROM daily_sales_summary r
+        """
+        group = ""
+
+    query += " WHERE 1=1"
+    params = []
+    if from_date:
+        query += " AND r.summary_date >= %s"
+        params.append(from_date)
+    if to_date:
+        query += " AND r.summary_date <= %s"
+        params.append(to_date)
+    query += f" GROUP BY period{group} ORDER BY period DESC, SUM(r.revenue) DESC"
+
+    cursor.execute(query, tuple(params))
+    return cursor.fetchall()
+
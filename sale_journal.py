@@ -0,0 +1,223 @@
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from decimal import Decimal
+from typing import List, NamedTuple, Optional
+
+from store_service import InsufficientStockError, StoreError
+
+# Local file completed sales are written to before they reach the store
+# database. On by default; set it empty to record each sale synchronously.
+SALE_JOURNAL = os.environ.get("STORMANAG_SALE_JOURNAL", "sale_journal.db")
+FLUSH_BATCH_SIZE = 50
+# Seconds the flusher waits after the database failed, doubling up to the max
+FLUSH_RETRY_DELAY = 1
+FLUSH_MAX_RETRY_DELAY = 30
+
+JOURNAL_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS pending_sales (
+        idempotency_key TEXT PRIMARY KEY,
+        queued_at TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT
+    )
+"""
+
+
+class QueuedSale(NamedTuple):
+    idempotency_key: str
+    customer_id: int
+    seller_id: int
+    # (product_id, quantity, unit_price) as in SaleLine
+    lines: list
+    session_id: Optional[str]
+    sale_date: datetime
+    discount: Decimal = Decimal("0.00")
+    tax: Decimal = Decimal("0.00")
+    attempts: int = 0
+    last_error: Optional[str] = None
+
+    @property
+    def total_amount(self):
+        subtotal = sum((quantity * unit_price for _, quantity, unit_price in self.lines), Decimal("0.00"))
+        return subtotal - self.discount + self.tax
+
+
+def encode(sale):
+    return json.dumps({
+        "customer_id": sale.customer_id,
+        "seller_id": sale.seller_id,
+        "lines": [[product_id, quantity, str(unit_price)] for product_id, quantity, unit_price in sale.lines],
+        "session_id": sale.session_id,
+        "sale_date": sale.sale_date.isoformat(" "),
+        "discount": str(sale.discount),
+        "tax": str(sale.tax),
+    })
+
+
+def decode(key, payload, attempts, last_error):
+    data = json.loads(payload)
+    lines = [(product_id, quantity, Decimal(unit_price)) for product_id, quantity, unit_price in data["lines"]]
+    # Sales queued before discounts and tax were recorded have neither
+    return QueuedSale(key, data["customer_id"], data["seller_id"], lines, data["session_id"],
+                      datetime.fromisoformat(data["sale_date"]), Decimal(data.get("discount", "0.00")),
+                      Decimal(data.get("tax", "0.00")), attempts, last_error)
+
+
+class SaleJournal:
+    # Append-only queue of completed sales in a local SQLite file. A sale is
+    # durable as soon as append() returns, whatever state the store database
+    # is in; it leaves the journal only once the database has committed it.
+    def __init__(self, path=SALE_JOURNAL):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        # Every append is fsynced; a queued sale must survive a power cut
+        self.connection.execute("PRAGMA synchronous = FULL")
+        self.connection.execute(JOURNAL_SCHEMA)
+
+    def append(self, customer_id, seller_id, lines, session_id=None, sale_date=None,
+               discount=Decimal("0.00"), tax=Decimal("0.00")) -> QueuedSale:
+        sale = QueuedSale(uuid.uuid4().hex, customer_id, seller_id, [tuple(line) for line in lines], session_id,
+                          sale_date or datetime.now().replace(microsecond=0), discount, tax)
+        with self.lock:
+            self.connection.execute("INSERT INTO pending_sales (idempotency_key, queued_at, payload) VALUES (?, ?, ?)",
+                                    (sale.idempotency_key, datetime.now().isoformat(" "), encode(sale)))
+        return sale
+
+    def pending(self, limit=FLUSH_BATCH_SIZE) -> List[QueuedSale]:
+        # Oldest first, so sales reach the database in the order they were made
+        with self.lock:
+            rows = self.connection.execute("""
+                SELECT idempotency_key, payload, attempts, last_error FROM pending_sales
+                WHERE failed = 0 ORDER BY queued_at, rowid LIMIT ?
+            """, (limit,)).fetchall()
+        return [decode(*row) for row in rows]
+
+    def failed(self) -> List[QueuedSale]:
+        with self.lock:
+            rows = self.connection.execute("""
+                SELECT idempotency_key, payload, attempts, last_error FROM pending_sales
+                WHERE failed = 1 ORDER BY queued_at, rowid
+            """).fetchall()
+        return [decode(*row) for row in rows]
+
+    def remove(self, key):
+        with self.lock:
+            self.connection.execute("DELETE FROM pending_sales WHERE idempotency_key = ?", (key,))
+
+    def record_error(self, key, err, permanent=False):
+        # Permanent failures (e.g. stock sold elsewhere while offline) are
+        # parked for someone to look at instead of being retried forever
+        with self.lock:
+            self.connection.execute("""
+                UPDATE pending_sales SET attempts = attempts + 1, last_error = ?, failed = ?
+                WHERE idempotency_key = ?
+            """, (str(err), int(permanent), key))
+
+    def retry_failed(self):
+        with self.lock:
+            return self.connection.execute("UPDATE pending_sales SET failed = 0 WHERE failed = 1").rowcount
+
+    def counts(self):
+        # (waiting, failed)
+        with self.lock:
+            row = self.connection.execute("""
+                SELECT COALESCE(SUM(failed = 0), 0), COALESCE(SUM(failed = 1), 0) FROM pending_sales
+            """).fetchone()
+        return row[0], row[1]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class JournalFlusher:
+    # Background thread that drains the journal into the store database.
+    # Each sale is committed with its idempotency key, so one that was
+    # committed just before a crash or a lost connection is recognised on
+    # replay instead of being recorded twice.
+    def __init__(self, service, journal, batch_size=FLUSH_BATCH_SIZE):
+        self.service = service
+        self.journal = journal
+        self.batch_size = batch_size
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.thread = None
+        self.last_error = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def wake(self):
+        self.wakeup.set()
+
+    def stop(self, timeout=5):
+        self.stopping = True
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self):
+        delay = FLUSH_RETRY_DELAY
+        while not self.stopping:
+            try:
+                flushed = self.flush()
+            except Exception as err:
+                # The database is unreachable; the sales stay queued
+                self.last_error = err
+                print(f"Sale journal flush failed, retrying in {delay} s: {err}")
+                self.wakeup.wait(delay)
+                self.wakeup.clear()
+                delay = min(delay * 2, FLUSH_MAX_RETRY_DELAY)
+                continue
+            self.last_error = None
+            delay = FLUSH_RETRY_DELAY
+            if flushed:
+                # The database is back; stop selling from the catalog alone
+                self.service.offline_until = 0
+            if flushed < self.batch_size:
+                self.wakeup.wait(FLUSH_MAX_RETRY_DELAY)
+                self.wakeup.clear()
+
+    def flush(self):
+        # Sends one batch, oldest first; returns how many sales left the
+        # journal. A sale the database refuses for its contents (e.g. a
+        # customer that does not exist) is parked and the batch goes on; any
+        # other database error stops the batch so the order is kept.
+        flushed = 0
+        for sale in self.journal.pending(self.batch_size):
+            try:
+                self.service.create_sale(sale.customer_id, sale.seller_id, sale.lines, sale.session_id,
+                                         sale.sale_date, idempotency_key=sale.idempotency_key,
+                                         discount=sale.discount, tax=sale.tax)
+            except (StoreError, InsufficientStockError) as err:
+                self.journal.record_error(sale.idempotency_key, err, permanent=True)
+                print(f"Queued sale {sale.idempotency_key} could not be recorded: {err}")
+            except Exception as err:
+                if not self.service.backend.dialect.is_data_error(err):
+                    self.journal.record_error(sale.idempotency_key, err)
+                    raise
+                self.journal.record_error(sale.idempotency_key, err, permanent=True)
+                print(f"Queued sale {sale.idempotency_key} was refused by the database: {err}")
+            else:
+                self.journal.remove(sale.idempotency_key)
+            flushed += 1
+        return flushed
+
+    def drain(self):
+        # Flushes until the journal is empty, for the CLI and for shutdown
+        total = 0
+        while True:
+            flushed = self.flush()
+            total += flushed
+            if flushed < self.batch_size:
+                return total
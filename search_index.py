@@ -0,0 +1,112 @@
+import heapq
+import re
+import threading
+from bisect import bisect_left, insort
+
+SEARCH_LIMIT = 50
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or "").lower())
+
+
+class ProductSearchIndex:
+    # Inverted index from word to product ids over name, category and
+    # description. Each query term matches every indexed word it is a prefix
+    # of, found by bisecting the sorted word list, and all terms must match.
+    # Products are added and removed one at a time, so a new product is
+    # searchable without reloading the catalog.
+    def __init__(self):
+        self.postings = {}
+        self.words = []
+        self.documents = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def build(cls, products):
+        # Bulk load from (product_id, name, category, description) tuples,
+        # sorting the word list once instead of inserting word by word
+        index = cls()
+        for product_id, name, category, description in products:
+            for word in index.store(product_id, name, category, description):
+                index.postings.setdefault(word, set()).add(product_id)
+        index.words = sorted(index.postings)
+        return index
+
+    def store(self, product_id, name, category, description):
+        name_words = tuple(tokenize(name))
+        words = set(name_words) | set(tokenize(category)) | set(tokenize(description))
+        self.documents[product_id] = ((name or "").lower(), name_words, words)
+        return words
+
+    def add(self, product_id, name, category=None, description=None):
+        with self.lock:
+            self.discard(product_id)
+            for word in self.store(product_id, name, category, description):
+                ids = self.postings.get(word)
+                if ids is None:
+                    self.postings[word] = ids = set()
+                    insort(self.words, word)
+                ids.add(product_id)
+
+    def remove(self, product_id):
+        with self.lock:
+            self.discard(product_id)
+
+    def discard(self, product_id):
+        document = self.documents.pop(product_id, None)
+        if document is None:
+            return
+        for word in document[2]:
+            ids = self.postings[word]
+            ids.discard(product_id)
+            if not ids:
+                del self.postings[word]
+                del self.words[bisect_left(self.words, word)]
+
+    def prefix_matches(self, term):
+        start = bisect_left(self.words, term)
+        end = bisect_left(self.words, term + "\uffff", start)
+        ids = set()
+        for word in self.words[start:end]:
+            ids |= self.postings[word]
+        return ids
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        # Returns up to `limit` product ids: names starting with the query
+        # first, then names containing a word starting with it, then matches
+        # on category or description only; alphabetical within each group.
+        query = (query or "").strip().lower()
+        terms = tokenize(query)
+        with self.lock:
+            if not terms:
+                candidates = self.documents
+            else:
+                candidates = None
+                for term in terms:
+                    ids = self.prefix_matches(term)
+                    candidates = ids if candidates is None else candidates & ids
+                    if not candidates:
+                        break
+            exact_id = int(query) if query.isdigit() else None
+            if exact_id in self.documents:
+                # Typing a product id finds it directly
+                candidates = set(candidates) | {exact_id}
+            first = terms[0] if terms else ""
+            documents = self.documents
+
+            def rank(product_id):
+                name, name_words, _ = documents[product_id]
+                if product_id == exact_id or name.startswith(query):
+                    return 0, name, product_id
+                for word in name_words:
+                    if word.startswith(first):
+                        return 1, name, product_id
+                return 2, name, product_id
+
+            return heapq.nsmallest(limit, candidates, key=rank)
+
+    def __len__(self):
+        return len(self.documents)
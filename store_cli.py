@@ -0,0 +1,383 @@
+import argparse
+import sys
+from datetime import date, datetime
+from itertools import chain
+
+from bulk_io import EXPORT_QUERIES, IMPORT_CHUNK_SIZE, IMPORTS, export_csv, import_csv
+from cart import Cart
+from query_stats import QUERY_STATS
+from sale_journal import SALE_JOURNAL, JournalFlusher, SaleJournal
+from store_service import InsufficientStockError, StoreError, StoreService
+
+
+def print_rows(rows, headers):
+    # Tab separated so the output can be piped into other tools. rows may be
+    # a stream, which is printed as it is read.
+    print("\t".join(headers))
+    for row in rows:
+        print("\t".join("" if value is None else str(value) for value in row))
+
+
+def parse_item(value):
+    try:
+        product_id, quantity = value.split(":")
+        return int(product_id), int(quantity)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected PRODUCT_ID:QUANTITY, got {value!r}")
+
+
+def cmd_migrate(service, args):
+    if not service.migrate():
+        print("Schema is up to date")
+
+
+def cmd_add_seller(service, args):
+    seller = service.add_seller(args.name, args.contact, args.email)
+    print(f"Added seller {seller.seller_id}")
+
+
+def cmd_add_customer(service, args):
+    customer = service.add_customer(args.name, args.contact, args.email)
+    print(f"Added customer {customer.customer_id}")
+
+
+def cmd_add_product(service, args):
+    product = service.add_product(args.name, args.price, args.description, args.category, args.sku, args.barcode)
+    print(f"Added product {product.product_id}")
+
+
+def cmd_restock(service, args):
+    service.restock(args.product_id, args.quantity)
+    print(f"Restocked product {args.product_id} with {args.quantity}")
+
+
+def cmd_sale(service, args):
+    cart = Cart()
+    for product_id, quantity in args.items:
+        line = service.sale_line(product_id, quantity)
+        cart.add(product_id, str(product_id), line.unit_price, quantity)
+    cart.set_discount_text(args.discount)
+    totals = cart.totals
+    receipt = service.create_sale(args.customer, args.seller, cart.sale_lines(),
+                                  discount=totals.discount, tax=totals.tax)
+    print(f"Sale {receipt.sale_id} recorded at {receipt.sale_date}, total {receipt.total_amount}")
+
+
+def cmd_products(service, args):
+    print_rows(chain.from_iterable(service.iter_products()), ["ID", "Name", "Description", "Price", "Category", "SKU", "Barcode"])
+
+
+def cmd_customers(service, args):
+    print_rows(chain.from_iterable(service.iter_customers()), ["ID", "Name", "Contact", "Email"])
+
+
+def cmd_sellers(service, args):
+    print_rows(chain.from_iterable(service.iter_sellers()), ["ID", "Name", "Contact", "Email"])
+
+
+def cmd_inventory(service, args):
+    print_rows(chain.from_iterable(service.iter_inventory()), ["ID", "Product", "Quantity", "Last Restocked"])
+
+
+def cmd_sales(service, args):
+    if not args.limit:
+        print_rows(chain.from_iterable(service.iter_sales(args.from_date, args.to_date)),
+                   ["ID", "Date", "Customer", "Seller", "Total"])
+        return
+    total = service.count_sales(args.from_date, args.to_date)
+    rows = service.query_sales(args.from_date, args.to_date, limit=args.limit)
+    print_rows(rows, ["ID", "Date", "Customer", "Seller", "Total"])
+    print(f"# {len(rows)} of {total} sales", file=sys.stderr)
+
+
+def cmd_totals(service, args):
+    rows = service.sales_totals(args.period, args.breakdown, args.from_date, args.to_date)
+    print_rows(rows, ["Period", "Name", "Sales", "Items", "Revenue"])
+
+
+def cmd_rebuild_rollups(service, args):
+    service.rebuild_rollups(args.from_date)
+    print("Rollups rebuilt")
+
+
+def cmd_analytics(service, args):
+    # numpy is only needed for these reports
+    try:
+        from analytics import BASKET_HISTOGRAM_MAX, WEEKDAYS, SalesAnalytics
+    except ImportError:
+        raise StoreError("Analytics reports need numpy; install it with pip install numpy")
+    analytics = SalesAnalytics(service)
+    if args.report == "products":
+        print_rows(analytics.top_products(args.top, args.by, args.from_date, args.to_date),
+                   ["ID", "Product", "Quantity", "Revenue"])
+    elif args.report == "sellers":
+        print_rows(analytics.seller_leaderboard(args.top, args.from_date, args.to_date),
+                   ["ID", "Seller", "Sales", "Items", "Revenue"])
+    elif args.report == "baskets":
+        stats = analytics.basket_sizes(args.from_date, args.to_date)
+        print(f"# {stats.sales} sales, {stats.mean_units:.2f} units on average, "
+              f"p50/p90/p99 units {'/'.join(map(str, stats.units))}, "
+              f"totals {'/'.join(map(str, stats.totals))}", file=sys.stderr)
+        sizes = [str(size) for size in range(BASKET_HISTOGRAM_MAX)] + [f"{BASKET_HISTOGRAM_MAX}+"]
+        print_rows(zip(sizes, stats.histogram), ["Units", "Sales"])
+    else:
+        heatmap = analytics.hour_heatmap(args.from_date, args.to_date)
+        print_rows(([day, *counts] for day, counts in zip(WEEKDAYS, heatmap.sale_count)),
+                   ["Day", *(f"{hour:02d}" for hour in range(24))])
+
+
+def cmd_low_stock(service, args):
+    if args.update:
+        service.update_velocity()
+    rows = service.low_stock(args.days)
+    print_rows(rows, ["ID", "Product", "SKU", "Available", "Reorder Point", "Per Day", "Days Left"])
+    print(f"# {len(rows)} product(s) low on stock", file=sys.stderr)
+
+
+def cmd_update_velocity(service, args):
+    through = date.fromisoformat(args.through) if args.through else None
+    print(f"Folded {service.update_velocity(through)} day(s) of sales into the velocities")
+
+
+def cmd_set_min_stock(service, args):
+    service.set_min_stock(args.product_id, args.min_stock)
+    if args.min_stock is None:
+        print(f"Minimum stock for product {args.product_id} removed")
+    else:
+        print(f"Minimum stock for product {args.product_id} set to {args.min_stock}")
+
+
+def cmd_adjust_stock(service, args):
+    change = service.adjust_stock(args.product_id, args.counted, args.note)
+    print(f"Stock for product {args.product_id} set to {args.counted} ({change:+d})")
+
+
+def cmd_stock(service, args):
+    print_rows(service.stock_at(args.at, args.product), ["ID", "Product", "Quantity"])
+
+
+def cmd_movements(service, args):
+    rows = service.stock_movements(args.product_id, args.from_date)
+    print_rows(rows, ["ID", "Time", "Kind", "Quantity", "Sale", "Note"])
+
+
+def cmd_compact_ledger(service, args):
+    written, dropped = service.compact_ledger()
+    print(f"{written} snapshot row(s) written, {dropped} old movement(s) dropped")
+
+
+def cmd_check_ledger(service, args):
+    drift = service.ledger_drift()
+    print_rows(drift, ["ID", "Inventory", "Ledger"])
+    if drift:
+        raise StoreError(f"{len(drift)} product(s) do not match the ledger")
+
+
+def cmd_archive_sales(service, args):
+    def progress(month, sales, items):
+        print(f"  {month:%Y-%m}: {sales} sales, {items} items", file=sys.stderr)
+
+    sales, items = service.archive_sales(args.before, progress)
+    print(f"Archived {sales} sales and {items} items")
+
+
+def cmd_partition_sales(service, args):
+    print(f"Added {service.partition_sales()} monthly partition(s) to Sales")
+
+
+def cmd_expire_reservations(service, args):
+    print(f"Released {service.expire_reservations()} expired reservation(s)")
+
+
+def cmd_flush_journal(service, args):
+    journal = SaleJournal(args.journal)
+    try:
+        if args.retry_failed:
+            print(f"Requeued {journal.retry_failed()} failed sale(s)")
+        processed = JournalFlusher(service, journal).drain()
+        failed = journal.failed()
+        print(f"Processed {processed} queued sale(s), {len(failed)} rejected")
+        for sale in failed:
+            print(f"{sale.idempotency_key}\t{sale.sale_date}\t{sale.total_amount}\t{sale.last_error}", file=sys.stderr)
+    finally:
+        journal.close()
+
+
+def cmd_import(service, args):
+    def progress(processed, imported, rejected):
+        print(f"  {processed} rows read, {imported} imported, {rejected} rejected", file=sys.stderr)
+
+    result = import_csv(service, args.kind, args.file, args.chunk_size, progress)
+    for line, message in result.rejected:
+        print(f"line {line}: {message}", file=sys.stderr)
+    print(f"Imported {result.imported} {args.kind}, rejected {len(result.rejected)}")
+
+
+def cmd_export(service, args):
+    def progress(exported):
+        print(f"  {exported} rows written", file=sys.stderr)
+
+    print(f"Exported {export_csv(service, args.kind, args.file, progress=progress)} {args.kind}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Store Management System command line")
+    parser.add_argument("--stats", choices=["summary", "json", "prometheus"],
+                        help="print query statistics to stderr when the command finishes")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("migrate", help="apply pending schema migrations").set_defaults(func=cmd_migrate)
+
+    for name, func in (("add-seller", cmd_add_seller), ("add-customer", cmd_add_customer)):
+        command = commands.add_parser(name)
+        command.add_argument("name")
+        command.add_argument("contact")
+        command.add_argument("--email")
+        command.set_defaults(func=func)
+
+    command = commands.add_parser("add-product")
+    command.add_argument("name")
+    command.add_argument("price")
+    command.add_argument("--description")
+    command.add_argument("--category")
+    command.add_argument("--sku")
+    command.add_argument("--barcode")
+    command.set_defaults(func=cmd_add_product)
+
+    command = commands.add_parser("restock", help="add stock for a product")
+    command.add_argument("product_id", type=int)
+    command.add_argument("quantity", type=int)
+    command.set_defaults(func=cmd_restock)
+
+    command = commands.add_parser("sale", help="record a sale at current catalog prices")
+    command.add_argument("--customer", type=int, required=True)
+    command.add_argument("--seller", type=int, required=True)
+    command.add_argument("--discount", help='an amount ("5") or a rate of the subtotal ("10%%")')
+    command.add_argument("items", nargs="+", type=parse_item, metavar="PRODUCT_ID:QUANTITY")
+    command.set_defaults(func=cmd_sale)
+
+    for name, func in (("products", cmd_products), ("customers", cmd_customers),
+                       ("sellers", cmd_sellers), ("inventory", cmd_inventory)):
+        commands.add_parser(name, help=f"list {name}").set_defaults(func=func)
+
+    command = commands.add_parser("sales", help="list sales, newest first")
+    command.add_argument("--from", dest="from_date")
+    command.add_argument("--to", dest="to_date")
+    command.add_argument("--limit", type=int, default=100, help="0 streams every matching sale")
+    command.set_defaults(func=cmd_sales)
+
+    command = commands.add_parser("totals", help="sales totals from the daily rollups")
+    command.add_argument("--period", choices=["Day", "Week", "Month"], default="Day")
+    command.add_argument("--breakdown", choices=["All", "Seller", "Product"], default="All")
+    command.add_argument("--from", dest="from_date")
+    command.add_argument("--to", dest="to_date")
+    command.set_defaults(func=cmd_totals)
+
+    command = commands.add_parser("rebuild-rollups", help="recompute the daily rollups from sales history")
+    command.add_argument("--from", dest="from_date", help="only rebuild days on or after this date (YYYY-MM-DD)")
+    command.set_defaults(func=cmd_rebuild_rollups)
+
+    command = commands.add_parser("analytics", help="top products, seller leaderboard, basket sizes, sales by hour")
+    command.add_argument("report", choices=["products", "sellers", "baskets", "hours"])
+    command.add_argument("--top", type=int, default=10)
+    command.add_argument("--by", choices=["revenue", "quantity"], default="revenue", help="ranking for products")
+    command.add_argument("--from", dest="from_date")
+    command.add_argument("--to", dest="to_date")
+    command.set_defaults(func=cmd_analytics)
+
+    command = commands.add_parser("low-stock", help="products at or below their reorder point")
+    command.add_argument("--days", type=int, help="flag stock that runs out within this many days instead")
+    command.add_argument("--update", action="store_true", help="bring sales velocities up to date first")
+    command.set_defaults(func=cmd_low_stock)
+
+    command = commands.add_parser("update-velocity", help="fold recent days' sales into the sales velocities")
+    command.add_argument("--through", help="last day to fold in (YYYY-MM-DD), default yesterday")
+    command.set_defaults(func=cmd_update_velocity)
+
+    command = commands.add_parser("set-min-stock", help="set the stock a product should never fall below")
+    command.add_argument("product_id", type=int)
+    command.add_argument("min_stock", type=int, nargs="?", help="leave out to remove the minimum")
+    command.set_defaults(func=cmd_set_min_stock)
+
+    command = commands.add_parser("adjust-stock", help="set a product's stock to a counted quantity")
+    command.add_argument("product_id", type=int)
+    command.add_argument("counted", type=int)
+    command.add_argument("--note", help="reason recorded in the ledger, e.g. 'stocktake' or 'damaged'")
+    command.set_defaults(func=cmd_adjust_stock)
+
+    command = commands.add_parser("stock", help="stock levels from the movement ledger, now or at a past time")
+    command.add_argument("--at", type=datetime.fromisoformat, help="YYYY-MM-DD or 'YYYY-MM-DD HH:MM'")
+    command.add_argument("--product", type=int)
+    command.set_defaults(func=cmd_stock)
+
+    command = commands.add_parser("movements", help="a product's stock movements, newest first")
+    command.add_argument("product_id", type=int)
+    command.add_argument("--from", dest="from_date")
+    command.set_defaults(func=cmd_movements)
+
+    commands.add_parser("compact-ledger", help="roll old stock movements into snapshots") \
+        .set_defaults(func=cmd_compact_ledger)
+    commands.add_parser("check-ledger", help="list products whose stock does not match the ledger") \
+        .set_defaults(func=cmd_check_ledger)
+
+    command = commands.add_parser("archive-sales", help="move sales of ended months into the archive tables")
+    command.add_argument("--before", required=True, help="first month to keep (YYYY-MM)")
+    command.set_defaults(func=cmd_archive_sales)
+
+    commands.add_parser("partition-sales", help="partition Sales by month (MySQL), or add upcoming months") \
+        .set_defaults(func=cmd_partition_sales)
+
+    commands.add_parser("expire-reservations", help="release stock held by abandoned carts") \
+        .set_defaults(func=cmd_expire_reservations)
+
+    command = commands.add_parser("flush-journal", help="send sales queued in a till's local journal")
+    command.add_argument("--journal", default=SALE_JOURNAL or "sale_journal.db")
+    command.add_argument("--retry-failed", action="store_true", help="also retry sales that were rejected before")
+    command.set_defaults(func=cmd_flush_journal)
+
+    command = commands.add_parser("import", help="bulk upsert rows from a CSV file")
+    command.add_argument("kind", choices=sorted(IMPORTS))
+    command.add_argument("file")
+    command.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    command.set_defaults(func=cmd_import)
+
+    command = commands.add_parser("export", help="stream a table to a CSV file")
+    command.add_argument("kind", choices=sorted(EXPORT_QUERIES))
+    command.add_argument("file")
+    command.set_defaults(func=cmd_export)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    service = StoreService()
+    try:
+        with QUERY_STATS.action(args.command):
+            if args.command != "migrate":
+                service.migrate()
+            args.func(service, args)
+    except (StoreError, InsufficientStockError) as err:
+        print(f"Error: {err}", file=sys.stderr)
+        return 1
+    finally:
+        if args.stats:
+            print_stats(args.stats)
+    return 0
+
+
+def print_stats(fmt):
+    if fmt == "json":
+        print(QUERY_STATS.to_json(), file=sys.stderr)
+    elif fmt == "prometheus":
+        print(QUERY_STATS.to_prometheus(), end="", file=sys.stderr)
+    else:
+        for summary in QUERY_STATS.summaries():
+            print(summary, file=sys.stderr)
+        for entry in QUERY_STATS.snapshot()["statements"]:
+            print(f"  {entry['calls']:>6} x {entry['avg_ms']:8.2f} ms  {entry['rows']:>8} rows  {entry['statement'][:100]}",
+                  file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,788 @@
+import os
+import socket
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from archive import archive_horizon, archive_month, months_to_archive, partition_sales, reaches_archive
+from catalog import ProductCatalog
+from db import create_backend, run_transaction
+from ledger import (adjust_stock, compact_ledger, ledger_drift, ledger_horizon, movement_history,
+                    record_movements, stock_at)
+from migrations import migrate
+from reorder import days_left, low_stock, set_min_stock, update_velocity
+from reservations import (InsufficientStockError, expire_reservations, held_quantities, lock_inventory,
+                          release_session, reserve_stock, restock)
+from rollups import rebuild_rollups, record_sale, sales_totals
+
+SALES_PAGE_SIZE = 200
+
+# Recorded on every sale so tills sharing a database can be told apart; set
+# STORMANAG_TERMINAL_ID when one machine runs several
+TERMINAL_ID = os.environ.get("STORMANAG_TERMINAL_ID") or socket.gethostname()
+
+# Seconds a service with a sale journal keeps selling from the catalog alone
+# after the database failed, before it tries the database again
+OFFLINE_RETRY_INTERVAL = 30
+
+# Streaming results come in batches; the first one is small so the first rows
+# can be shown while the rest are still being read
+STREAM_FIRST_BATCH = 100
+STREAM_BATCH_SIZE = 1000
+
+SELLERS_QUERY = "SELECT seller_id, seller_name, contact_number, email FROM Sellers"
+CUSTOMERS_QUERY = "SELECT customer_id, customer_name, contact_number, email FROM Customers"
+PRODUCTS_QUERY = "SELECT product_id, product_name, description, price, category, sku, barcode FROM Products"
+INVENTORY_QUERY = """
+    SELECT i.inventory_id, p.product_name, i.quantity, i.last_restocked
+    FROM Inventory i
+    JOIN Products p ON i.product_id = p.product_id
+"""
+
+# The list views' rows with the time each last changed as an extra, last
+# column. The inventory view shows product names, so renaming a product
+# changes its inventory row too.
+CHANGES_QUERIES = {
+    "sellers": ("""SELECT seller_id, seller_name, contact_number, email, last_modified, {now}
+                   FROM Sellers""", ["last_modified"], "seller_id"),
+    "customers": ("""SELECT customer_id, customer_name, contact_number, email, last_modified, {now}
+                     FROM Customers""", ["last_modified"], "customer_id"),
+    "products": ("""SELECT product_id, product_name, description, price, category, sku, barcode, last_modified,
+                           {now}
+                    FROM Products""", ["last_modified"], "product_id"),
+    "inventory": ("""
+        SELECT i.inventory_id, p.product_name, i.quantity, i.last_restocked, {newest}, {now}
+        FROM Inventory i
+        JOIN Products p ON i.product_id = p.product_id
+    """, ["i.last_modified", "p.last_modified"], "i.inventory_id"),
+}
+# A row is stamped when its statement runs but only seen once its transaction
+# commits, possibly after a later stamp was read. Rows changed this close to
+# a read are read again by the next refresh so such rows are not missed.
+CHANGES_OVERLAP = timedelta(seconds=10)
+
+# Everything the sale screen needs at startup in one round trip: the catalog
+# rows (as in CATALOG_QUERY) followed by customer and seller names, tagged by
+# their first column
+LOOKUPS_QUERY = """
+    SELECT 'P', p.product_id, p.product_name, p.price, p.category, p.description, p.sku, p.barcode,
+           i.quantity - i.reserved
+    FROM Products p
+    LEFT JOIN Inventory i ON i.product_id = p.product_id
+    UNION ALL
+    SELECT 'C', customer_id, customer_name, NULL, NULL, NULL, NULL, NULL, NULL FROM Customers
+    UNION ALL
+    SELECT 'S', seller_id, seller_name, NULL, NULL, NULL, NULL, NULL, NULL FROM Sellers
+"""
+
+SALES_REPORT_QUERY = """
+    SELECT s.sale_id, s.sale_date, c.customer_name, sl.seller_name, s.total_amount
+    FROM {sales} s
+    LEFT JOIN Customers c ON s.customer_id = c.customer_id
+    LEFT JOIN Sellers sl ON s.seller_id = sl.seller_id
+    WHERE 1=1
+"""
+
+
+class StoreError(Exception):
+    pass
+
+
+class ValidationError(StoreError):
+    pass
+
+
+class Seller(NamedTuple):
+    seller_id: int
+    name: str
+    contact: str
+    email: Optional[str]
+
+
+class Customer(NamedTuple):
+    customer_id: int
+    name: str
+    contact: str
+    email: Optional[str]
+
+
+class Product(NamedTuple):
+    product_id: int
+    name: str
+    description: Optional[str]
+    price: Decimal
+    category: Optional[str]
+    sku: Optional[str]
+    barcode: Optional[str]
+
+
+class InventoryRow(NamedTuple):
+    inventory_id: int
+    product_name: str
+    quantity: int
+    last_restocked: Optional[date]
+
+
+class SaleLine(NamedTuple):
+    product_id: int
+    quantity: int
+    unit_price: Decimal
+
+
+class SaleReceipt(NamedTuple):
+    sale_id: int
+    sale_date: datetime
+    total_amount: Decimal
+
+
+class SaleRecord(NamedTuple):
+    sale_id: int
+    sale_date: datetime
+    customer_name: Optional[str]
+    seller_name: Optional[str]
+    total_amount: Decimal
+
+
+class Lookups(NamedTuple):
+    customers: List[Tuple[int, str]]
+    sellers: List[Tuple[int, str]]
+
+
+class LowStockRow(NamedTuple):
+    product_id: int
+    product_name: str
+    sku: Optional[str]
+    available: int
+    reorder_point: Optional[int]
+    daily_velocity: float
+    # At the current velocity; None when the product does not sell
+    days_left: Optional[int]
+
+
+class MovementRow(NamedTuple):
+    movement_id: int
+    moved_at: datetime
+    # One of ledger.MOVEMENT_KINDS
+    kind: str
+    quantity: int
+    sale_id: Optional[int]
+    note: Optional[str]
+
+
+class StockLevel(NamedTuple):
+    product_id: int
+    product_name: Optional[str]
+    quantity: int
+
+
+class TotalsRow(NamedTuple):
+    period: date
+    name: Optional[str]
+    sale_count: int
+    items_sold: int
+    revenue: Decimal
+
+
+def sales_filters(from_date=None, to_date=None):
+    conditions = []
+    params = []
+    if from_date:
+        conditions.append(" AND s.sale_date >= %s")
+        params.append(from_date)
+    if to_date:
+        conditions.append(" AND s.sale_date <= %s")
+        params.append(to_date)
+    return conditions, params
+
+
+def sales_count_query(filters, archived=False):
+    conditions, params = filters
+    where = "".join(conditions)
+    if archived:
+        return (f"SELECT (SELECT COUNT(*) FROM Sales s WHERE 1=1{where})"
+                f" + (SELECT COUNT(*) FROM Sales_Archive s WHERE 1=1{where})", tuple(params) * 2)
+    return "SELECT COUNT(*) FROM Sales s WHERE 1=1" + where, tuple(params)
+
+
+def sales_page_query(filters, key=None, forward=True, limit=SALES_PAGE_SIZE, archived=False):
+    # archived: the range reaches back into Sales_Archive. Each table then
+    # returns its own page, filtered by its indexes (and, on a partitioned
+    # Sales, only from the months in range), and the outer query merges them.
+    conditions, params = filters
+    conditions = list(conditions)
+    params = list(params)
+    if key is not None:
+        op = "<" if forward else ">"
+        conditions.append(f" AND (s.sale_date {op} %s OR (s.sale_date = %s AND s.sale_id {op} %s))")
+        params.extend([key[0], key[0], key[1]])
+    direction = "DESC" if forward else "ASC"
+    order = f" ORDER BY s.sale_date {direction}, s.sale_id {direction}"
+    if limit is not None:
+        order += " LIMIT %s"
+        params.append(limit)
+    where = "".join(conditions)
+    if not archived:
+        return SALES_REPORT_QUERY.format(sales="Sales") + where + order, tuple(params)
+    pages = " UNION ALL ".join(f"""
+        SELECT * FROM (
+            SELECT sale_id, sale_date, customer_id, seller_id, total_amount FROM {table} s
+            WHERE 1=1{where}{order}
+        ) {alias}""" for table, alias in (("Sales", "hot"), ("Sales_Archive", "archived")))
+    outer_params = [limit] if limit is not None else []
+    return SALES_REPORT_QUERY.format(sales=f"({pages})") + order, tuple(params * 2 + outer_params)
+
+
+def changes_query(kind, dialect, since=None):
+    # Every row of the view, or only those changed after `since`
+    query, columns, key = CHANGES_QUERIES[kind]
+    query = query.format(newest=dialect.greatest(*columns), now=dialect.now)
+    params = ()
+    if since is not None:
+        query += " WHERE " + " OR ".join(f"{column} > %s" for column in columns)
+        params = (since,) * len(columns)
+    return query + f" ORDER BY {key}", params
+
+
+def as_datetime(value):
+    # SQLite hands back computed DATETIME values as text
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+
+def parse_price(price):
+    try:
+        price = Decimal(str(price))
+    except InvalidOperation:
+        raise ValidationError("Price must be a valid number")
+    if not price.is_finite() or price < 0:
+        raise ValidationError("Price must be a valid number")
+    return price.quantize(Decimal("0.01"))
+
+
+def sale_amounts(lines, discount=0, tax=0):
+    # (discount, tax, total_amount) in cents; the lines' own total is what
+    # Sale_Items adds up to, and the discount may not take the sale below 0
+    subtotal = sum((line.quantity * line.unit_price for line in lines), Decimal("0.00"))
+    discount = parse_price(discount or 0)
+    tax = parse_price(tax or 0)
+    if discount > subtotal:
+        raise ValidationError("Discount is larger than the sale")
+    return discount, tax, subtotal - discount + tax
+
+
+class StoreService:
+    # The store's business operations, independent of any UI and of the
+    # database engine. Every method checks out its own connection from the
+    # backend, so a service can be shared by worker threads. Writes that
+    # lock inventory rows are retried when they lose a deadlock to another
+    # terminal. With a sale journal (sale_journal.SaleJournal), checkout
+    # keeps working while the database is down.
+    def __init__(self, backend=None, catalog=None, terminal_id=None, journal=None):
+        self.backend = backend or create_backend()
+        self.catalog = catalog or ProductCatalog()
+        self.terminal_id = terminal_id or TERMINAL_ID
+        self.journal = journal
+        self.offline_until = 0
+        self.velocity_checked = None
+        # Customer and seller ids seen by load_lookups, so queued sales can be
+        # checked without a database round trip
+        self.customer_ids = set()
+        self.seller_ids = set()
+
+    def fetch_all(self, query, params=()):
+        with self.backend.connection() as db:
+            with db.cursor() as cursor:
+                cursor.execute(query, params)
+                return cursor.fetchall()
+
+    def stream(self, query, params=(), row_type=None, batch_size=STREAM_BATCH_SIZE):
+        # Yields lists of rows read through an unbuffered cursor, so memory
+        # stays flat however large the result is. The connection is held
+        # until the generator is exhausted or closed; close it from the
+        # thread that iterated it.
+        with self.backend.connection() as db:
+            with db.cursor(buffered=False) as cursor:
+                cursor.execute(query, params)
+                size = min(STREAM_FIRST_BATCH, batch_size)
+                while True:
+                    rows = cursor.fetchmany(size)
+                    if not rows:
+                        return
+                    yield [row_type(*row) for row in rows] if row_type else rows
+                    size = batch_size
+
+    def migrate(self):
+        with self.backend.connection() as db:
+            return migrate(db)
+
+    # Sellers and customers
+
+    def add_seller(self, name, contact, email=None) -> Seller:
+        if not name or not contact:
+            raise ValidationError("Name and Contact are required fields")
+        with self.backend.connection() as db:
+            with db.cursor() as cursor:
+                cursor.execute("INSERT INTO Sellers (seller_name, contact_number, email) VALUES (%s, %s, %s)",
+                               (name, contact, email))
+                seller_id = cursor.lastrowid
+            db.commit()
+        return Seller(seller_id, name, contact, email)
+
+    def list_sellers(self) -> List[Seller]:
+        return [Seller(*row) for row in self.fetch_all(SELLERS_QUERY)]
+
+    def iter_sellers(self, batch_size=STREAM_BATCH_SIZE) -> Iterator[List[Seller]]:
+        return self.stream(SELLERS_QUERY, row_type=Seller, batch_size=batch_size)
+
+    def add_customer(self, name, contact, email=None) -> Customer:
+        if not name or not contact:
+            raise ValidationError("Name and Contact are required fields")
+        with self.backend.connection() as db:
+            with db.cursor() as cursor:
+                cursor.execute("INSERT INTO Customers (customer_name, contact_number, email) VALUES (%s, %s, %s)",
+                               (name, contact, email))
+                customer_id = cursor.lastrowid
+            db.commit()
+        return Customer(customer_id, name, contact, email)
+
+    def list_customers(self) -> List[Customer]:
+        return [Customer(*row) for row in self.fetch_all(CUSTOMERS_QUERY)]
+
+    def iter_customers(self, batch_size=STREAM_BATCH_SIZE) -> Iterator[List[Customer]]:
+        return self.stream(CUSTOMERS_QUERY, row_type=Customer, batch_size=batch_size)
+
+    # Products and inventory
+
+    def add_product(self, name, price, description=None, category=None, sku=None, barcode=None) -> Product:
+        if not name or price in (None, ""):
+            raise ValidationError("Name and Price are required fields")
+        price = parse_price(price)
+        sku = sku or None
+        barcode = barcode or None
+        for code in (sku, barcode):
+            if code and self.catalog.lookup_code(code):
+                raise ValidationError(f"Code {code} already belongs to another product")
+        with self.backend.connection() as db:
+            with db.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO Products (product_name, description, price, category, sku, barcode)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                """, (name, description, price, category, sku, barcode))
+                product_id = cursor.lastrowid
+            db.commit()
+            self.catalog.refresh_products(db, [product_id])
+        return Product(product_id, name, description, price, category, sku, barcode)
+
+    def list_products(self) -> List[Product]:
+        return [Product(*row) for row in self.fetch_all(PRODUCTS_QUERY)]
+
+    def iter_products(self, batch_size=STREAM_BATCH_SIZE) -> Iterator[List[Product]]:
+        return self.stream(PRODUCTS_QUERY, row_type=Product, batch_size=batch_size)
+
+    def warm_catalog(self):
+        with self.backend.connection() as db:
+            self.catalog.warm(db)
+        return self.catalog.products()
+
+    def load_lookups(self) -> Lookups:
+        # Warms the catalog and lists customers and sellers with a single query
+        products, customers, sellers = [], [], []
+        for kind, *row in self.fetch_all(LOOKUPS_QUERY):
+            if kind == "P":
+                products.append(row)
+            elif kind == "C":
+                customers.append((row[0], row[1]))
+            else:
+                sellers.append((row[0], row[1]))
+        self.catalog.load(products)
+        self.customer_ids = {customer_id for customer_id, _ in customers}
+        self.seller_ids = {seller_id for seller_id, _ in sellers}
+        return Lookups(customers, sellers)
+
+    def restock(self, product_id, quantity):
+        if quantity <= 0:
+            raise ValidationError("Quantity must be a positive number")
+        run_transaction(self.backend, lambda db: restock(db, product_id, quantity),
+                        after=lambda db: self.catalog.refresh_products(db, [product_id]))
+
+    # Stock levels
+
+    def update_velocity(self, through=None):
+        # Daily work; returns 0 straight away once the day has been folded in
+        return run_transaction(self.backend, lambda db: update_velocity(db, through))
+
+    def low_stock(self, days=None) -> List[LowStockRow]:
+        with self.backend.connection() as db:
+            with db.cursor() as cursor:
+                rows = low_stock(cursor, days)
+        return [LowStockRow(product_id, name, sku, int(available), reorder_point, float(velocity),
+                            days_left(int(available), float(velocity)))
+                for product_id, name, sku, available, reorder_point, velocity in rows]
+
+    def check_low_stock(self) -> List[LowStockRow]:
+        # What the monitor runs: bring velocities up to yesterday once a day,
+        # then read the flagged products through the index
+        today = date.today()
+        if self.velocity_checked != today:
+            self.update_velocity()
+            self.velocity_checked = today
+        return self.low_stock()
+
+    def set_min_stock(self, product_id, min_stock=None):
+        if min_stock is not None and min_stock < 0:
+            raise ValidationError("Minimum stock cannot be negative")
+        if not run_transaction(self.backend, lambda db: set_min_stock(db, product_id, min_stock)):
+            raise ValidationError("Product not available in inventory")
+
+    # Stock ledger
+
+    def adjust_stock(self, product_id, counted, note=None):
+        # Returns the change recorded, 0 when the count matched
+        if counted < 0:
+            raise ValidationError("Counted stock cannot be negative")
+        try:
+            change = run_transaction(self.backend, lambda db: adjust_stock(db, product_id, counted, note),
+                                     after=lambda db: self.catalog.refresh_products(db, [product_id]))
+        except ValueError as err:
+            raise ValidationError(str(err))
+        if change is None:
+            raise ValidationError("Product not available in inventory")
+        return change
+
+    def stock_at(self, when=None, product_id=None) -> List[StockLevel]:
+        # Stock as it stood at `when`, rebuilt from the ledger
+        with self.backend.connection() as db:
+            with db.cursor() as cursor:
+                horizon = ledger_horizon(cursor)
+                if when and horizon and when < horizon:
+                    raise ValidationError(f"Stock movements before {horizon:%Y-%m-%d} are no longer kept")
+                stock = stock_at(cursor, when, None if product_id is None else [product_id])
+                if product_id is None:
+                    cursor.execute("SELECT product_id, product_name FROM Products")
+                else:
+                    cursor.execute("SELECT product_id, product_name FROM Products WHERE product_id = %s",
+                                   (product_id,))
+                names = dict(cursor.fetchall())
+        return [StockLevel(product_id, names.get(product_id), quantity)
+                for product_id, quantity in sorted(stock.items())]
+
+    def stock_movements(self, product_id, from_date=None) -> List[MovementRow]:
+        with self.backend.connection() as db:
+            with db.cursor() as cursor:
+                rows = movement_history(cursor, product_id, from_date)
+        return [MovementRow(*row) for row in rows]
+
+    def compact_ledger(self, cutoff=None):
+        # Returns (snapshots written, movements dropped)
+        return run_transaction(self.backend, lambda db: compact_ledger(db, cutoff))
+
+    def ledger_drift(self):
+        # [(product_id, Inventory.quantity, ledger balance)] that disagree
+        with self.backend.connection() as db:
+            with db.cursor() as cursor:
+                return ledger_drift(cursor)
+
+    def list_inventory(self) -> List[InventoryRow]:
+        return [InventoryRow(*row) for row in self.fetch_all(INVENTORY_QUERY)]
+
+    def iter_inventory(self, batch_size=STREAM_BATCH_SIZE) -> Iterator[List[InventoryRow]]:
+        return self.stream(INVENTORY_QUERY, row_type=InventoryRow, batch_size=batch_size)
+
+    def iter_changes(self, kind, since=None, batch_size=STREAM_BATCH_SIZE) -> Iterator[list]:
+        # Rows of a list view ("sellers", "customers", "products" or
+        # "inventory") changed after `since`, or all of them when it is None.
+        # Each row ends with its watermark: when it last changed, but no
+        # later than CHANGES_OVERLAP before it was read. The largest
+        # watermark seen is the `since` for the next call.
+        query, params = changes_query(kind, self.backend.dialect, since)
+        batches = self.stream(query, params, batch_size=batch_size)
+        try:
+            for rows in batches:
+                yield [(*row[:-2], min(as_datetime(row[-2]), as_datetime(row[-1]) - CHANGES_OVERLAP))
+                       for row in rows]
+        finally:
+            # Hands the connection back on the thread that read it
+            batches.close()
+
+    # Checkout
+
+    def sale_line(self, product_id, quantity) -> SaleLine:
+        # Priced from the catalog; only a cache miss costs a round trip
+        entry = self.catalog.get(product_id)
+        if entry is None:
+            with self.backend.connection() as db:
+                self.catalog.refresh_products(db, [product_id])
+            entry = self.catalog.get(product_id)
+        if entry is None:
+            raise ValidationError("Selected product not found")
+        return SaleLine(product_id, quantity, entry.price)
+
+    def reserve(self, session_id, product_id, quantity):
+        # Holds stock for an open cart and returns the product's catalog entry
+        if quantity <= 0:
+            raise ValidationError("Quantity must be a positive number")
+        def hold(db):
+            try:
+                reserve_stock(db, session_id, product_id, quantity)
+            except InsufficientStockError:
+                self.catalog.refresh_products(db, [product_id])
+                raise
+
+        def update_catalog(db):
+            if self.catalog.get(product_id) is None:
+                # Not cached yet, e.g. added on another terminal
+                self.catalog.refresh_products(db, [product_id])
+            else:
+                self.catalog.adjust_stock({product_id: -quantity})
+
+        if self.journal is None:
+            run_transaction(self.backend, hold, after=update_catalog)
+        elif time.monotonic() < self.offline_until:
+            return self.reserve_offline(product_id, quantity)
+        else:
+            try:
+                run_transaction(self.backend, hold, after=update_catalog)
+            except (StoreError, InsufficientStockError):
+                raise
+            except Exception:
+                self.offline_until = time.monotonic() + OFFLINE_RETRY_INTERVAL
+                return self.reserve_offline(product_id, quantity)
+        entry = self.catalog.get(product_id)
+        if entry is None:
+            raise ValidationError("Selected product not found")
+        return entry
+
+    def reserve_offline(self, product_id, quantity):
+        # Without the database nothing can be held; the catalog's stock hint
+        # stands in, and the sale is checked against Inventory when the
+        # journal is flushed
+        entry = self.catalog.get(product_id)
+        if entry is None:
+            raise ValidationError("Selected product not found")
+        if entry.stock is None or entry.stock < quantity:
+            raise InsufficientStockError(f"Not enough stock. Only {entry.stock or 0} available")
+        self.catalog.adjust_stock({product_id: -quantity})
+        return entry
+
+    def scan(self, session_id, code, quantity=1):
+        # Resolves a scanned SKU or barcode from the catalog's code map and
+        # holds the stock like reserve()
+        code = (code or "").strip()
+        if not code:
+            raise ValidationError("Nothing was scanned")
+        entry = self.catalog.lookup_code(code)
+        if entry is None:
+            with self.backend.connection() as db:
+                entry = self.catalog.refresh_code(db, code)
+        if entry is None:
+            raise ValidationError(f"No product with code {code}")
+        return self.reserve(session_id, entry.product_id, quantity)
+
+    def release_cart(self, session_id):
+        return run_transaction(self.backend, lambda db: release_session(db, session_id))
+
+    def expire_reservations(self):
+        return run_transaction(self.backend, expire_reservations)
+
+    def check_lines(self, lines):
+        if not lines:
+            raise ValidationError("No items in the sale")
+        lines = [SaleLine(product_id, quantity, parse_price(unit_price)) for product_id, quantity, unit_price in lines]
+        if any(line.quantity <= 0 for line in lines):
+            raise ValidationError("Quantity must be a positive number")
+        return lines
+
+    def queue_sale(self, customer_id, seller_id, lines, session_id=None, discount=0, tax=0):
+        # Checkout without a database round trip: the sale is written to the
+        # local journal and reaches the database when the flusher sends it
+        # with create_sale
+        if self.journal is None:
+            raise StoreError("No sale journal is configured")
+        lines = self.check_lines(lines)
+        discount, tax, _ = sale_amounts(lines, discount, tax)
+        self.check_sale_parties(customer_id, seller_id)
+        return self.journal.append(customer_id, seller_id, lines, session_id, discount=discount, tax=tax)
+
+    def check_sale_parties(self, customer_id, seller_id):
+        self.check_known("Customer", customer_id, self.customer_ids,
+                         "SELECT customer_id FROM Customers WHERE customer_id = %s")
+        self.check_known("Seller", seller_id, self.seller_ids, "SELECT seller_id FROM Sellers WHERE seller_id = %s")
+
+    def check_known(self, kind, value, known, query):
+        # A sale for a customer or seller that does not exist would otherwise
+        # only be refused by a foreign key, possibly much later when the
+        # journal is flushed. Ids not seen at startup (e.g. added on another
+        # terminal) are looked up, unless the database is down; the flusher
+        # then parks the sale if it is rejected.
+        if value is None or value in known:
+            return
+        if time.monotonic() >= self.offline_until:
+            try:
+                found = self.fetch_all(query, (value,))
+            except Exception:
+                self.offline_until = time.monotonic() + OFFLINE_RETRY_INTERVAL
+                return
+            if not found:
+                raise ValidationError(f"{kind} {value} not found")
+            known.add(value)
+
+    def create_sale(self, customer_id, seller_id, lines, session_id=None, sale_date=None,
+                    idempotency_key=None, discount=0, tax=0) -> SaleReceipt:
+        # A sale with an idempotency key is recorded once however many times
+        # it is sent; a repeat returns the receipt of the first. discount and
+        # tax are amounts, as worked out by cart.Cart.
+        lines = self.check_lines(lines)
+        self.check_sale_parties(customer_id, seller_id)
+        sale_date = sale_date or datetime.now().replace(microsecond=0)
+        discount, tax, total_amount = sale_amounts(lines, discount, tax)
+
+        quantities = {}
+        for line in lines:
+            quantities[line.product_id] = quantities.get(line.product_id, 0) + line.quantity
+
+        def sell(db):
+            with db.cursor() as cursor:
+                dialect = cursor.dialect
+                cursor.execute(dialect.begin)
+
+                if idempotency_key:
+                    # The unique index only covers Sales; a late replay of a
+                    # sale whose month was archived is found in the archive
+                    cursor.execute("""
+                        SELECT sale_id, sale_date, total_amount FROM Sales WHERE idempotency_key = %s
+                        UNION ALL
+                        SELECT sale_id, sale_date, total_amount FROM Sales_Archive WHERE idempotency_key = %s
+                    """, (idempotency_key, idempotency_key))
+                    recorded = cursor.fetchone()
+                    if recorded is not None:
+                        db.rollback()
+                        return SaleReceipt(*recorded)
+
+                cursor.execute("""
+                    INSERT INTO Sales (customer_id, seller_id, sale_date, total_amount, discount_amount, tax_amount,
+                                       terminal_id, idempotency_key)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                """, (customer_id, seller_id, sale_date, total_amount, discount, tax, self.terminal_id,
+                      idempotency_key))
+                sale_id = cursor.lastrowid
+
+                # executemany sends all line items as one multi-row INSERT
+                cursor.executemany("""
+                    INSERT INTO Sale_Items (sale_id, product_id, quantity, unit_price)
+                    VALUES (%s, %s, %s, %s)
+                """, [(sale_id, *line) for line in lines])
+
+                # Turn the cart's holds into a sale: decrement all products in
+                # one statement. The guard counts our own holds as available and
+                # skips rows that would oversell (e.g. after a hold expired), so
+                # a short row count means another till sold the stock first.
+                held = held_quantities(cursor, session_id) if session_id else {}
+                lock_inventory(cursor, quantities)
+                derived = " UNION ALL ".join(["SELECT %s AS product_id, %s AS quantity, %s AS held"] * len(quantities))
+                cursor.execute(dialect.update_join(
+                    "Inventory", "i", derived, "i.product_id = d.product_id",
+                    {"quantity": "i.quantity - d.quantity", "reserved": dialect.greatest("i.reserved - d.held", "0")},
+                    where="i.quantity - i.reserved + d.held >= d.quantity"
+                ), [value for product_id, quantity in sorted(quantities.items())
+                    for value in (product_id, quantity, held.get(product_id, 0))])
+
+                if cursor.rowcount != len(quantities):
+                    placeholders = ", ".join(["%s"] * len(quantities))
+                    cursor.execute(f"SELECT product_id, quantity - reserved FROM Inventory WHERE product_id IN ({placeholders})",
+                                   list(quantities))
+                    available = dict(cursor.fetchall())
+                    short = [str(product_id) for product_id, quantity in quantities.items()
+                             if available.get(product_id, 0) + held.get(product_id, 0) < quantity]
+                    db.rollback()
+                    self.catalog.refresh_products(db, quantities)
+                    raise InsufficientStockError(f"Not enough stock for product(s) {', '.join(short)}")
+
+                record_movements(cursor, "sale", {product_id: -quantity for product_id, quantity in quantities.items()},
+                                 sale_id=sale_id)
+                if session_id:
+                    cursor.execute("DELETE FROM Stock_Reservations WHERE session_id = %s", (session_id,))
+
+                record_sale(cursor, sale_date, seller_id, total_amount, lines)
+
+            db.commit()
+            return SaleReceipt(sale_id, sale_date, total_amount)
+
+        # A deadlock rolls back the whole sale, so it is safe to run it again
+        return run_transaction(self.backend, sell, after=lambda db: self.catalog.refresh_products(db, quantities))
+
+    # Reports
+
+    def reaches_archive(self, from_date=None) -> bool:
+        # Whether a report from from_date on must read archived sales too
+        with self.backend.connection() as db:
+            with db.cursor() as cursor:
+                return reaches_archive(archive_horizon(cursor), from_date)
+
+    def count_sales(self, from_date=None, to_date=None) -> int:
+        archived = self.reaches_archive(from_date)
+        return self.fetch_all(*sales_count_query(sales_filters(from_date, to_date), archived))[0][0]
+
+    def query_sales(self, from_date=None, to_date=None, after=None, forward=True,
+                    limit=SALES_PAGE_SIZE) -> List[SaleRecord]:
+        # Keyset pagination: `after` is the (sale_date, sale_id) of the last row
+        # of the previous page, in the direction of travel
+        rows = self.fetch_all(*sales_page_query(sales_filters(from_date, to_date), after, forward, limit,
+                                                self.reaches_archive(from_date)))
+        records = [SaleRecord(*row) for row in rows]
+        return records if forward else records[::-1]
+
+    def iter_sales(self, from_date=None, to_date=None, batch_size=STREAM_BATCH_SIZE) -> Iterator[List[SaleRecord]]:
+        # The whole filtered report, newest first, for exports and scripts
+        query, params = sales_page_query(sales_filters(from_date, to_date), limit=None,
+                                         archived=self.reaches_archive(from_date))
+        return self.stream(query, params, row_type=SaleRecord, batch_size=batch_size)
+
+    def sales_totals(self, period="Day", breakdown="All", from_date=None, to_date=None) -> List[TotalsRow]:
+        with self.backend.connection() as db:
+            with db.cursor() as cursor:
+                rows = sales_totals(cursor, period, breakdown, from_date, to_date)
+        # Engines without a decimal type sum revenue as floats
+        return [TotalsRow(period, name, sale_count, items_sold, Decimal(str(revenue)).quantize(Decimal("0.01")))
+                for period, name, sale_count, items_sold, revenue in rows]
+
+    def rebuild_rollups(self, from_date=None):
+        with self.backend.connection() as db:
+            with db.cursor() as cursor:
+                cursor.execute(cursor.dialect.begin)
+                rebuild_rollups(cursor, from_date, reaches_archive(archive_horizon(cursor), from_date))
+            db.commit()
+
+    # Sales history
+
+    def archive_sales(self, before, progress=None):
+        # Moves every sale dated before `before` (a month start, and never
+        # the current month) into the archive tables, one month per
+        # transaction. Returns (sales, items) moved.
+        try:
+            before = date.fromisoformat(f"{before}-01" if len(str(before)) == 7 else str(before))
+        except ValueError:
+            raise ValidationError("Give the month to archive up to as YYYY-MM")
+        if before.day != 1:
+            raise ValidationError("Sales are archived by whole months; give the first day of a month")
+        if before > date.today().replace(day=1):
+            raise ValidationError("Only months that have ended can be archived")
+        with self.backend.connection() as db:
+            with db.cursor() as cursor:
+                months = months_to_archive(cursor, before)
+        sales = items = 0
+        for month in months:
+            moved = run_transaction(self.backend, lambda db: archive_month(db, month))
+            sales += moved[0]
+            items += moved[1]
+            if progress:
+                progress(month, *moved)
+        return sales, items
+
+    def partition_sales(self):
+        # Returns the number of monthly partitions added
+        if self.backend.dialect.name != "mysql":
+            raise StoreError("Partitioning needs MySQL")
+        with self.backend.connection() as db:
+            with db.cursor() as cursor:
+                return partition_sales(cursor)
+
@@ -1,8 +1,539 @@
-import mysql.connector
+import queue
+import threading
+import time
+import traceback
 from tkinter import *
-from tkinter import messagebox, ttk
-from datetime import datetime
-from decimal import Decimal
+from tkinter import filedialog, messagebox, ttk
+
+from cart import Cart
+from catalog import CATALOG_TTL
+from ledger import LEDGER_COMPACT_INTERVAL
+from query_stats import QUERY_STATS
+from reorder import LOW_STOCK_CHECK_INTERVAL, REORDER_COVER_DAYS
+from reservations import RESERVATION_SWEEP_INTERVAL, new_session_id
+from rollups import BREAKDOWNS, PERIODS
+from sale_journal import SALE_JOURNAL, JournalFlusher, SaleJournal
+from search_index import SEARCH_LIMIT
+from store_service import SALES_PAGE_SIZE, InsufficientStockError, StoreService, ValidationError
+
+SALES_WINDOW_PAGES = 3
+
+DB_WORKERS = 2
+EXECUTOR_POLL_MS = 16
+# Time each poll may spend in callbacks before yielding back to Tk
+EXECUTOR_POLL_BUDGET = 0.008
+# Batches a stream may have waiting for the main loop before its worker stops
+# reading; bounds memory when the database is faster than the UI
+STREAM_MAX_PENDING = 4
+
+SEARCH_DEBOUNCE_MS = 150
+DIAGNOSTICS_REFRESH_MS = 1000
+JOURNAL_STATUS_MS = 2000
+
+ANALYTICS_REPORTS = ("Top products", "Top products by quantity", "Seller leaderboard", "Basket sizes",
+                     "Sales by hour")
+ANALYTICS_TOP = 50
+
+# Startup is timed from here to the window being shown and to the sale
+# screen's lists being filled in
+STARTED_AT = time.perf_counter()
+
+
+def action_name(job):
+    # Names the user action a job belongs to for the query stats, e.g.
+    # "StoreManagementSystem.process_sale.<locals>.<lambda>" -> "process_sale"
+    name = getattr(job, "__qualname__", None) or type(job).__name__
+    return name.split(".<locals>")[0].rsplit(".", 1)[-1]
+
+
+class QueryExecutor:
+    # Runs blocking jobs (service calls) on worker threads and hands the
+    # results back to the Tk main loop. Streams hand back one batch at a
+    # time as they are read.
+    def __init__(self, root, workers=DB_WORKERS, on_busy=None):
+        self.root = root
+        self.on_busy = on_busy
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.generations = {}
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.busy = False
+        self.threads = []
+        for _ in range(workers):
+            thread = threading.Thread(target=self.worker, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        self.poll_id = self.root.after(EXECUTOR_POLL_MS, self.poll)
+
+    def submit(self, job, on_success=None, on_error=None, key=None, action=None):
+        # Submitting a job with the same key makes the older one stale: it is
+        # skipped if it has not started yet and its result is dropped otherwise.
+        # Its statements are counted towards `action`, by default the name of
+        # the method that submitted it.
+        generation = self.cancel(key) if key is not None else None
+        self.pending += 1
+        self.notify_busy()
+        self.jobs.put((job, on_success, on_error, key, generation, None, action or action_name(job)))
+
+    def submit_stream(self, job, on_batch, on_done=None, on_error=None, key=None, action=None):
+        # job returns an iterator of batches (e.g. StoreService.iter_products).
+        # It is iterated on a worker thread, on_batch runs on the main loop for
+        # each batch, and a newer submission with the same key stops it.
+        generation = self.cancel(key) if key is not None else None
+        self.pending += 1
+        self.notify_busy()
+        self.jobs.put((job, on_batch, on_error, key, generation, on_done or (lambda _: None),
+                       action or action_name(job)))
+
+    def cancel(self, key):
+        with self.lock:
+            generation = self.generations.get(key, 0) + 1
+            self.generations[key] = generation
+        return generation
+
+    def is_current(self, key, generation):
+        if key is None:
+            return True
+        with self.lock:
+            return self.generations.get(key) == generation
+
+    def worker(self):
+        while True:
+            task = self.jobs.get()
+            if task is None:
+                break
+            job, on_success, on_error, key, generation, on_done, action = task
+            if not self.is_current(key, generation):
+                self.results.put((None, None, key, generation, True, None))
+                continue
+            if on_done is not None:
+                with QUERY_STATS.action(action):
+                    self.run_stream(job, on_success, on_done, on_error, key, generation)
+                continue
+            try:
+                with QUERY_STATS.action(action):
+                    result = job()
+            except Exception as err:
+                self.results.put((on_error, err, key, generation, True, None))
+            else:
+                self.results.put((on_success, result, key, generation, True, None))
+
+    def run_stream(self, job, on_batch, on_done, on_error, key, generation):
+        slots = threading.Semaphore(STREAM_MAX_PENDING)
+        batches = None
+        try:
+            batches = job()
+            for batch in batches:
+                if not self.is_current(key, generation):
+                    break
+                slots.acquire()
+                self.results.put((on_batch, batch, key, generation, False, slots))
+        except Exception as err:
+            self.results.put((on_error, err, key, generation, True, None))
+            return
+        finally:
+            # Release the cursor and connection on this thread
+            if hasattr(batches, "close"):
+                batches.close()
+        self.results.put((on_done, None, key, generation, True, None))
+
+    def poll(self):
+        self.poll_id = self.root.after(EXECUTOR_POLL_MS, self.poll)
+        deadline = time.perf_counter() + EXECUTOR_POLL_BUDGET
+        while time.perf_counter() < deadline:
+            try:
+                callback, value, key, generation, final, slots = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if final:
+                self.pending -= 1
+            try:
+                if callback is not None and self.is_current(key, generation):
+                    callback(value)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                if slots is not None:
+                    slots.release()
+        self.notify_busy()
+
+    def notify_busy(self):
+        busy = self.pending > 0
+        if busy != self.busy:
+            self.busy = busy
+            if self.on_busy:
+                self.on_busy(busy)
+
+    def shutdown(self):
+        self.root.after_cancel(self.poll_id)
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join(timeout=1)
+
+
+class SalesReportPager:
+    # Keyset pagination over (sale_date, sale_id) that keeps at most
+    # SALES_WINDOW_PAGES pages of rows in the tree at any time.
+    def __init__(self, executor, service, tree, status_label):
+        self.executor = executor
+        self.service = service
+        self.tree = tree
+        self.status_label = status_label
+        self.key = f"sales_report_{id(self)}"
+        self.pages = []
+        self.filters = (None, None)
+        self.total = 0
+        self.offset = 0
+        self.at_start = True
+        self.at_end = True
+        self.loading = False
+
+    def reset(self, from_date=None, to_date=None):
+        self.filters = (from_date, to_date)
+
+        self.tree.delete(*self.tree.get_children())
+        self.pages = []
+        self.total = 0
+        self.offset = 0
+        self.at_start = True
+        self.at_end = False
+        self.loading = True
+        self.status_label.config(text="Loading...")
+
+        def job():
+            # The total is counted separately so paging never has to touch every row
+            total = self.service.count_sales(from_date, to_date)
+            return total, self.service.query_sales(from_date, to_date)
+
+        def done(result):
+            self.total, rows = result
+            self.loading = False
+            self.append_page(rows)
+
+        self.executor.submit(job, done, self.on_error, key=self.key, action="sales_report")
+
+    def request_page(self, key, forward, apply):
+        self.loading = True
+        from_date, to_date = self.filters
+
+        def job():
+            return self.service.query_sales(from_date, to_date, key, forward)
+
+        def done(rows):
+            self.loading = False
+            apply(rows)
+
+        self.executor.submit(job, done, self.on_error, key=self.key, action="sales_report")
+
+    def load_next(self):
+        if self.loading or self.at_end:
+            return
+        key = self.pages[-1]["last"] if self.pages else None
+        self.request_page(key, True, self.append_page)
+
+    def load_previous(self):
+        if self.loading or self.at_start or not self.pages:
+            return
+        self.request_page(self.pages[0]["first"], False, self.prepend_page)
+
+    def append_page(self, rows):
+        if len(rows) < SALES_PAGE_SIZE:
+            self.at_end = True
+        if rows:
+            anchor = self.tree.get_children()[-1] if self.pages else None
+            items = [self.tree.insert("", END, values=row) for row in rows]
+            self.pages.append({"first": (rows[0][1], rows[0][0]), "last": (rows[-1][1], rows[-1][0]), "items": items})
+
+            if len(self.pages) > SALES_WINDOW_PAGES:
+                dropped = self.pages.pop(0)
+                self.tree.delete(*dropped["items"])
+                self.offset += len(dropped["items"])
+                self.at_start = False
+            if anchor:
+                self.tree.see(anchor)
+        self.update_status()
+
+    def prepend_page(self, rows):
+        if len(rows) < SALES_PAGE_SIZE:
+            self.at_start = True
+        if rows:
+            anchor = self.tree.get_children()[0]
+            items = [self.tree.insert("", index, values=row) for index, row in enumerate(rows)]
+            self.pages.insert(0, {"first": (rows[0][1], rows[0][0]), "last": (rows[-1][1], rows[-1][0]), "items": items})
+            self.offset = max(self.offset - len(items), 0)
+
+            if len(self.pages) > SALES_WINDOW_PAGES:
+                dropped = self.pages.pop()
+                self.tree.delete(*dropped["items"])
+                self.at_end = False
+            self.tree.see(anchor)
+        self.update_status()
+
+    def on_scroll(self, first, last):
+        if float(last) >= 0.98:
+            self.load_next()
+        elif float(first) <= 0.02:
+            self.load_previous()
+
+    def on_error(self, err):
+        self.loading = False
+        self.update_status()
+        messagebox.showerror("Error", f"Failed to load sales: {err}")
+
+    def close(self):
+        self.executor.cancel(self.key)
+
+    def update_status(self):
+        shown = sum(len(page["items"]) for page in self.pages)
+        if shown:
+            text = f"Showing {self.offset + 1}-{self.offset + shown} of {self.total} sales"
+        else:
+            text = f"Showing 0 of {self.total} sales"
+        self.status_label.config(text=text)
+
+
+class TreeViewModel:
+    # Keeps a Treeview in step with one of the list tables, keyed by primary
+    # key (the first column). The first refresh reads every row; later ones
+    # read only rows changed since (StoreService.iter_changes) and touch
+    # only tree rows that are new or show different values.
+    def __init__(self, executor, service, tree, kind, on_error=None):
+        self.executor = executor
+        self.service = service
+        self.tree = tree
+        self.kind = kind
+        self.on_error = on_error
+        self.key = f"view_{kind}"
+        # key -> values shown
+        self.rows = {}
+        # Watermark of the changes applied, None until the first full load
+        self.since = None
+
+    def refresh(self):
+        since = self.since
+        # A full load also drops rows that are gone from the table
+        seen = set() if since is None else None
+        watermark = [since]
+
+        def apply(rows):
+            for *values, row_watermark in rows:
+                key = values[0]
+                if seen is not None:
+                    seen.add(key)
+                if watermark[0] is None or row_watermark > watermark[0]:
+                    watermark[0] = row_watermark
+                values = tuple(values)
+                shown = self.rows.get(key)
+                if shown == values:
+                    continue
+                if shown is None:
+                    self.tree.insert("", END, iid=str(key), values=values)
+                else:
+                    self.tree.item(str(key), values=values)
+                self.rows[key] = values
+
+        def done(_):
+            if seen is not None:
+                gone = [key for key in self.rows if key not in seen]
+                if gone:
+                    self.tree.delete(*(str(key) for key in gone))
+                for key in gone:
+                    del self.rows[key]
+            self.since = watermark[0]
+
+        self.executor.submit_stream(lambda: self.service.iter_changes(self.kind, since), apply, done,
+                                    self.on_error, key=self.key, action=self.key)
+
+
+class ProductSearchBox:
+    # Turns a combobox into an incremental search over the catalog. Typing
+    # is debounced and the dropdown only ever holds the top matches, so
+    # it stays fast however many products there are.
+    def __init__(self, root, combobox, catalog, limit=SEARCH_LIMIT):
+        self.root = root
+        self.combobox = combobox
+        self.catalog = catalog
+        self.limit = limit
+        self.pending = None
+        combobox.configure(postcommand=self.update_values)
+        combobox.bind("<KeyRelease>", self.on_key)
+
+    def on_key(self, event):
+        if event.keysym in ("Up", "Down", "Return", "Escape", "Tab"):
+            return
+        if self.pending is not None:
+            self.root.after_cancel(self.pending)
+        self.pending = self.root.after(SEARCH_DEBOUNCE_MS, self.update_values)
+
+    def update_values(self):
+        self.pending = None
+        entries = self.catalog.search(self.combobox.get(), self.limit)
+        self.combobox['values'] = [f"{entry.product_id} - {entry.name}" for entry in entries]
+
+    def selected_id(self):
+        # Either a picked "id - name" value or a product name typed in full
+        text = self.combobox.get().strip()
+        try:
+            return int(text.split(" - ")[0])
+        except ValueError:
+            pass
+        matches = self.catalog.search(text, 1)
+        if matches and matches[0].name.lower() == text.lower():
+            return matches[0].product_id
+        return None
+
+    def clear(self):
+        self.combobox.set('')
+        self.update_values()
+
+
+class DiagnosticsPanel:
+    # Window over QUERY_STATS: statements sent per user action, latency and
+    # rows per statement, and the slow query log with captured plans. It
+    # refreshes itself while open and can export the stats for dashboards.
+    def __init__(self, root, stats=QUERY_STATS, startup_times=None):
+        self.stats = stats
+        self.startup_times = startup_times or {}
+        self.window = Toplevel(root)
+        self.window.title("Diagnostics")
+        self.window.geometry("1000x650")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+        frame = Frame(self.window, padx=10, pady=10)
+        frame.pack(fill=X)
+        Button(frame, text="Reset", command=self.reset).pack(side=LEFT, padx=5)
+        Button(frame, text="Export JSON...", command=lambda: self.export("json")).pack(side=LEFT, padx=5)
+        Button(frame, text="Export Prometheus...", command=lambda: self.export("prometheus")).pack(side=LEFT, padx=5)
+        self.summary_label = Label(frame, text="", anchor=W)
+        self.summary_label.pack(side=LEFT, padx=10, fill=X, expand=True)
+
+        tabs = ttk.Notebook(self.window)
+        tabs.pack(fill=BOTH, expand=True, padx=10, pady=(0, 10))
+        self.action_tree = self.add_tree(tabs, "Actions", (
+            ("Action", 180), ("Runs", 60), ("Last Queries", 90), ("Last ms", 80),
+            ("Avg Queries", 90), ("Avg ms", 80)))
+        self.statement_tree = self.add_tree(tabs, "Statements", (
+            ("Statement", 460), ("Calls", 60), ("Rows", 70), ("Avg ms", 70), ("p95 ms", 70),
+            ("Max ms", 70), ("Errors", 60)))
+
+        slow_tab = Frame(tabs)
+        tabs.add(slow_tab, text="Slow Queries")
+        self.slow_tree = ttk.Treeview(slow_tab, columns=("Time", "ms", "Statement"), show="headings", height=12)
+        for column, width in (("Time", 80), ("ms", 70), ("Statement", 700)):
+            self.slow_tree.heading(column, text=column)
+            self.slow_tree.column(column, width=width)
+        self.slow_tree.pack(fill=BOTH, expand=True)
+        self.slow_tree.bind("<<TreeviewSelect>>", self.show_slow_query)
+        self.slow_detail = Text(slow_tab, height=10, wrap=WORD)
+        self.slow_detail.pack(fill=BOTH, expand=True, pady=(5, 0))
+        self.slow_queries = []
+        self.slow_total = None
+
+        self.refresh_id = None
+        self.refresh()
+
+    def add_tree(self, tabs, title, columns):
+        tab = Frame(tabs)
+        tabs.add(tab, text=title)
+        tree = ttk.Treeview(tab, columns=[column for column, _ in columns], show="headings")
+        for column, width in columns:
+            tree.heading(column, text=column)
+            tree.column(column, width=width)
+        scrollbar = ttk.Scrollbar(tab, orient=VERTICAL, command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=RIGHT, fill=Y)
+        tree.pack(side=LEFT, fill=BOTH, expand=True)
+        return tree
+
+    def refresh(self):
+        snapshot = self.stats.snapshot()
+        self.action_tree.delete(*self.action_tree.get_children())
+        for action in snapshot["actions"]:
+            runs = action["runs"]
+            self.action_tree.insert("", END, values=(
+                action["action"], runs, action["last_queries"], f"{action['last_ms']:.1f}",
+                f"{action['queries'] / runs:.1f}", f"{action['total_ms'] / runs:.1f}"))
+        self.statement_tree.delete(*self.statement_tree.get_children())
+        for entry in snapshot["statements"]:
+            self.statement_tree.insert("", END, values=(
+                entry["statement"], entry["calls"], entry["rows"], f"{entry['avg_ms']:.2f}",
+                entry["p95_ms"], f"{entry['max_ms']:.2f}", entry["errors"]))
+        # The slow log only changes when a slow query is added or the stats
+        # are reset; leave the selection alone otherwise
+        if snapshot["slow_queries_total"] != self.slow_total:
+            self.slow_total = snapshot["slow_queries_total"]
+            self.slow_queries = snapshot["slow_queries"]
+            self.slow_tree.delete(*self.slow_tree.get_children())
+            for index, slow in enumerate(reversed(self.slow_queries)):
+                self.slow_tree.insert("", END, iid=str(len(self.slow_queries) - 1 - index), values=(
+                    time.strftime("%H:%M:%S", time.localtime(slow["at"])), f"{slow['elapsed_ms']:.1f}",
+                    slow["statement"]))
+
+        queries = sum(entry["calls"] for entry in snapshot["statements"])
+        text = (f"{queries} statements, {snapshot['slow_queries_total']} slower than {snapshot['slow_query_ms']:g} ms, "
+                f"{snapshot['retries_total']} transaction retries")
+        if self.startup_times:
+            text += "; startup: " + ", ".join(f"{milestone} {ms:.0f} ms"
+                                              for milestone, ms in self.startup_times.items())
+        self.summary_label.config(text=text)
+        self.refresh_id = self.window.after(DIAGNOSTICS_REFRESH_MS, self.refresh)
+
+    def show_slow_query(self, event):
+        selected = self.slow_tree.selection()
+        if not selected:
+            return
+        slow = self.slow_queries[int(selected[0])]
+        detail = f"{slow['statement']}\n\nParameters: {', '.join(slow['params']) or '(none)'}"
+        if slow["plan"]:
+            detail += f"\n\nPlan:\n{slow['plan']}"
+        self.slow_detail.delete("1.0", END)
+        self.slow_detail.insert("1.0", detail)
+
+    def reset(self):
+        self.stats.reset()
+        self.slow_detail.delete("1.0", END)
+
+    def export(self, fmt):
+        extension = ".prom" if fmt == "prometheus" else ".json"
+        path = filedialog.asksaveasfilename(parent=self.window, defaultextension=extension,
+                                            initialfile=f"query_stats{extension}")
+        if not path:
+            return
+        try:
+            self.stats.export(path, fmt)
+        except OSError as err:
+            messagebox.showerror("Error", f"Failed to export stats: {err}", parent=self.window)
+
+    def close(self):
+        if self.refresh_id is not None:
+            self.window.after_cancel(self.refresh_id)
+        self.window.destroy()
+
+
+def analytics_report(analytics, report, from_date, to_date):
+    # (headings, rows, summary line) for the Analytics tab; runs on a worker
+    from analytics import BASKET_HISTOGRAM_MAX, WEEKDAYS
+
+    if report == "Seller leaderboard":
+        rows = analytics.seller_leaderboard(ANALYTICS_TOP, from_date, to_date)
+        return ("ID", "Seller", "Sales", "Items", "Revenue"), rows, f"Top {len(rows)} sellers by revenue"
+    if report == "Basket sizes":
+        stats = analytics.basket_sizes(from_date, to_date)
+        sizes = [str(size) for size in range(BASKET_HISTOGRAM_MAX)] + [f"{BASKET_HISTOGRAM_MAX}+"]
+        summary = (f"{stats.sales} sales, {stats.mean_units:.2f} units on average; "
+                   f"p50/p90/p99 units {'/'.join(map(str, stats.units))}, "
+                   f"totals ${'/$'.join(map(str, stats.totals))}")
+        return ("Units", "Sales"), list(zip(sizes, stats.histogram)), summary
+    if report == "Sales by hour":
+        heatmap = analytics.hour_heatmap(from_date, to_date)
+        rows = [(day, *counts) for day, counts in zip(WEEKDAYS, heatmap.sale_count)]
+        return ("Day", *(f"{hour:02d}" for hour in range(24))), rows, "Sales by weekday and hour of day"
+    by = "quantity" if report == "Top products by quantity" else "revenue"
+    rows = analytics.top_products(ANALYTICS_TOP, by, from_date, to_date)
+    return ("ID", "Product", "Quantity", "Revenue"), rows, f"Top {len(rows)} products by {by}"
+
 
 class StoreManagementSystem:
     def __init__(self, root):
@@ -11,133 +542,149 @@ class StoreManagementSystem:
         self.root.geometry("1000x750")
         self.root.configure(bg="#f0f0f0")
         
-        # Database connection
-        self.db = self.create_db_connection()
-        if self.db is None:
-            messagebox.showerror("Error", "Failed to connect to database. Application will exit.")
-            self.root.destroy()
-            return
-            
-        self.cursor = self.db.cursor()
-        self.initialize_tables()
-        
         # Styling
         self.label_font = ('Arial', 10)
         self.entry_font = ('Arial', 10)
         self.button_font = ('Arial', 10, 'bold')
         self.title_font = ('Arial', 12, 'bold')
         
+        # Database work runs on background threads so the window never blocks.
+        # Completed sales go to the local journal first, so checkout neither
+        # waits for nor depends on the database.
+        self.journal = SaleJournal(SALE_JOURNAL) if SALE_JOURNAL else None
+        self.service = StoreService(journal=self.journal)
+        self.catalog = self.service.catalog
+        self.flusher = None
+        # Sales history held in memory for the Analytics tab, loaded on first use
+        self.analytics = None
+        self.customer_list = []
+        self.seller_list = []
+        # Widgets other tabs fill in, set once their tab has been built
+        self.sale_customer = None
+        self.sale_seller = None
+        self.search_boxes = []
+        self.startup_times = {}
+        # Live list views by table, added as their tabs are built
+        self.views = {}
+        self.journal_waiting = 0
+        # Products at or below their reorder point, as of the last check
+        self.low_stock = []
+        self.low_stock_tree = None
+
+        # Database work runs here; nothing is submitted before the UI exists
+        self.executor = QueryExecutor(self.root, on_busy=self.set_busy)
+
         # Create UI
         self.create_ui()
         
-        # Initialize data
-        self.load_products()
-        self.load_customers()
-        self.load_sellers()
-        self.load_sale_products()
+        # The open sale; the sale screen only displays it
+        self.cart = Cart()
+        self.processing_sale = False
+        self.cart_session = new_session_id()
         
-        # Sale items list
-        self.sale_items = []
+        # The schema check and the lists load while the window is being
+        # drawn; their results are only applied once the main loop runs
+        self.executor.submit(self.service.migrate, self.on_database_ready, self.on_database_error)
+        self.root.bind("<Map>", self.on_first_map)
         
         # Set up closing handler
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
-    def create_db_connection(self):
-        try:
-            connection = mysql.connector.connect(
-                host="localhost",
-                user="root",
-                password="123456789",
-                database="store_management",
-                port=3306,
-                ssl_disabled=True,
-                use_pure=True
-            )
-            if connection.is_connected():
-                db_info = connection.get_server_info()
-                print(f"Successfully connected to MySQL Server version {db_info}")
-            return connection
-        except mysql.connector.Error as err:
-            print(f"Connection error: {err}")
-            messagebox.showerror("Database Error", f"Error connecting to MySQL: {err}")
-            return None
-
-    def initialize_tables(self):
-        try:
-            tables = [
-                """CREATE TABLE IF NOT EXISTS Sellers (
-                    seller_id INT AUTO_INCREMENT PRIMARY KEY,
-                    seller_name VARCHAR(100) NOT NULL,
-                    contact_number VARCHAR(15) NOT NULL,
-                    email VARCHAR(100),
-                    UNIQUE KEY unique_seller (seller_name, contact_number)
-                )""",
-                """CREATE TABLE IF NOT EXISTS Customers (
-                    customer_id INT AUTO_INCREMENT PRIMARY KEY,
-                    customer_name VARCHAR(100) NOT NULL,
-                    contact_number VARCHAR(15) NOT NULL,
-                    email VARCHAR(100),
-                    UNIQUE KEY unique_customer (customer_name, contact_number)
-                )""",
-                """CREATE TABLE IF NOT EXISTS Products (
-                    product_id INT AUTO_INCREMENT PRIMARY KEY,
-                    product_name VARCHAR(100) NOT NULL,
-                    description TEXT,
-                    price DECIMAL(10, 2) NOT NULL,
-                    category VARCHAR(50),
-                    UNIQUE KEY unique_product (product_name)
-                )""",
-                """CREATE TABLE IF NOT EXISTS Inventory (
-                    inventory_id INT AUTO_INCREMENT PRIMARY KEY,
-                    product_id INT NOT NULL,
-                    quantity INT NOT NULL DEFAULT 0,
-                    last_restocked DATE,
-                    FOREIGN KEY (product_id) REFERENCES Products(product_id),
-                    UNIQUE KEY unique_inventory (product_id)
-                )""",
-                """CREATE TABLE IF NOT EXISTS Sales (
-                    sale_id INT AUTO_INCREMENT PRIMARY KEY,
-                    customer_id INT,
-                    seller_id INT,
-                    sale_date DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    total_amount DECIMAL(10, 2),
-                    FOREIGN KEY (customer_id) REFERENCES Customers(customer_id),
-                    FOREIGN KEY (seller_id) REFERENCES Sellers(seller_id)
-                )""",
-                """CREATE TABLE IF NOT EXISTS Sale_Items (
-                    item_id INT AUTO_INCREMENT PRIMARY KEY,
-                    sale_id INT NOT NULL,
-                    product_id INT NOT NULL,
-                    quantity INT NOT NULL,
-                    unit_price DECIMAL(10, 2) NOT NULL,
-                    FOREIGN KEY (sale_id) REFERENCES Sales(sale_id),
-                    FOREIGN KEY (product_id) REFERENCES Products(product_id)
-                )"""
-            ]
-            
-            for table in tables:
-                self.cursor.execute(table)
-                
-            self.db.commit()
-            print("All tables verified/created successfully")
-        except mysql.connector.Error as err:
-            print(f"Table creation error: {err}")
-            messagebox.showerror("Database Error", f"Failed to initialize tables: {err}")
+    def record_startup(self, milestone):
+        elapsed = (time.perf_counter() - STARTED_AT) * 1000
+        self.startup_times[milestone] = elapsed
+        print(f"Startup: {milestone} after {elapsed:.0f} ms")
+
+    def on_first_map(self, event):
+        if event.widget is not self.root:
+            return
+        self.root.unbind("<Map>")
+        self.record_startup("window shown")
+
+    def on_database_ready(self, _):
+        print("Database schema is up to date")
+        self.load_lookups()
+        if self.journal is not None:
+            # Sales queued during an earlier outage are sent first
+            self.flusher = JournalFlusher(self.service, self.journal).start()
+            self.update_journal_status()
+        if CATALOG_TTL:
+            self.root.after(CATALOG_TTL * 1000, self.refresh_catalog)
+        self.sweep_reservations()
+        self.check_low_stock()
+        self.compact_ledger()
+
+    def on_database_error(self, err):
+        print(f"Connection error: {err}")
+        messagebox.showerror("Database Error", f"Failed to connect to database. Application will exit.\n{err}")
+        self.executor.shutdown()
+        self.root.destroy()
+
+    def run_db(self, job, on_success, error_message, key=None, title="Error"):
+        self.executor.submit(job, on_success, lambda err: self.show_db_error(err, error_message, title), key)
+
+    def show_db_error(self, err, error_message, title="Error"):
+        # Validation failures are shown as-is, like the checks done in the UI
+        if isinstance(err, (ValidationError, InsufficientStockError)):
+            messagebox.showerror("Error", str(err))
+        else:
+            messagebox.showerror(title, f"{error_message}: {err}")
+
+    def add_view(self, kind, tree, error_message):
+        self.views[kind] = TreeViewModel(self.executor, self.service, tree, kind,
+                                         lambda err: self.show_db_error(err, error_message))
+
+    def refresh_view(self, kind):
+        # Only rows changed since the last refresh are read and redrawn; a
+        # view whose tab has not been opened yet has nothing to update
+        view = self.views.get(kind)
+        if view is not None:
+            view.refresh()
+
+    def set_busy(self, busy):
+        self.status_label.config(text="Loading..." if busy else "Ready")
+        self.root.config(cursor="watch" if busy else "")
 
     def create_ui(self):
+        status_bar = Frame(self.root, bg="#f0f0f0")
+        status_bar.pack(side=BOTTOM, fill=X, padx=10, pady=(0, 5))
+        Button(status_bar, text="Diagnostics", command=self.show_diagnostics).pack(side=RIGHT)
+        self.low_stock_label = Label(status_bar, text="", anchor=E, bg="#f0f0f0", fg="#D32F2F",
+                                     font=self.label_font, cursor="hand2")
+        self.low_stock_label.pack(side=RIGHT, padx=10)
+        self.low_stock_label.bind("<Button-1>", lambda event: self.show_low_stock())
+        self.journal_label = Label(status_bar, text="", anchor=E, bg="#f0f0f0", font=self.label_font)
+        self.journal_label.pack(side=RIGHT, padx=10)
+        self.status_label = Label(status_bar, text="Ready", anchor=W, bg="#f0f0f0", font=self.label_font)
+        self.status_label.pack(side=LEFT, fill=X, expand=True)
+        
         self.notebook = ttk.Notebook(self.root)
         self.notebook.pack(pady=10, padx=10, fill=BOTH, expand=True)
         
-        self.create_seller_tab()
-        self.create_customer_tab()
-        self.create_product_tab()
-        self.create_inventory_tab()
-        self.create_sales_tab()
-
-    def create_seller_tab(self):
-        tab = Frame(self.notebook, bg="#f0f0f0")
-        self.notebook.add(tab, text="Sellers")
-
+        # Tabs start out empty and get their widgets the first time they are
+        # selected, so only the first one is built before the window shows
+        self.tab_builders = {}
+        for text, build in (("Sellers", self.create_seller_tab),
+                            ("Customers", self.create_customer_tab),
+                            ("Products", self.create_product_tab),
+                            ("Inventory", self.create_inventory_tab),
+                            ("Sales", self.create_sales_tab)):
+            tab = Frame(self.notebook, bg="#f0f0f0")
+            self.notebook.add(tab, text=text)
+            self.tab_builders[str(tab)] = build
+        self.notebook.bind("<<NotebookTabChanged>>", self.build_selected_tab)
+        self.build_selected_tab()
+
+    def show_diagnostics(self):
+        DiagnosticsPanel(self.root, QUERY_STATS, self.startup_times)
+
+    def build_selected_tab(self, event=None):
+        tab = self.notebook.select()
+        build = self.tab_builders.pop(tab, None)
+        if build is not None:
+            build(self.notebook.nametowidget(tab))
+
+    def create_seller_tab(self, tab):
         # Seller Form
         Label(tab, text="Seller Name:", bg="#f0f0f0", font=self.label_font).grid(row=0, column=0, padx=5, pady=5, sticky=W)
         self.seller_name = Entry(tab, font=self.entry_font)
@@ -164,13 +711,11 @@ class StoreManagementSystem:
         self.seller_tree.column("Contact", width=100)
         self.seller_tree.column("Email", width=150)
         self.seller_tree.grid(row=4, column=0, columnspan=2, padx=5, pady=5, sticky="nsew")
+        self.add_view("sellers", self.seller_tree, "Failed to load sellers")
 
         Button(tab, text="View Sellers", command=self.view_sellers, font=self.button_font, bg="#2196F3", fg="white").grid(row=5, column=0, columnspan=2, pady=10)
 
-    def create_customer_tab(self):
-        tab = Frame(self.notebook, bg="#f0f0f0")
-        self.notebook.add(tab, text="Customers")
-
+    def create_customer_tab(self, tab):
         # Customer Form
         Label(tab, text="Customer Name:", bg="#f0f0f0", font=self.label_font).grid(row=0, column=0, padx=5, pady=5, sticky=W)
         self.customer_name = Entry(tab, font=self.entry_font)
@@ -197,13 +742,11 @@ class StoreManagementSystem:
         self.customer_tree.column("Contact", width=100)
         self.customer_tree.column("Email", width=150)
         self.customer_tree.grid(row=4, column=0, columnspan=2, padx=5, pady=5, sticky="nsew")
+        self.add_view("customers", self.customer_tree, "Failed to load customers")
 
         Button(tab, text="View Customers", command=self.view_customers, font=self.button_font, bg="#2196F3", fg="white").grid(row=5, column=0, columnspan=2, pady=10)
 
-    def create_product_tab(self):
-        tab = Frame(self.notebook, bg="#f0f0f0")
-        self.notebook.add(tab, text="Products")
-
+    def create_product_tab(self, tab):
         # Product Form
         Label(tab, text="Product Name:", bg="#f0f0f0", font=self.label_font).grid(row=0, column=0, padx=5, pady=5, sticky=W)
         self.product_name = Entry(tab, font=self.entry_font)
@@ -221,32 +764,44 @@ class StoreManagementSystem:
         self.product_category = Entry(tab, font=self.entry_font)
         self.product_category.grid(row=3, column=1, padx=5, pady=5)
 
-        Button(tab, text="Add Product", command=self.add_product, font=self.button_font, bg="#4CAF50", fg="white").grid(row=4, column=0, columnspan=2, pady=10)
+        Label(tab, text="SKU:", bg="#f0f0f0", font=self.label_font).grid(row=4, column=0, padx=5, pady=5, sticky=W)
+        self.product_sku = Entry(tab, font=self.entry_font)
+        self.product_sku.grid(row=4, column=1, padx=5, pady=5)
+
+        Label(tab, text="Barcode:", bg="#f0f0f0", font=self.label_font).grid(row=5, column=0, padx=5, pady=5, sticky=W)
+        self.product_barcode = Entry(tab, font=self.entry_font)
+        self.product_barcode.grid(row=5, column=1, padx=5, pady=5)
+
+        Button(tab, text="Add Product", command=self.add_product, font=self.button_font, bg="#4CAF50", fg="white").grid(row=6, column=0, columnspan=2, pady=10)
 
         # Product Treeview
-        self.product_tree = ttk.Treeview(tab, columns=("ID", "Name", "Description", "Price", "Category"), show="headings")
+        self.product_tree = ttk.Treeview(tab, columns=("ID", "Name", "Description", "Price", "Category", "SKU", "Barcode"), show="headings")
         self.product_tree.heading("ID", text="ID")
         self.product_tree.heading("Name", text="Name")
         self.product_tree.heading("Description", text="Description")
         self.product_tree.heading("Price", text="Price")
         self.product_tree.heading("Category", text="Category")
+        self.product_tree.heading("SKU", text="SKU")
+        self.product_tree.heading("Barcode", text="Barcode")
         self.product_tree.column("ID", width=50)
         self.product_tree.column("Name", width=150)
         self.product_tree.column("Description", width=200)
         self.product_tree.column("Price", width=80)
         self.product_tree.column("Category", width=100)
-        self.product_tree.grid(row=5, column=0, columnspan=2, padx=5, pady=5, sticky="nsew")
+        self.product_tree.column("SKU", width=100)
+        self.product_tree.column("Barcode", width=120)
+        self.product_tree.grid(row=7, column=0, columnspan=2, padx=5, pady=5, sticky="nsew")
+        self.add_view("products", self.product_tree, "Failed to load products")
 
-        Button(tab, text="View Products", command=self.view_products, font=self.button_font, bg="#2196F3", fg="white").grid(row=6, column=0, columnspan=2, pady=10)
-
-    def create_inventory_tab(self):
-        tab = Frame(self.notebook, bg="#f0f0f0")
-        self.notebook.add(tab, text="Inventory")
+        Button(tab, text="View Products", command=self.view_products, font=self.button_font, bg="#2196F3", fg="white").grid(row=8, column=0, columnspan=2, pady=10)
 
+    def create_inventory_tab(self, tab):
         # Inventory Form
         Label(tab, text="Product:", bg="#f0f0f0", font=self.label_font).grid(row=0, column=0, padx=5, pady=5, sticky=W)
         self.inventory_product = ttk.Combobox(tab, font=self.entry_font)
         self.inventory_product.grid(row=0, column=1, padx=5, pady=5)
+        self.inventory_search = ProductSearchBox(self.root, self.inventory_product, self.catalog)
+        self.search_boxes.append(self.inventory_search)
 
         Label(tab, text="Quantity:", bg="#f0f0f0", font=self.label_font).grid(row=1, column=0, padx=5, pady=5, sticky=W)
         self.inventory_quantity = Entry(tab, font=self.entry_font)
@@ -265,31 +820,38 @@ class StoreManagementSystem:
         self.inventory_tree.column("Quantity", width=80)
         self.inventory_tree.column("Last Restocked", width=120)
         self.inventory_tree.grid(row=3, column=0, columnspan=2, padx=5, pady=5, sticky="nsew")
+        self.add_view("inventory", self.inventory_tree, "Failed to load inventory")
 
-        Button(tab, text="View Inventory", command=self.view_inventory, font=self.button_font, bg="#2196F3", fg="white").grid(row=4, column=0, columnspan=2, pady=10)
-
-    def create_sales_tab(self):
-        tab = Frame(self.notebook, bg="#f0f0f0")
-        self.notebook.add(tab, text="Sales")
+        Button(tab, text="View Inventory", command=self.view_inventory, font=self.button_font, bg="#2196F3", fg="white").grid(row=4, column=0, pady=10)
+        Button(tab, text="Low Stock", command=self.show_low_stock, font=self.button_font, bg="#FF9800", fg="white").grid(row=4, column=1, pady=10)
 
+    def create_sales_tab(self, tab):
         # Sales Form
         Label(tab, text="Customer:", bg="#f0f0f0", font=self.label_font).grid(row=0, column=0, padx=5, pady=5, sticky=W)
-        self.sale_customer = ttk.Combobox(tab, font=self.entry_font)
+        self.sale_customer = ttk.Combobox(tab, font=self.entry_font, values=self.customer_list)
         self.sale_customer.grid(row=0, column=1, padx=5, pady=5)
 
         Label(tab, text="Seller:", bg="#f0f0f0", font=self.label_font).grid(row=1, column=0, padx=5, pady=5, sticky=W)
-        self.sale_seller = ttk.Combobox(tab, font=self.entry_font)
+        self.sale_seller = ttk.Combobox(tab, font=self.entry_font, values=self.seller_list)
         self.sale_seller.grid(row=1, column=1, padx=5, pady=5)
 
-        Label(tab, text="Product:", bg="#f0f0f0", font=self.label_font).grid(row=2, column=0, padx=5, pady=5, sticky=W)
+        # Scanners type the code and press Enter; each scan adds one unit
+        Label(tab, text="Scan SKU/Barcode:", bg="#f0f0f0", font=self.label_font).grid(row=2, column=0, padx=5, pady=5, sticky=W)
+        self.sale_scan = Entry(tab, font=self.entry_font)
+        self.sale_scan.grid(row=2, column=1, padx=5, pady=5)
+        self.sale_scan.bind("<Return>", self.scan_item)
+
+        Label(tab, text="Product:", bg="#f0f0f0", font=self.label_font).grid(row=3, column=0, padx=5, pady=5, sticky=W)
         self.sale_product = ttk.Combobox(tab, font=self.entry_font)
-        self.sale_product.grid(row=2, column=1, padx=5, pady=5)
+        self.sale_product.grid(row=3, column=1, padx=5, pady=5)
+        self.sale_search = ProductSearchBox(self.root, self.sale_product, self.catalog)
+        self.search_boxes.append(self.sale_search)
 
-        Label(tab, text="Quantity:", bg="#f0f0f0", font=self.label_font).grid(row=3, column=0, padx=5, pady=5, sticky=W)
+        Label(tab, text="Quantity:", bg="#f0f0f0", font=self.label_font).grid(row=4, column=0, padx=5, pady=5, sticky=W)
         self.sale_quantity = Entry(tab, font=self.entry_font)
-        self.sale_quantity.grid(row=3, column=1, padx=5, pady=5)
+        self.sale_quantity.grid(row=4, column=1, padx=5, pady=5)
 
-        Button(tab, text="Add to Sale", command=self.add_sale_item, font=self.button_font, bg="#4CAF50", fg="white").grid(row=4, column=0, columnspan=2, pady=10)
+        Button(tab, text="Add to Sale", command=self.add_sale_item, font=self.button_font, bg="#4CAF50", fg="white").grid(row=5, column=0, columnspan=2, pady=10)
 
         # Sale Items Treeview
         self.sale_items_tree = ttk.Treeview(tab, columns=("Product", "Quantity", "Price", "Total"), show="headings")
@@ -301,150 +863,205 @@ class StoreManagementSystem:
         self.sale_items_tree.column("Quantity", width=80)
         self.sale_items_tree.column("Price", width=80)
         self.sale_items_tree.column("Total", width=80)
-        self.sale_items_tree.grid(row=5, column=0, columnspan=2, padx=5, pady=5, sticky="nsew")
+        self.sale_items_tree.grid(row=6, column=0, columnspan=2, padx=5, pady=5, sticky="nsew")
+
+        # An amount ("5") or a rate of the subtotal ("10%")
+        Label(tab, text="Discount:", bg="#f0f0f0", font=self.label_font).grid(row=7, column=0, padx=5, pady=5, sticky=W)
+        self.sale_discount = Entry(tab, font=self.entry_font)
+        self.sale_discount.grid(row=7, column=1, padx=5, pady=5)
+        self.sale_discount.bind("<Return>", self.apply_discount)
+        self.sale_discount.bind("<FocusOut>", self.apply_discount)
 
         # Total Label
-        self.sale_total_label = Label(tab, text="Total: $0.00", bg="#f0f0f0", font=self.title_font)
-        self.sale_total_label.grid(row=6, column=0, columnspan=2, pady=5)
+        self.sale_total_label = Label(tab, bg="#f0f0f0", font=self.title_font)
+        self.sale_total_label.grid(row=8, column=0, columnspan=2, pady=5)
+        self.show_cart_totals()
+
+        Button(tab, text="Process Sale", command=self.process_sale, font=self.button_font, bg="#FF5722", fg="white").grid(row=9, column=0, pady=10)
+        Button(tab, text="View Sales", command=self.view_sales, font=self.button_font, bg="#2196F3", fg="white").grid(row=9, column=1, pady=10)
 
-        Button(tab, text="Process Sale", command=self.process_sale, font=self.button_font, bg="#FF5722", fg="white").grid(row=7, column=0, pady=10)
-        Button(tab, text="View Sales", command=self.view_sales, font=self.button_font, bg="#2196F3", fg="white").grid(row=7, column=1, pady=10)
 
     def load_products(self):
-        try:
-            self.cursor.execute("SELECT product_id, product_name FROM Products")
-            products = self.cursor.fetchall()
-            self.product_list = [f"{product[0]} - {product[1]}" for product in products]
-            self.inventory_product['values'] = self.product_list
-            self.sale_product['values'] = self.product_list
-        except mysql.connector.Error as err:
-            messagebox.showerror("Error", f"Failed to load products: {err}")
+        # Warming the catalog also builds the search index for the comboboxes
+        self.run_db(self.service.warm_catalog, lambda _: self.fill_product_lists(),
+                    "Failed to load products", key="load_products")
+
+    def fill_product_lists(self):
+        # Only tabs that have been built have search boxes to fill
+        for search in self.search_boxes:
+            search.update_values()
+
+    def refresh_catalog(self):
+        # Pick up price and stock changes made by other terminals
+        if self.catalog.is_stale():
+            self.load_products()
+        self.root.after(CATALOG_TTL * 1000, self.refresh_catalog)
+
+    def load_lookups(self):
+        # Catalog, customers and sellers arrive together from one query
+        def done(lookups):
+            self.fill_product_lists()
+            self.fill_customers(lookups.customers)
+            self.fill_sellers(lookups.sellers)
+            self.record_startup("lists loaded")
+
+        self.run_db(self.service.load_lookups, done, "Failed to load products, customers and sellers")
 
     def load_customers(self):
-        try:
-            self.cursor.execute("SELECT customer_id, customer_name FROM Customers")
-            customers = self.cursor.fetchall()
-            self.customer_list = [f"{customer[0]} - {customer[1]}" for customer in customers]
+        def done(customers):
+            self.fill_customers((customer.customer_id, customer.name) for customer in customers)
+
+        self.run_db(self.service.list_customers, done, "Failed to load customers", key="load_customers")
+
+    def fill_customers(self, customers):
+        self.customer_list = [f"{customer_id} - {name}" for customer_id, name in customers]
+        if self.sale_customer is not None:
             self.sale_customer['values'] = self.customer_list
-        except mysql.connector.Error as err:
-            messagebox.showerror("Error", f"Failed to load customers: {err}")
 
     def load_sellers(self):
-        try:
-            self.cursor.execute("SELECT seller_id, seller_name FROM Sellers")
-            sellers = self.cursor.fetchall()
-            self.seller_list = [f"{seller[0]} - {seller[1]}" for seller in sellers]
+        def done(sellers):
+            self.fill_sellers((seller.seller_id, seller.name) for seller in sellers)
+
+        self.run_db(self.service.list_sellers, done, "Failed to load sellers", key="load_sellers")
+
+    def fill_sellers(self, sellers):
+        self.seller_list = [f"{seller_id} - {name}" for seller_id, name in sellers]
+        if self.sale_seller is not None:
             self.sale_seller['values'] = self.seller_list
-        except mysql.connector.Error as err:
-            messagebox.showerror("Error", f"Failed to load sellers: {err}")
 
-    def load_sale_products(self):
-        try:
-            self.cursor.execute("SELECT product_id, product_name, price FROM Products")
-            self.sale_products_data = {f"{product[0]} - {product[1]}": product[2] for product in self.cursor.fetchall()}
-        except mysql.connector.Error as err:
-            messagebox.showerror("Error", f"Failed to load product prices: {err}")
+    def update_journal_status(self):
+        # A local file read, cheap enough for the main loop
+        waiting, failed = self.journal.counts()
+        text = f"{waiting} sale(s) waiting to sync" if waiting else ""
+        if failed:
+            text += ("; " if text else "") + f"{failed} sale(s) need attention"
+        if waiting and self.flusher.last_error is not None:
+            text += " (database unreachable)"
+        self.journal_label.config(text=text, fg="#D32F2F" if failed else "black")
+        if waiting < self.journal_waiting:
+            # Queued sales reached the database and changed its stock
+            self.refresh_view("inventory")
+            self.refresh_low_stock()
+        self.journal_waiting = waiting
+        self.root.after(JOURNAL_STATUS_MS, self.update_journal_status)
+
+    def sweep_reservations(self):
+        # Hand back stock held by carts that were abandoned
+        self.executor.submit(self.service.expire_reservations, None,
+                             lambda err: print(f"Failed to expire reservations: {err}"),
+                             key="expire_reservations")
+        self.root.after(RESERVATION_SWEEP_INTERVAL * 1000, self.sweep_reservations)
+
+    def compact_ledger(self):
+        # Rolls yesterday's stock movements into snapshots; a no-op until
+        # the next day once any terminal has done it
+        self.executor.submit(self.service.compact_ledger, None,
+                             lambda err: print(f"Failed to compact the stock ledger: {err}"), key="compact_ledger")
+        self.root.after(LEDGER_COMPACT_INTERVAL * 1000, self.compact_ledger)
+
+    def check_low_stock(self):
+        # The low-stock monitor: velocities are brought up to date once a
+        # day, and each check is an indexed query over the flagged products
+        self.executor.submit(self.service.check_low_stock, self.show_low_stock_count,
+                             lambda err: print(f"Failed to check stock levels: {err}"), key="check_low_stock")
+        self.root.after(LOW_STOCK_CHECK_INTERVAL * 1000, self.check_low_stock)
+
+    def refresh_low_stock(self):
+        # Its own key, so it never makes a queued daily update stale
+        self.executor.submit(self.service.low_stock, self.show_low_stock_count,
+                             lambda err: print(f"Failed to check stock levels: {err}"), key="low_stock")
+
+    def show_low_stock_count(self, rows):
+        self.low_stock = rows
+        self.low_stock_label.config(text=f"{len(rows)} product(s) low on stock" if rows else "")
+        if self.low_stock_tree is not None and self.low_stock_tree.winfo_exists():
+            self.fill_low_stock_tree()
+
+    def show_low_stock(self):
+        if self.low_stock_tree is not None and self.low_stock_tree.winfo_exists():
+            self.low_stock_tree.winfo_toplevel().lift()
+            return
+        window = Toplevel(self.root)
+        window.title(f"Low Stock (cover for {REORDER_COVER_DAYS} days)")
+        window.geometry("800x400")
+        columns = ("ID", "Product", "SKU", "Available", "Reorder Point", "Per Day", "Days Left")
+        tree = self.low_stock_tree = ttk.Treeview(window, columns=columns, show="headings")
+        for column, width in zip(columns, (50, 200, 100, 80, 100, 80, 80)):
+            tree.heading(column, text=column)
+            tree.column(column, width=width)
+        tree.pack(fill=BOTH, expand=True, padx=10, pady=10)
+        self.fill_low_stock_tree()
+        self.refresh_low_stock()
+
+    def fill_low_stock_tree(self):
+        tree = self.low_stock_tree
+        tree.delete(*tree.get_children())
+        for row in self.low_stock:
+            days = "" if row.days_left is None else row.days_left
+            tree.insert("", END, values=(row.product_id, row.product_name, row.sku or "", row.available,
+                                         row.reorder_point, f"{row.daily_velocity:.2f}", days))
 
     def add_seller(self):
         name = self.seller_name.get()
         contact = self.seller_contact.get()
         email = self.seller_email.get()
 
-        if not name or not contact:
-            messagebox.showerror("Error", "Name and Contact are required fields")
-            return
-
-        try:
-            self.cursor.execute("INSERT INTO Sellers (seller_name, contact_number, email) VALUES (%s, %s, %s)", 
-                              (name, contact, email))
-            self.db.commit()
+        def done(_):
             messagebox.showinfo("Success", "Seller added successfully")
             self.seller_name.delete(0, END)
             self.seller_contact.delete(0, END)
             self.seller_email.delete(0, END)
             self.load_sellers()
-        except mysql.connector.Error as err:
-            messagebox.showerror("Error", f"Failed to add seller: {err}")
-            self.db.rollback()
+            self.refresh_view("sellers")
+
+        self.run_db(lambda: self.service.add_seller(name, contact, email), done, "Failed to add seller")
 
     def view_sellers(self):
-        try:
-            self.seller_tree.delete(*self.seller_tree.get_children())
-            self.cursor.execute("SELECT seller_id, seller_name, contact_number, email FROM Sellers")
-            sellers = self.cursor.fetchall()
-            for seller in sellers:
-                self.seller_tree.insert("", END, values=seller)
-        except mysql.connector.Error as err:
-            messagebox.showerror("Error", f"Failed to load sellers: {err}")
+        self.refresh_view("sellers")
 
     def add_customer(self):
         name = self.customer_name.get()
         contact = self.customer_contact.get()
         email = self.customer_email.get()
 
-        if not name or not contact:
-            messagebox.showerror("Error", "Name and Contact are required fields")
-            return
-
-        try:
-            self.cursor.execute("INSERT INTO Customers (customer_name, contact_number, email) VALUES (%s, %s, %s)", 
-                              (name, contact, email))
-            self.db.commit()
+        def done(_):
             messagebox.showinfo("Success", "Customer added successfully")
             self.customer_name.delete(0, END)
             self.customer_contact.delete(0, END)
             self.customer_email.delete(0, END)
             self.load_customers()
-        except mysql.connector.Error as err:
-            messagebox.showerror("Error", f"Failed to add customer: {err}")
-            self.db.rollback()
+            self.refresh_view("customers")
+
+        self.run_db(lambda: self.service.add_customer(name, contact, email), done, "Failed to add customer")
 
     def view_customers(self):
-        try:
-            self.customer_tree.delete(*self.customer_tree.get_children())
-            self.cursor.execute("SELECT customer_id, customer_name, contact_number, email FROM Customers")
-            customers = self.cursor.fetchall()
-            for customer in customers:
-                self.customer_tree.insert("", END, values=customer)
-        except mysql.connector.Error as err:
-            messagebox.showerror("Error", f"Failed to load customers: {err}")
+        self.refresh_view("customers")
 
     def add_product(self):
         name = self.product_name.get()
         desc = self.product_desc.get()
         price = self.product_price.get()
         category = self.product_category.get()
+        sku = self.product_sku.get().strip()
+        barcode = self.product_barcode.get().strip()
 
-        if not name or not price:
-            messagebox.showerror("Error", "Name and Price are required fields")
-            return
-
-        try:
-            price = float(price)
-            self.cursor.execute("INSERT INTO Products (product_name, description, price, category) VALUES (%s, %s, %s, %s)", 
-                              (name, desc, price, category))
-            self.db.commit()
+        def done(_):
             messagebox.showinfo("Success", "Product added successfully")
             self.product_name.delete(0, END)
             self.product_desc.delete(0, END)
             self.product_price.delete(0, END)
             self.product_category.delete(0, END)
-            self.load_products()
-        except ValueError:
-            messagebox.showerror("Error", "Price must be a valid number")
-        except mysql.connector.Error as err:
-            messagebox.showerror("Error", f"Failed to add product: {err}")
-            self.db.rollback()
+            self.product_sku.delete(0, END)
+            self.product_barcode.delete(0, END)
+            self.fill_product_lists()
+            self.refresh_view("products")
+            self.refresh_view("inventory")
+
+        self.run_db(lambda: self.service.add_product(name, price, desc, category, sku, barcode), done,
+                    "Failed to add product")
 
     def view_products(self):
-        try:
-            self.product_tree.delete(*self.product_tree.get_children())
-            self.cursor.execute("SELECT product_id, product_name, description, price, category FROM Products")
-            products = self.cursor.fetchall()
-            for product in products:
-                self.product_tree.insert("", END, values=product)
-        except mysql.connector.Error as err:
-            messagebox.showerror("Error", f"Failed to load products: {err}")
+        self.refresh_view("products")
 
     def update_inventory(self):
         product = self.inventory_product.get()
@@ -454,48 +1071,28 @@ class StoreManagementSystem:
             messagebox.showerror("Error", "Product and Quantity are required fields")
             return
 
+        product_id = self.inventory_search.selected_id()
+        if product_id is None:
+            messagebox.showerror("Error", "Select a product from the list")
+            return
+
         try:
-            product_id = int(product.split(" - ")[0])
             quantity = int(quantity)
-            
-            # Check if inventory record exists
-            self.cursor.execute("SELECT quantity FROM Inventory WHERE product_id = %s", (product_id,))
-            result = self.cursor.fetchone()
-            
-            if result:
-                # Update existing inventory
-                new_quantity = result[0] + quantity
-                self.cursor.execute("UPDATE Inventory SET quantity = %s, last_restocked = CURDATE() WHERE product_id = %s",
-                                  (new_quantity, product_id))
-            else:
-                # Create new inventory record
-                self.cursor.execute("INSERT INTO Inventory (product_id, quantity, last_restocked) VALUES (%s, %s, CURDATE())",
-                                  (product_id, quantity))
-            
-            self.db.commit()
+        except ValueError:
+            messagebox.showerror("Error", "Quantity must be a valid integer")
+            return
+
+        def done(_):
             messagebox.showinfo("Success", "Inventory updated successfully")
-            self.inventory_product.set('')
+            self.inventory_search.clear()
             self.inventory_quantity.delete(0, END)
             self.view_inventory()
-        except ValueError:
-            messagebox.showerror("Error", "Quantity must be a valid integer")
-        except mysql.connector.Error as err:
-            messagebox.showerror("Error", f"Failed to update inventory: {err}")
-            self.db.rollback()
+            self.refresh_low_stock()
+
+        self.run_db(lambda: self.service.restock(product_id, quantity), done, "Failed to update inventory")
 
     def view_inventory(self):
-        try:
-            self.inventory_tree.delete(*self.inventory_tree.get_children())
-            self.cursor.execute("""
-                SELECT i.inventory_id, p.product_name, i.quantity, i.last_restocked 
-                FROM Inventory i
-                JOIN Products p ON i.product_id = p.product_id
-            """)
-            inventory = self.cursor.fetchall()
-            for item in inventory:
-                self.inventory_tree.insert("", END, values=item)
-        except mysql.connector.Error as err:
-            messagebox.showerror("Error", f"Failed to load inventory: {err}")
+        self.refresh_view("inventory")
 
     def add_sale_item(self):
         product = self.sale_product.get()
@@ -505,78 +1102,91 @@ class StoreManagementSystem:
             messagebox.showerror("Error", "Product and Quantity are required fields")
             return
 
+        product_id = self.sale_search.selected_id()
+        if product_id is None:
+            messagebox.showerror("Error", "Select a product from the list")
+            return
+
         try:
             # Convert quantity to integer and validate
             quantity = int(quantity)
             if quantity <= 0:
                 messagebox.showerror("Error", "Quantity must be a positive number")
                 return
+        except ValueError:
+            messagebox.showerror("Error", "Quantity must be a valid number")
+            return
 
-            # Get product details
-            product_id = int(product.split(" - ")[0])
-            
-            # Get product price from database and handle Decimal type
-            self.cursor.execute("SELECT price FROM Products WHERE product_id = %s", (product_id,))
-            result = self.cursor.fetchone()
-            
-            if not result:
-                messagebox.showerror("Error", "Selected product not found")
-                return
-                
-            price = float(result[0]) if isinstance(result[0], Decimal) else result[0]
+        # Cheap pre-check against the cached stock before asking the database
+        entry = self.catalog.get(product_id)
+        if entry is not None and entry.stock is None:
+            messagebox.showerror("Error", "Product not available in inventory")
+            return
+        if entry is not None and quantity > entry.stock:
+            messagebox.showerror("Error", f"Not enough stock. Only {entry.stock} available")
+            return
 
-            # Check inventory availability
-            self.cursor.execute("SELECT quantity FROM Inventory WHERE product_id = %s", (product_id,))
-            inventory = self.cursor.fetchone()
-            
-            if not inventory:
-                messagebox.showerror("Error", "Product not available in inventory")
-                return
-                
-            available_quantity = inventory[0]
-            if quantity > available_quantity:
-                messagebox.showerror("Error", f"Not enough stock. Only {available_quantity} available")
-                return
+        # Hold the stock for this cart so another till cannot sell it
+        session_id = self.cart_session
+        def done(entry):
+            self.add_cart_line(product, entry, quantity)
+            # Clear the input fields
+            self.sale_search.clear()
+            self.sale_quantity.delete(0, END)
 
-            # Calculate total for this item
-            total = float(price * quantity)
+        self.run_db(lambda: self.service.reserve(session_id, product_id, quantity), done,
+                    "Failed to add sale item", title="Database Error")
 
-            # Add to sale items list
-            self.sale_items.append({
-                "product_id": product_id,
-                "product_name": product,
-                "quantity": quantity,
-                "price": price,
-                "total": total
-            })
+    def scan_item(self, event=None):
+        code = self.sale_scan.get().strip()
+        # Ready for the next scan straight away
+        self.sale_scan.delete(0, END)
+        if not code:
+            return
 
-            # Update the treeview
-            self.sale_items_tree.insert("", END, 
-                                      values=(product, quantity, f"${price:.2f}", f"${total:.2f}"))
+        entry = self.catalog.lookup_code(code)
+        if entry is not None and not entry.stock:
+            messagebox.showerror("Error", f"{entry.name} is out of stock")
+            return
 
-            # Update total label - handle Decimal/float conversion
-            current_total_text = self.sale_total_label.cget("text")
-            try:
-                current_total = float(current_total_text.split("$")[1]) if "$" in current_total_text else 0.0
-            except:
-                current_total = 0.0
-                
-            new_total = current_total + total
-            self.sale_total_label.config(text=f"Total: ${new_total:.2f}")
+        session_id = self.cart_session
+        self.run_db(lambda: self.service.scan(session_id, code),
+                    lambda entry: self.add_cart_line(f"{entry.product_id} - {entry.name}", entry, 1),
+                    "Failed to scan item", title="Scan Error")
 
-            # Clear the input fields
-            self.sale_product.set('')
-            self.sale_quantity.delete(0, END)
+    def add_cart_line(self, product, entry, quantity):
+        line = self.cart.add(entry.product_id, product, entry.price, quantity)
+        row = str(line.product_id)
+        if not self.sale_items_tree.exists(row):
+            self.sale_items_tree.insert("", END, iid=row)
+        self.sale_items_tree.item(row, values=(line.name, line.quantity, f"${line.unit_price}", f"${line.total}"))
+        self.show_cart_totals()
 
-        except ValueError:
-            messagebox.showerror("Error", "Quantity must be a valid number")
-        except mysql.connector.Error as err:
-            messagebox.showerror("Database Error", f"Failed to add sale item: {err}")
-        except Exception as err:
-            messagebox.showerror("Error", f"Unexpected error: {str(err)}")
+    def apply_discount(self, event=None):
+        try:
+            self.cart.set_discount_text(self.sale_discount.get())
+        except ValidationError as err:
+            messagebox.showerror("Error", str(err))
+            self.sale_discount.delete(0, END)
+            self.cart.set_discount()
+            return False
+        finally:
+            self.show_cart_totals()
+        return True
+
+    def show_cart_totals(self):
+        totals = self.cart.totals
+        if not totals.discount and not totals.tax:
+            self.sale_total_label.config(text=f"Total: ${totals.total}")
+            return
+        self.sale_total_label.config(text=f"Subtotal: ${totals.subtotal}   Discount: -${totals.discount}   "
+                                          f"Tax: ${totals.tax}   Total: ${totals.total}")
 
     def process_sale(self):
-        if not self.sale_items:
+        if self.processing_sale:
+            return
+
+        if not self.cart:
             messagebox.showerror("Error", "No items in the sale")
             return
 
@@ -590,144 +1200,234 @@ class StoreManagementSystem:
         try:
             customer_id = int(customer.split(" - ")[0])
             seller_id = int(seller.split(" - ")[0])
-            
-            # Handle Decimal/float conversion for total amount
-            total_amount_text = self.sale_total_label.cget("text")
-            total_amount = float(total_amount_text.split("$")[1]) if "$" in total_amount_text else 0.0
-            
-            # Start transaction
-            self.cursor.execute("START TRANSACTION")
-            
-            # Create sale record
-            self.cursor.execute("""
-                INSERT INTO Sales (customer_id, seller_id, total_amount) 
-                VALUES (%s, %s, %s)
-            """, (customer_id, seller_id, total_amount))
-            sale_id = self.cursor.lastrowid
-            
-            # Add sale items and update inventory
-            for item in self.sale_items:
-                product_id = item['product_id']
-                
-                # Add sale item - ensure proper decimal handling
-                unit_price = Decimal(str(item['price']))
-                self.cursor.execute("""
-                    INSERT INTO Sale_Items (sale_id, product_id, quantity, unit_price)
-                    VALUES (%s, %s, %s, %s)
-                """, (sale_id, product_id, item['quantity'], unit_price))
-                
-                # Update inventory
-                self.cursor.execute("""
-                    UPDATE Inventory 
-                    SET quantity = quantity - %s 
-                    WHERE product_id = %s
-                """, (item['quantity'], product_id))
-            
-            self.db.commit()
+        except ValueError as err:
+            messagebox.showerror("Error", f"An error occurred: {str(err)}")
+            return
+
+        # Picks up a discount typed but not yet confirmed with Enter
+        if not self.apply_discount():
+            return
+        lines = self.cart.sale_lines()
+        totals = self.cart.totals
+        session_id = self.cart_session
+
+        def done(_):
+            self.processing_sale = False
+            if self.flusher is not None:
+                self.flusher.wake()
             messagebox.showinfo("Success", "Sale processed successfully")
             
             # Reset sale form
-            self.sale_items = []
+            self.cart_session = new_session_id()
+            self.cart.clear()
             self.sale_items_tree.delete(*self.sale_items_tree.get_children())
-            self.sale_total_label.config(text="Total: $0.00")
+            self.sale_discount.delete(0, END)
+            self.show_cart_totals()
             self.sale_customer.set('')
             self.sale_seller.set('')
             self.view_inventory()
-        except mysql.connector.Error as err:
-            self.db.rollback()
+            self.refresh_low_stock()
+
+        def failed(err):
+            self.processing_sale = False
             messagebox.showerror("Error", f"Failed to process sale: {err}")
-        except Exception as err:
-            self.db.rollback()
-            messagebox.showerror("Error", f"An error occurred: {str(err)}")
+
+        self.processing_sale = True
+        if self.flusher is not None:
+            job = lambda: self.service.queue_sale(customer_id, seller_id, lines, session_id,
+                                                  discount=totals.discount, tax=totals.tax)
+        else:
+            job = lambda: self.service.create_sale(customer_id, seller_id, lines, session_id,
+                                                   discount=totals.discount, tax=totals.tax)
+        self.executor.submit(job, done, failed)
 
     def view_sales(self):
-        try:
-            # Create a new window for sales report
-            sales_window = Toplevel(self.root)
-            sales_window.title("Sales Report")
-            sales_window.geometry("1000x600")
-            
-            # Date range selection
-            frame = Frame(sales_window, padx=10, pady=10)
-            frame.pack(fill=X)
-            
-            Label(frame, text="From:").grid(row=0, column=0, padx=5)
-            self.from_date = Entry(frame)
-            self.from_date.grid(row=0, column=1, padx=5)
-            
-            Label(frame, text="To:").grid(row=0, column=2, padx=5)
-            self.to_date = Entry(frame)
-            self.to_date.grid(row=0, column=3, padx=5)
-            
-            Button(frame, text="Filter", command=self.filter_sales).grid(row=0, column=4, padx=10)
-            
-            # Sales Treeview
-            tree = ttk.Treeview(sales_window, columns=("ID", "Date", "Customer", "Seller", "Total"), show="headings")
-            tree.heading("ID", text="ID")
-            tree.heading("Date", text="Date")
-            tree.heading("Customer", text="Customer")
-            tree.heading("Seller", text="Seller")
-            tree.heading("Total", text="Total")
-            tree.column("ID", width=50)
-            tree.column("Date", width=120)
-            tree.column("Customer", width=150)
-            tree.column("Seller", width=150)
-            tree.column("Total", width=100)
-            tree.pack(fill=BOTH, expand=True, padx=10, pady=10)
-            
-            # Load all sales initially
-            self.cursor.execute("""
-                SELECT s.sale_id, s.sale_date, c.customer_name, sl.seller_name, s.total_amount 
-                FROM Sales s
-                LEFT JOIN Customers c ON s.customer_id = c.customer_id
-                LEFT JOIN Sellers sl ON s.seller_id = sl.seller_id
-                ORDER BY s.sale_date DESC
-            """)
-            sales = self.cursor.fetchall()
-            for sale in sales:
-                tree.insert("", END, values=sale)
-            
-            # Store the tree reference for filtering
-            self.sales_tree = tree
-        except mysql.connector.Error as err:
-            messagebox.showerror("Error", f"Failed to load sales: {err}")
+        # Create a new window for sales report
+        sales_window = Toplevel(self.root)
+        sales_window.title("Sales Report")
+        sales_window.geometry("1000x600")
+        
+        # Date range selection
+        frame = Frame(sales_window, padx=10, pady=10)
+        frame.pack(fill=X)
+        
+        Label(frame, text="From:").grid(row=0, column=0, padx=5)
+        self.from_date = Entry(frame)
+        self.from_date.grid(row=0, column=1, padx=5)
+        
+        Label(frame, text="To:").grid(row=0, column=2, padx=5)
+        self.to_date = Entry(frame)
+        self.to_date.grid(row=0, column=3, padx=5)
+        
+        Button(frame, text="Filter", command=self.filter_sales).grid(row=0, column=4, padx=10)
+        
+        report_tabs = ttk.Notebook(sales_window)
+        report_tabs.pack(fill=BOTH, expand=True, padx=10, pady=10)
+        sales_tab = Frame(report_tabs)
+        report_tabs.add(sales_tab, text="Sales")
+        totals_tab = Frame(report_tabs)
+        report_tabs.add(totals_tab, text="Totals")
+        analytics_tab = Frame(report_tabs)
+        report_tabs.add(analytics_tab, text="Analytics")
+        
+        # Sales Treeview
+        tree_frame = Frame(sales_tab)
+        tree_frame.pack(fill=BOTH, expand=True)
+        tree = ttk.Treeview(tree_frame, columns=("ID", "Date", "Customer", "Seller", "Total"), show="headings")
+        tree.heading("ID", text="ID")
+        tree.heading("Date", text="Date")
+        tree.heading("Customer", text="Customer")
+        tree.heading("Seller", text="Seller")
+        tree.heading("Total", text="Total")
+        tree.column("ID", width=50)
+        tree.column("Date", width=120)
+        tree.column("Customer", width=150)
+        tree.column("Seller", width=150)
+        tree.column("Total", width=100)
+        scrollbar = ttk.Scrollbar(tree_frame, orient=VERTICAL, command=tree.yview)
+        scrollbar.pack(side=RIGHT, fill=Y)
+        tree.pack(side=LEFT, fill=BOTH, expand=True)
+        
+        status_label = Label(sales_tab, text="", anchor=W)
+        status_label.pack(fill=X, pady=(5, 0))
+        
+        # Rows are fetched page by page as the user scrolls
+        pager = self.sales_pager = SalesReportPager(self.executor, self.service, tree, status_label)
+        
+        def on_scroll(first, last):
+            scrollbar.set(first, last)
+            pager.on_scroll(first, last)
+        tree.configure(yscrollcommand=on_scroll)
+        
+        self.create_totals_tab(totals_tab)
+        self.create_analytics_tab(analytics_tab)
+        
+        def on_close():
+            pager.close()
+            self.executor.cancel("sales_totals")
+            self.executor.cancel("sales_analytics")
+            sales_window.destroy()
+        sales_window.protocol("WM_DELETE_WINDOW", on_close)
+        
+        pager.reset()
+        self.view_totals()
+        
+        # Store the tree reference for filtering
+        self.sales_tree = tree
+
+    def create_totals_tab(self, tab):
+        controls = Frame(tab)
+        controls.pack(fill=X, pady=5)
+        
+        Label(controls, text="Period:").grid(row=0, column=0, padx=5)
+        self.totals_period = ttk.Combobox(controls, values=list(PERIODS), state="readonly", width=10)
+        self.totals_period.set("Day")
+        self.totals_period.grid(row=0, column=1, padx=5)
+        
+        Label(controls, text="Breakdown:").grid(row=0, column=2, padx=5)
+        self.totals_breakdown = ttk.Combobox(controls, values=list(BREAKDOWNS), state="readonly", width=10)
+        self.totals_breakdown.set("All")
+        self.totals_breakdown.grid(row=0, column=3, padx=5)
+        
+        Button(controls, text="Show", command=self.view_totals).grid(row=0, column=4, padx=10)
+        
+        # Totals Treeview
+        self.totals_tree = ttk.Treeview(tab, columns=("Period", "Name", "Sales", "Items", "Revenue"), show="headings")
+        self.totals_tree.heading("Period", text="Period")
+        self.totals_tree.heading("Name", text="Name")
+        self.totals_tree.heading("Sales", text="Sales")
+        self.totals_tree.heading("Items", text="Items")
+        self.totals_tree.heading("Revenue", text="Revenue")
+        self.totals_tree.column("Period", width=100)
+        self.totals_tree.column("Name", width=200)
+        self.totals_tree.column("Sales", width=80)
+        self.totals_tree.column("Items", width=80)
+        self.totals_tree.column("Revenue", width=100)
+        self.totals_tree.pack(fill=BOTH, expand=True)
+
+    def view_totals(self):
+        period = self.totals_period.get()
+        breakdown = self.totals_breakdown.get()
+        from_date = self.from_date.get()
+        to_date = self.to_date.get()
+        
+        def done(rows):
+            self.totals_tree.delete(*self.totals_tree.get_children())
+            for row in rows:
+                self.totals_tree.insert("", END, values=row)
+        
+        # Reads the daily rollups, so the cost does not grow with sales history
+        self.run_db(lambda: self.service.sales_totals(period, breakdown, from_date, to_date), done,
+                    "Failed to load sales totals", key="sales_totals")
+
+    def create_analytics_tab(self, tab):
+        controls = Frame(tab)
+        controls.pack(fill=X, pady=5)
+
+        Label(controls, text="Report:").grid(row=0, column=0, padx=5)
+        self.analytics_report = ttk.Combobox(controls, values=list(ANALYTICS_REPORTS), state="readonly", width=25)
+        self.analytics_report.set(ANALYTICS_REPORTS[0])
+        self.analytics_report.grid(row=0, column=1, padx=5)
+        self.analytics_report.bind("<<ComboboxSelected>>", lambda event: self.view_analytics())
+
+        Button(controls, text="Show", command=self.view_analytics).grid(row=0, column=2, padx=10)
+
+        # Columns change with the report
+        self.analytics_tree = ttk.Treeview(tab, show="headings")
+        self.analytics_tree.pack(fill=BOTH, expand=True)
+        self.analytics_summary = Label(tab, text="", anchor=W)
+        self.analytics_summary.pack(fill=X, pady=(5, 0))
+
+    def view_analytics(self):
+        if self.analytics is None:
+            # numpy is only needed once this tab is used
+            try:
+                from analytics import SalesAnalytics
+            except ImportError:
+                self.analytics_summary.config(text="The analytics reports need numpy (pip install numpy)")
+                return
+            self.analytics = SalesAnalytics(self.service)
+        analytics = self.analytics
+        report = self.analytics_report.get()
+        from_date = self.from_date.get()
+        to_date = self.to_date.get()
+
+        def done(result):
+            headings, rows, summary = result
+            tree = self.analytics_tree
+            tree.delete(*tree.get_children())
+            tree["columns"] = headings
+            for heading in headings:
+                tree.heading(heading, text=heading)
+                tree.column(heading, width=max(40, 600 // len(headings)))
+            for row in rows:
+                tree.insert("", END, values=row)
+            self.analytics_summary.config(text=summary)
+
+        # The first report loads the sales history into memory; later ones
+        # only read sales added since
+        self.run_db(lambda: analytics_report(analytics, report, from_date, to_date), done,
+                    "Failed to load analytics", key="sales_analytics")
 
     def filter_sales(self):
         from_date = self.from_date.get()
         to_date = self.to_date.get()
         
-        try:
-            query = """
-                SELECT s.sale_id, s.sale_date, c.customer_name, sl.seller_name, s.total_amount 
-                FROM Sales s
-                LEFT JOIN Customers c ON s.customer_id = c.customer_id
-                LEFT JOIN Sellers sl ON s.seller_id = sl.seller_id
-                WHERE 1=1
-            """
-            params = []
-            
-            if from_date:
-                query += " AND s.sale_date >= %s"
-                params.append(from_date)
-            if to_date:
-                query += " AND s.sale_date <= %s"
-                params.append(to_date)
-            
-            query += " ORDER BY s.sale_date DESC"
-            
-            self.cursor.execute(query, tuple(params))
-            sales = self.cursor.fetchall()
-            
-            self.sales_tree.delete(*self.sales_tree.get_children())
-            for sale in sales:
-                self.sales_tree.insert("", END, values=sale)
-        except mysql.connector.Error as err:
-            messagebox.showerror("Error", f"Failed to filter sales: {err}")
+        # A second click supersedes any page request still in flight
+        self.sales_pager.reset(from_date, to_date)
+        self.view_totals()
+        if self.analytics is not None:
+            self.view_analytics()
 
     def on_closing(self):
         if messagebox.askokcancel("Quit", "Do you want to quit?"):
-            self.cursor.close()
-            self.db.close()
+            # Give back whatever the open cart is holding
+            session_id = self.cart_session
+            self.executor.submit(lambda: self.service.release_cart(session_id))
+            self.executor.shutdown()
+            if self.flusher is not None:
+                # Whatever is still queued is sent on the next start
+                self.flusher.stop()
             self.root.destroy()
 
 if __name__ == "__main__":
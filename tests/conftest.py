@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import SQLiteBackend  # noqa: E402
+from migrations import migrate  # noqa: E402
+from store_service import StoreService  # noqa: E402
+
+
+@pytest.fixture
+def backend(tmp_path):
+    # A migrated SQLite store of its own per test, with one customer and one
+    # seller and no products yet
+    backend = SQLiteBackend(str(tmp_path / "store.db"))
+    with backend.connection() as db:
+        migrate(db)
+        with db.cursor() as cursor:
+            cursor.execute("INSERT INTO Customers (customer_name, contact_number) VALUES ('Test customer', '555-0100')")
+            cursor.execute("INSERT INTO Sellers (seller_name, contact_number) VALUES ('Test seller', '555-0101')")
+    return backend
+
+
+@pytest.fixture
+def add_product(backend):
+    # add_product(name, price, stock) -> product_id; the stock goes in as a
+    # restock so the ledger matches Inventory
+    service = StoreService(backend)
+
+    def add(name, price, stock):
+        with backend.connection() as db:
+            with db.cursor() as cursor:
+                cursor.execute("INSERT INTO Products (product_name, price) VALUES (%s, %s)", (name, price))
+                product_id = cursor.lastrowid
+        service.restock(product_id, stock)
+        return product_id
+    return add
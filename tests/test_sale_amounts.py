@@ -0,0 +1,96 @@
+import random
+from decimal import Decimal
+
+import pytest
+
+from cart import CENT, Cart, to_money
+from store_service import StoreService, ValidationError, sale_amounts
+
+TAX_RATES = ("0", "0.0725", "0.2", "8.875%", "33%")
+CARTS = 2000
+STORED_CARTS = 50
+CUSTOMER_ID = SELLER_ID = 1
+
+
+def random_price(rng):
+    # Whole cents, with the odd awkward one that rounds badly as a float
+    return rng.choice([Decimal(rng.randint(1, 99999)) / 100, Decimal("0.10"), Decimal("0.29"), Decimal("19.99")])
+
+
+def random_cart(rng, product_ids=None, prices=None):
+    # A cart of 1-8 lines, some of them added twice, with a fixed or a rate
+    # discount or none. Products and their prices are made up unless given.
+    cart = Cart(tax_rate=rng.choice(TAX_RATES))
+    for _ in range(rng.randint(1, 8)):
+        if product_ids:
+            product_id = rng.choice(product_ids)
+            price = prices[product_id]
+        else:
+            product_id = rng.randint(1, 20)
+            price = cart.get(product_id).unit_price if cart.get(product_id) else random_price(rng)
+        cart.add(product_id, f"Product {product_id}", price, rng.randint(1, 12))
+    kind = rng.choice(("none", "amount", "rate"))
+    if kind == "amount":
+        cart.set_discount(amount=to_money(cart.subtotal * Decimal(rng.random())))
+    elif kind == "rate":
+        cart.set_discount(rate=f"{rng.choice([5, 10, 12.5, 33.3, 50, 100])}%")
+    return cart
+
+
+def lines_total(lines):
+    return sum((line.quantity * line.unit_price for line in lines), Decimal("0.00"))
+
+
+def test_cart_totals_add_up_to_the_lines():
+    rng = random.Random(20)
+    for _ in range(CARTS):
+        cart = random_cart(rng)
+        totals = cart.totals
+        lines = cart.sale_lines()
+        assert totals.subtotal == lines_total(lines)
+        assert totals.total - totals.tax + totals.discount == lines_total(lines)
+        assert 0 <= totals.discount <= totals.subtotal
+        for amount in totals:
+            assert amount == amount.quantize(CENT)
+
+        # What create_sale stores for the cart comes out the same
+        discount, tax, total = sale_amounts(lines, totals.discount, totals.tax)
+        assert (discount, tax, total) == (totals.discount, totals.tax, totals.total)
+        assert total - tax + discount == lines_total(lines)
+
+
+def test_discount_larger_than_the_sale_is_refused():
+    cart = Cart()
+    cart.add(1, "Product 1", "4.99", 2)
+    with pytest.raises(ValidationError):
+        sale_amounts(cart.sale_lines(), "10.00", 0)
+
+
+def test_stored_sales_add_up_to_their_items(backend, add_product):
+    rng = random.Random(21)
+    prices = {}
+    for n in range(10):
+        price = random_price(rng)
+        prices[add_product(f"Product {n}", price, 100000)] = price
+    service = StoreService(backend)
+
+    receipts = []
+    for _ in range(STORED_CARTS):
+        cart = random_cart(rng, list(prices), prices)
+        totals = cart.totals
+        receipt = service.create_sale(CUSTOMER_ID, SELLER_ID, cart.sale_lines(),
+                                      discount=totals.discount, tax=totals.tax)
+        assert receipt.total_amount == totals.total
+        receipts.append((receipt.sale_id, totals))
+
+    with backend.connection() as db:
+        with db.cursor() as cursor:
+            for sale_id, totals in receipts:
+                cursor.execute("SELECT total_amount, discount_amount, tax_amount FROM Sales WHERE sale_id = %s",
+                               (sale_id,))
+                total, discount, tax = (to_money(value) for value in cursor.fetchone())
+                cursor.execute("SELECT quantity, unit_price FROM Sale_Items WHERE sale_id = %s", (sale_id,))
+                items = sum((quantity * to_money(unit_price) for quantity, unit_price in cursor.fetchall()),
+                            Decimal("0.00"))
+                assert (total, discount, tax) == (totals.total, totals.discount, totals.tax)
+                assert total - tax + discount == items
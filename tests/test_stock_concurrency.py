@@ -0,0 +1,170 @@
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from ledger import ledger_drift
+from reservations import InsufficientStockError, new_session_id
+from store_service import SaleLine, StoreService
+
+TERMINALS = 8
+STOCK = 10
+PRICE = Decimal("2.50")
+CUSTOMER_ID = SELLER_ID = 1
+
+
+def run_terminals(work, count=TERMINALS):
+    # Runs work(index) on `count` threads at once; a failure in any of them
+    # fails the test
+    with ThreadPoolExecutor(count) as executor:
+        return [future.result() for future in [executor.submit(work, index) for index in range(count)]]
+
+
+class StockWatcher:
+    # Samples Inventory while the terminals run, so stock that dips below 0
+    # and comes back up is caught too
+    def __init__(self, backend, product_ids):
+        self.backend = backend
+        self.product_ids = product_ids
+        self.lowest_quantity = self.lowest_available = None
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.watch)
+
+    def sample(self):
+        placeholders = ", ".join(["%s"] * len(self.product_ids))
+        with self.backend.connection() as db:
+            with db.cursor() as cursor:
+                cursor.execute(f"SELECT MIN(quantity), MIN(quantity - reserved) FROM Inventory "
+                               f"WHERE product_id IN ({placeholders})", self.product_ids)
+                quantity, available = cursor.fetchone()
+        if self.lowest_quantity is None or quantity < self.lowest_quantity:
+            self.lowest_quantity = quantity
+        if self.lowest_available is None or available < self.lowest_available:
+            self.lowest_available = available
+
+    def watch(self):
+        while not self.done.wait(0.001):
+            self.sample()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.done.set()
+        self.thread.join()
+        self.sample()
+
+
+def sell_until_refused(backend, product_ids, index, limit):
+    # One terminal buying a few units at a time until every product is
+    # refused even a single unit. Even terminals hold the units first, like
+    # the till; odd ones sell straight away, like a flushed journal.
+    # Returns the units sold; a terminal stops once it alone has sold more
+    # than there was, so a broken stock guard fails the test instead of
+    # selling forever.
+    service = StoreService(backend, terminal_id=f"test-{index}")
+    rng = random.Random(index)
+    left = list(product_ids)
+    sold = 0
+    while left and sold <= limit:
+        product_id = rng.choice(left)
+        for quantity in (rng.randint(1, 3), 1):
+            session_id = new_session_id() if index % 2 == 0 else None
+            try:
+                if session_id:
+                    service.reserve(session_id, product_id, quantity)
+                service.create_sale(CUSTOMER_ID, SELLER_ID, [SaleLine(product_id, quantity, PRICE)], session_id)
+            except InsufficientStockError:
+                if session_id:
+                    service.release_cart(session_id)
+            else:
+                sold += quantity
+                break
+        else:
+            left.remove(product_id)
+    return sold
+
+
+def stock_levels(backend, product_ids):
+    placeholders = ", ".join(["%s"] * len(product_ids))
+    with backend.connection() as db:
+        with db.cursor() as cursor:
+            cursor.execute(f"SELECT product_id, quantity, reserved FROM Inventory WHERE product_id IN ({placeholders})",
+                           product_ids)
+            levels = {product_id: (quantity, reserved) for product_id, quantity, reserved in cursor.fetchall()}
+            cursor.execute(f"SELECT COALESCE(SUM(quantity), 0) FROM Sale_Items WHERE product_id IN ({placeholders})",
+                           product_ids)
+            items = cursor.fetchone()[0]
+            drift = ledger_drift(cursor)
+    return levels, items, drift
+
+
+def test_terminals_sell_exactly_the_stock(backend, add_product):
+    product_ids = [add_product(f"Scarce {n}", PRICE, STOCK) for n in range(2)]
+
+    with StockWatcher(backend, product_ids) as watcher:
+        sold = run_terminals(lambda index: sell_until_refused(backend, product_ids, index, STOCK * len(product_ids)))
+
+    levels, items, drift = stock_levels(backend, product_ids)
+    assert sum(sold) == STOCK * len(product_ids)
+    assert items == STOCK * len(product_ids)
+    assert all(quantity == 0 and reserved == 0 for quantity, reserved in levels.values())
+    assert watcher.lowest_quantity >= 0
+    assert watcher.lowest_available >= 0
+    assert drift == []
+
+
+def test_concurrent_restocks_add_up(backend, add_product):
+    product_ids = [add_product(f"Restocked {n}", PRICE, STOCK) for n in range(3)]
+    service = StoreService(backend)
+
+    def clerk(index):
+        rng = random.Random(index)
+        added = {product_id: 0 for product_id in product_ids}
+        for _ in range(25):
+            product_id = rng.choice(product_ids)
+            quantity = rng.randint(1, 20)
+            service.restock(product_id, quantity)
+            added[product_id] += quantity
+        return added
+
+    added = run_terminals(clerk)
+
+    levels, _, drift = stock_levels(backend, product_ids)
+    for product_id in product_ids:
+        assert levels[product_id][0] == STOCK + sum(clerk_added[product_id] for clerk_added in added)
+    assert drift == []
+
+
+def test_sales_and_restocks_together(backend, add_product):
+    # Half the threads sell, half restock: every unit that came in is either
+    # sold or still on the shelf, and stock never goes below 0
+    product_ids = [add_product(f"Busy {n}", PRICE, STOCK) for n in range(2)]
+    service = StoreService(backend)
+
+    def work(index):
+        if index % 2:
+            # Sellers 1, 5, ... hold their units first, 3, 7, ... do not
+            return 0, sell_until_refused(backend, product_ids, index // 2, STOCK * len(product_ids) + 30 * TERMINALS)
+        rng = random.Random(index)
+        restocked = 0
+        for _ in range(10):
+            quantity = rng.randint(1, 3)
+            service.restock(rng.choice(product_ids), quantity)
+            restocked += quantity
+        return restocked, 0
+
+    with StockWatcher(backend, product_ids) as watcher:
+        results = run_terminals(work)
+
+    restocked = sum(restocked for restocked, _ in results)
+    sold = sum(sold for _, sold in results)
+    levels, items, drift = stock_levels(backend, product_ids)
+    left = sum(quantity for quantity, _ in levels.values())
+    assert sold == items
+    assert sold + left == STOCK * len(product_ids) + restocked
+    assert all(reserved == 0 for _, reserved in levels.values())
+    assert watcher.lowest_quantity >= 0
+    assert watcher.lowest_available >= 0
+    assert drift == []